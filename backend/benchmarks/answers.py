@@ -0,0 +1,70 @@
+""" Answer check benchmark.
+description: Times flaskr.answers.answer_matches() on synthetic answers of
+    several lengths, for exact guesses, guesses with as many typos as the
+    answer allows (the worst case, the banded edit distance runs to the
+    end) and wrong guesses, which it mostly stops early on. A check of an
+    answer of up to 10 words should take well under a millisecond.
+
+    python -m benchmarks.answers
+    python -m benchmarks.answers --words 1 5 20 --repeat 10000
+"""
+import argparse
+import random
+
+from .common import sentence, summary, timed
+
+
+def with_typos(rng, text, typos):
+    """ text with typos of its letters replaced by another letter. """
+    chars = list(text)
+    letters = [i for i, char in enumerate(chars) if char.isalpha()]
+    for i in rng.sample(letters, min(typos, len(letters))):
+        chars[i] = 'x' if chars[i] != 'x' else 'y'
+    return ''.join(chars)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--words', type=int, nargs='+',
+                        default=[1, 3, 10, 30])
+    parser.add_argument('--answers', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    from flaskr.answers import allowed_edits, answer_matches, normalize_answer
+
+    rng = random.Random(0)
+    print('{0:>6} {1:>6} {2:>8} {3:>10} {4:>10}'.format(
+        'words', 'chars', 'guess', 'mean us', 'p95 us'))
+    for words in args.words:
+        answers = [
+            normalize_answer(sentence(rng, words))
+            for _ in range(args.answers)
+        ]
+        guesses = {
+            'exact': answers,
+            'typos': [
+                with_typos(rng, answer, allowed_edits(answer))
+                for answer in answers
+            ],
+            'wrong': [
+                normalize_answer(sentence(rng, words)) for _ in answers
+            ],
+        }
+        chars = sum(len(answer) for answer in answers) // len(answers)
+        for name, batch in guesses.items():
+            pairs = list(zip(batch, answers))
+
+            def check():
+                for guess, answer in pairs:
+                    answer_matches(guess, answer)
+
+            # timed() gives ms per batch, ms * 1000 / answers is us each
+            stats = summary(timed(check, args.repeat))
+            print('{0:>6} {1:>6} {2:>8} {3:>10.2f} {4:>10.2f}'.format(
+                words, chars, name, stats['mean'] * 1000 / len(pairs),
+                stats['p95'] * 1000 / len(pairs)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+""" Sync vs async quiz players benchmark.
+description: Runs the app in a server process, either the Flask app on a
+    threaded werkzeug server (one thread per connection) or the ASGI entry
+    point on uvicorn, and plays quiz sessions against it from an asyncio
+    client: every player keeps one connection open, starts a session,
+    asks for --steps questions and ends the session. Reports latency
+    percentiles and requests per second for each number of simultaneous
+    players.
+
+    python -m benchmarks.async_quiz
+    python -m benchmarks.async_quiz --players 100 1000 5000 \
+        --database-url postgresql://postgres@localhost:5432/trivia_bench
+
+    Needs the packages of requirements-asgi.txt. With sqlite, or without
+    asyncpg, the async server reads questions on its thread pool.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+from .common import CATEGORIES, make_app, seed, summary
+
+
+def serve(mode, port):
+    """ Runs the server of mode ('sync' or 'async') until killed. """
+    if mode == 'sync':
+        from werkzeug.serving import (
+            ThreadedWSGIServer, WSGIRequestHandler, make_server
+        )
+        from flaskr import create_app
+
+        class KeepAliveHandler(WSGIRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_request(self, *args, **kwargs):
+                pass
+
+        # Same listen backlog as uvicorn below, instead of werkzeug's 128
+        ThreadedWSGIServer.request_queue_size = 4096
+        server = make_server('127.0.0.1', port, create_app(), threaded=True,
+                             request_handler=KeepAliveHandler)
+        print('ready', flush=True)
+        server.serve_forever()
+    else:
+        import uvicorn
+        from flaskr.asgi import create_asgi_app
+        app = create_asgi_app()
+        print('ready ({0} driver)'.format(app.database.name), flush=True)
+        uvicorn.Server(uvicorn.Config(
+            app, host='127.0.0.1', port=port, log_level='warning',
+            backlog=4096
+        )).run()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+class Connection(object):
+    """ Minimal keep-alive HTTP/1.1 client for JSON requests. """
+
+    def __init__(self, port):
+        self.port = port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(
+                '127.0.0.1', self.port
+            )
+        data = b'' if body is None else json.dumps(body).encode('utf-8')
+        self.writer.write((
+            '{0} {1} HTTP/1.1\r\nHost: localhost\r\n'
+            'Content-Type: application/json\r\nContent-Length: {2}\r\n\r\n'
+        ).format(method, path, len(data)).encode('latin-1') + data)
+        head = await self.reader.readuntil(b'\r\n\r\n')
+        lines = head.decode('latin-1').split('\r\n')
+        status = int(lines[0].split()[1])
+        headers = dict(
+            line.lower().split(': ', 1) for line in lines[1:] if line
+        )
+        payload = await self.reader.readexactly(
+            int(headers.get('content-length', 0))
+        )
+        if headers.get('connection') == 'close':
+            self.close()
+        return status, payload
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+
+async def play(port, steps, delay, samples, errors):
+    await asyncio.sleep(delay)
+    connection = Connection(port)
+
+    async def send(method, path, body=None):
+        start = time.perf_counter()
+        status, payload = await connection.request(method, path, body)
+        samples.append((time.perf_counter() - start) * 1000)
+        if status != 200:
+            errors.append(status)
+        return payload
+
+    try:
+        session = json.loads(await send('POST', '/quizzes/sessions', {
+            'quiz_category': {'id': random.randint(0, len(CATEGORIES))}
+        }))['session']
+        for _ in range(steps):
+            await send('POST', '/quizzes/sessions/' + session)
+        await send('DELETE', '/quizzes/sessions/' + session)
+    except (OSError, asyncio.IncompleteReadError, ValueError, KeyError) \
+            as error:
+        errors.append(type(error).__name__)
+    finally:
+        connection.close()
+
+
+async def run_players(port, players, steps, ramp):
+    samples = []
+    errors = []
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        play(port, steps, ramp * index / players, samples, errors)
+        for index in range(players)
+    ))
+    elapsed = time.perf_counter() - start
+    samples.sort()
+    result = summary(samples) if samples else {}
+    result.update({
+        'requests': len(samples),
+        'throughput': len(samples) / elapsed,
+        'errors': len(errors),
+        'error_types': sorted(set(str(error) for error in errors)),
+    })
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--serve', choices=['sync', 'async'],
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--size', type=int, default=10000)
+    parser.add_argument('--database-url', default=None)
+    parser.add_argument('--players', type=int, nargs='+',
+                        default=[100, 1000, 5000])
+    parser.add_argument('--steps', type=int, default=10,
+                        help='questions asked by every player')
+    parser.add_argument('--ramp', type=float, default=1.0,
+                        help='seconds over which the players connect')
+    parser.add_argument('--modes', nargs='+', choices=['sync', 'async'],
+                        default=['sync', 'async'])
+    parser.add_argument('--output', default=None,
+                        help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve(args.serve, args.port)
+
+    app = make_app(args.database_url)
+    with app.app_context():
+        seed(args.size)
+
+    results = {}
+    header = '{0:>6} {1:>8} {2:>9} {3:>9} {4:>9} {5:>9} {6:>7}'.format(
+        'mode', 'players', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'errors')
+    for mode in args.modes:
+        port = free_port()
+        # Slow query warnings of the server would flood the report
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'benchmarks.async_quiz', '--serve', mode,
+             '--port', str(port)],
+            env=dict(os.environ, SLOW_QUERY_MS=''), stdout=subprocess.PIPE
+        )
+        try:
+            print(mode, server.stdout.readline().decode().strip())
+            wait_for_port(port)
+            # loads the question pool before the clock starts
+            asyncio.run(run_players(port, 1, args.steps, 0))
+            print(header)
+            for players in args.players:
+                result = asyncio.run(
+                    run_players(port, players, args.steps, args.ramp)
+                )
+                results['{0}/{1}'.format(mode, players)] = result
+                print('{0:>6} {1:>8} {2:>9.2f} {3:>9.2f} {4:>9.2f} {5:>9.0f} '
+                      '{6:>7}'.format(
+                          mode, players, result.get('p50', 0),
+                          result.get('p95', 0), result.get('p99', 0),
+                          result['throughput'], result['errors']),
+                      ' '.join(result['error_types']))
+        finally:
+            server.terminate()
+            server.wait()
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+""" Bulk question import and export benchmark.
+description: Throughput in rows per second of import_questions with COPY
+    (PostgreSQL only) and executemany, for JSON Lines and CSV input,
+    against one Question.insert() per row, and of export_questions.
+
+    python -m benchmarks.bulk_import
+    python -m benchmarks.bulk_import --rows 100000 \
+        --database-url postgresql://postgres@localhost:5432/trivia_bench
+"""
+import argparse
+import csv
+import io
+import json
+import random
+import time
+
+from .common import CATEGORIES, make_app, seed, sentence
+
+
+def synthetic_rows(count):
+    rng = random.Random(count)
+    return [{
+        'question': 'Which {0}?'.format(sentence(rng, 8)),
+        'answer': sentence(rng, 2),
+        'category': rng.randint(1, len(CATEGORIES)),
+        'difficulty': rng.randint(1, 5),
+    } for _ in range(count)]
+
+
+def as_jsonl(rows):
+    return [json.dumps(row) + '\n' for row in rows]
+
+
+def as_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, ['question', 'answer', 'category',
+                                     'difficulty'])
+    writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue().splitlines(True)
+
+
+def report(name, rows, seconds):
+    print('{0:>28} {1:>9} {2:>10.2f} {3:>12,.0f}'.format(
+        name, rows, seconds, rows / seconds))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--single-rows', type=int, default=1000,
+                        help='rows inserted one by one for the baseline')
+    parser.add_argument('--database-url', default=None)
+    args = parser.parse_args()
+
+    app = make_app(args.database_url)
+    from models import db, Question
+    from flaskr.bulk import export_questions, import_questions
+
+    methods = ['executemany']
+    if db.engine.dialect.name == 'postgresql':
+        methods.insert(0, 'copy')
+    rows = synthetic_rows(args.rows)
+    categories = set(range(1, len(CATEGORIES) + 1))
+
+    print('{0:>28} {1:>9} {2:>10} {3:>12}'.format(
+        'run', 'rows', 'seconds', 'rows/s'))
+    with app.app_context():
+        seed(0)
+        start = time.perf_counter()
+        for row in rows[:args.single_rows]:
+            Question(**row).insert()
+        report('Question.insert() per row', args.single_rows,
+               time.perf_counter() - start)
+
+        for file_format, lines in (('jsonl', as_jsonl(rows)),
+                                   ('csv', as_csv(rows))):
+            for method in methods:
+                seed(0)
+                start = time.perf_counter()
+                result = import_questions(lines, file_format, categories,
+                                          method=method)
+                report('import {0} {1}'.format(file_format, method),
+                       result['inserted'], time.perf_counter() - start)
+
+        for file_format in ('jsonl', 'csv'):
+            start = time.perf_counter()
+            for _ in export_questions(file_format):
+                pass
+            report('export {0}'.format(file_format), args.rows,
+                   time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    main()
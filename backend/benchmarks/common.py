@@ -0,0 +1,107 @@
+import os
+import random
+import tempfile
+import time
+
+os.environ.setdefault('QUESTIONS_PER_PAGE', '10')
+
+CATEGORIES = ['Science', 'Art', 'Geography', 'History', 'Entertainment',
+              'Sports']
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'ze', 'qua',
+             'bri', 'dor', 'fen', 'gal', 'hum', 'jor', 'pel', 'tas']
+
+
+def vocabulary(size=5000, seed=0, syllables=SYLLABLES):
+    """ Deterministic list of distinct pseudo-words. """
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        words.add(''.join(
+            rng.choice(syllables) for _ in range(rng.randint(2, 4))
+        ))
+    return sorted(words)
+
+
+WORDS = vocabulary()
+# Words of random letters. The words of WORDS share their few syllables, so
+# any two questions have many 4 character substrings in common, which real
+# questions don't: these are closer to them for the duplicate detection.
+LETTER_WORDS = vocabulary(syllables=[
+    first + second for first in 'abcdefghijklmnopqrstuvwxyz'
+    for second in 'abcdefghijklmnopqrstuvwxyz'
+])
+# Zipf-like weights: a few words are very common, most are rare
+WEIGHTS = [1.0 / rank for rank in range(1, len(WORDS) + 1)]
+
+
+def sentence(rng, length, words=WORDS):
+    return ' '.join(rng.choices(words, WEIGHTS, k=length))
+
+
+def make_app(database_url=None):
+    """ Builds the trivia app against database_url, or against a new sqlite
+        file in the temp dir when no url is given.
+    """
+    if database_url is None:
+        handle, path = tempfile.mkstemp(suffix='.db', prefix='trivia_bench_')
+        os.close(handle)
+        database_url = 'sqlite:///' + path
+    os.environ['SQLALCHEMY_DATABASE_URI'] = database_url
+
+    from flaskr import create_app
+    from flaskr.migrate import upgrade
+    app = create_app()
+    with app.app_context():
+        upgrade()
+    return app
+
+
+def seed(size, batch_size=10000, words=WORDS):
+    """ Empties the questions and categories tables and inserts size
+        synthetic questions, made of words, spread across the default
+        categories. The questions are not signed (see flaskr.duplicates).
+    """
+    from models import db, Question, QuestionSignature, Category
+    db.session.execute(QuestionSignature.__table__.delete())
+    db.session.execute(Question.__table__.delete())
+    db.session.execute(Category.__table__.delete())
+    db.session.execute(Category.__table__.insert(), [
+        {'id': i, 'type': name} for i, name in enumerate(CATEGORIES, 1)
+    ])
+    rng = random.Random(size)
+    for start in range(1, size + 1, batch_size):
+        stop = min(start + batch_size, size + 1)
+        db.session.execute(Question.__table__.insert(), [{
+            'id': i,
+            'question': 'Which {0}?'.format(sentence(rng, 8, words)),
+            'answer': sentence(rng, 2, words),
+            'category': rng.randint(1, len(CATEGORIES)),
+            'difficulty': rng.randint(1, 5),
+        } for i in range(start, stop)])
+    db.session.commit()
+
+
+def timed(fn, repeat):
+    """ Calls fn repeat times, returns the sorted latencies in ms. """
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return samples
+
+
+def percentile(samples, fraction):
+    """ Nearest-rank percentile of sorted samples. """
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def summary(samples):
+    return {
+        'mean': sum(samples) / len(samples),
+        'p50': percentile(samples, 0.5),
+        'p95': percentile(samples, 0.95),
+        'p99': percentile(samples, 0.99),
+    }
@@ -0,0 +1,146 @@
+""" Duplicate detection benchmark.
+description: What duplicate detection costs: fingerprints per second,
+    signing a table written before the signatures existed (flask migrate),
+    the duplicate lookup of one new question against a full scan of the
+    table, and the duplicate report (flask dedup-report) time, peak Python
+    memory and recall of typo'd copies injected in the table.
+
+    The questions are made of words of random letters by default;
+    --corpus syllables uses the words of the other benchmarks, the worst
+    case: their questions share many 4 character substrings, so the LSH
+    buckets are crowded.
+
+    python -m benchmarks.duplicates
+    python -m benchmarks.duplicates --sizes 100000 1000000 \
+        --database-url postgresql://postgres@localhost:5432/trivia_bench
+"""
+import argparse
+import random
+import time
+import tracemalloc
+
+from .common import (
+    LETTER_WORDS, WORDS, make_app, seed, sentence, summary, timed
+)
+
+
+def typo(rng, text):
+    """ text with two adjacent letters of its longest word swapped. """
+    words = text.split()
+    position = max(range(len(words)), key=lambda index: len(words[index]))
+    word = words[position]
+    letter = rng.randrange(1, len(word) - 2)
+    words[position] = (word[:letter] + word[letter + 1] + word[letter]
+                       + word[letter + 2:])
+    return ' '.join(words)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000])
+    parser.add_argument('--database-url', default=None)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--copies', type=int, default=200)
+    parser.add_argument('--corpus', choices=('letters', 'syllables'),
+                        default='letters')
+    args = parser.parse_args()
+
+    words = LETTER_WORDS if args.corpus == 'letters' else WORDS
+
+    app = make_app(args.database_url)
+    from models import db, Question
+    from flaskr.bulk import insert_questions
+    from flaskr.migrate import upgrade
+    from flaskr.duplicates import (
+        SIMILARITY, duplicate_clusters, find_duplicates, fingerprint,
+        sign_missing_questions, similarity
+    )
+
+    print('{0:>9} {1:>18} {2:>10} {3:>10} {4:>10}'.format(
+        'rows', 'step', 'mean ms', 'p95 ms', 'p99 ms'))
+    with app.app_context():
+        upgrade()
+        for size in args.sizes:
+            seed(size, words=words)
+            rng = random.Random(size)
+
+            def line(step, milliseconds, note=''):
+                print('{0:>9} {1:>18} {2:>10.3f} {3}'.format(
+                    size, step, milliseconds, note))
+
+            start = time.perf_counter()
+            signed = sign_missing_questions(batch_size=5000)
+            elapsed = time.perf_counter() - start
+            line('sign table', elapsed * 1000,
+                 '  {0:.0f} questions/s'.format(signed / elapsed))
+
+            texts = ['Which {0}?'.format(sentence(rng, 8, words))
+                     for _ in range(10000)]
+            start = time.perf_counter()
+            for text in texts:
+                fingerprint(text)
+            line('fingerprint', (time.perf_counter() - start) * 1000
+                 / len(texts))
+
+            # Typo'd copies of random questions, written like the routes do
+            originals = db.session.query(Question.id, Question.question) \
+                .filter(Question.id.in_(
+                    rng.sample(range(1, size + 1), args.copies)
+                )).all()
+            copies = insert_questions([
+                {'question': typo(rng, question), 'answer': 'copy',
+                 'category': 1, 'difficulty': 1}
+                for _, question in originals
+            ])
+            db.session.commit()
+            # The copies the threshold calls duplicates, that recall counts
+            expected = set(
+                tuple(sorted((question_id, row['id'])))
+                for (question_id, question), row in zip(originals, copies)
+                if similarity(fingerprint(question),
+                              fingerprint(row['question'])) >= SIMILARITY
+            )
+
+            new = [fingerprint(typo(rng, 'Which {0}?'.format(
+                sentence(rng, 8, words)))) for _ in range(args.repeat)]
+            samples = []
+            for item in new:
+                samples += timed(lambda: find_duplicates([item]), 1)
+            stats = summary(sorted(samples))
+            print('{0:>9} {1:>18} {2:>10.3f} {3:>10.3f} {4:>10.3f}'.format(
+                size, 'lookup', stats['mean'], stats['p95'], stats['p99']))
+
+            def full_scan(item):
+                return [
+                    question_id for question_id, question
+                    in db.session.query(Question.id, Question.question)
+                    if similarity(item, fingerprint(question)) >= SIMILARITY
+                ]
+
+            start = time.perf_counter()
+            full_scan(new[0])
+            line('full scan', (time.perf_counter() - start) * 1000)
+
+            report = {}
+            start = time.perf_counter()
+            clusters = list(duplicate_clusters(stats=report))
+            elapsed = time.perf_counter() - start
+            tracemalloc.start()
+            list(duplicate_clusters())
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            found = set()
+            for cluster in clusters:
+                found.update(
+                    (first, second) for index, first in enumerate(cluster)
+                    for second in cluster[index + 1:]
+                )
+            line('dedup report', elapsed * 1000,
+                 '  {0} pairs compared, {1:.1f} MB peak, recall {2}/{3}'
+                 .format(report['compared'], peak / 1024 ** 2,
+                         len(expected & found), len(expected)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,314 @@
+""" Endpoint load test.
+description: Seeds a synthetic bank and drives the trivia endpoints, first
+    through the Flask test client (one client, no network) and then through
+    a real WSGI server (werkzeug, threaded) with concurrent HTTP clients.
+    Reports p50/p95/p99 latency and throughput per scenario and saves them
+    as JSON; --compare prints the change against a previous results file
+    and exits with status 1 on a regression.
+
+    python -m benchmarks.load --size 100000 --output before.json
+    python -m benchmarks.load --size 100000 --output after.json \
+        --compare before.json
+    python -m benchmarks.load --size 1000000 --concurrency 16 \
+        --database-url postgresql://postgres@localhost:5432/trivia_bench
+"""
+import argparse
+import json
+import logging
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from .common import CATEGORIES, WEIGHTS, WORDS, make_app, seed, summary
+
+QUIZ_STEPS = 5
+
+
+class TestClientDriver(object):
+    """ Sends requests through the Flask test client. """
+    name = 'client'
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None):
+        res = self.client.open(path, method=method, json=body)
+        return res.status_code, res.data
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class ServerDriver(object):
+    """ Sends HTTP requests to a werkzeug server running app in a thread.
+    """
+    name = 'server'
+
+    def __init__(self, app):
+        self.server = make_server('127.0.0.1', 0, app, threaded=True,
+                                  request_handler=QuietRequestHandler)
+        self.base_url = 'http://127.0.0.1:{0}'.format(
+            self.server.server_address[1]
+        )
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def request(self, method, path, body=None):
+        data = None if body is None else json.dumps(body).encode('utf-8')
+        req = urllib.request.Request(
+            self.base_url + path, data=data, method=method,
+            headers={'Content-Type': 'application/json'}
+        )
+        try:
+            with urllib.request.urlopen(req) as res:
+                return res.status, res.read()
+        except urllib.error.HTTPError as error:
+            return error.code, error.read()
+
+    def close(self):
+        self.server.shutdown()
+        self.thread.join()
+
+
+# Scenarios run one unit of work with send(method, path, body), which
+# times every request. size is the number of seeded questions.
+
+def list_questions(send, rng, size, max_page):
+    send('GET', '/questions?page={0}'.format(rng.randint(1, max_page)))
+
+
+def list_questions_cursor(send, rng, size, max_page):
+    send('GET', '/questions?after={0}&limit=10'.format(rng.randint(0, size)))
+
+
+def search(send, rng, size, max_page):
+    word = rng.choices(WORDS, WEIGHTS)[0]
+    send('GET', '/questions?question={0}'.format(word[:rng.randint(3, 6)]))
+
+
+def category_questions(send, rng, size, max_page):
+    send('GET', '/categories/{0}/questions?page={1}'.format(
+        rng.randint(1, len(CATEGORIES)), rng.randint(1, max_page)))
+
+
+def quiz(send, rng, size, max_page):
+    body = {
+        'quiz_category': {'id': rng.randint(0, len(CATEGORIES))},
+        'previous_questions': [],
+    }
+    for _ in range(QUIZ_STEPS):
+        question = json.loads(send('POST', '/quizzes', body))['question']
+        if not question:
+            break
+        body['previous_questions'].append(question['id'])
+
+
+def quiz_session(send, rng, size, max_page):
+    token = json.loads(send('POST', '/quizzes/sessions', {
+        'quiz_category': {'id': rng.randint(0, len(CATEGORIES))}
+    }))['session']
+    for _ in range(QUIZ_STEPS):
+        send('POST', '/quizzes/sessions/{0}'.format(token))
+    send('DELETE', '/quizzes/sessions/{0}'.format(token))
+
+
+def record_score(send, rng, size, max_page):
+    total = QUIZ_STEPS
+    send('POST', '/scores', {
+        'player': 'player{0}'.format(rng.randint(1, 10000)),
+        'quiz_category': {'id': rng.randint(0, len(CATEGORIES))},
+        'score': rng.randint(0, total),
+        'total': total,
+    })
+
+
+def leaderboard(send, rng, size, max_page):
+    send('GET', '/leaderboard?category={0}'.format(
+        rng.randint(0, len(CATEGORIES))))
+
+
+SCENARIOS = {
+    'questions': list_questions,
+    'questions_cursor': list_questions_cursor,
+    'search': search,
+    'category_questions': category_questions,
+    'quiz': quiz,
+    'quiz_session': quiz_session,
+    'score': record_score,
+    'leaderboard': leaderboard,
+}
+
+
+def run(driver, scenario, units, concurrency, size, max_page, warmup,
+        seed_value=0):
+    """ Runs units of scenario on concurrency threads and returns its
+        latency summary in ms, throughput and response counts by status.
+    """
+    samples = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def send(method, path, body=None):
+        start = time.perf_counter()
+        status, data = driver.request(method, path, body)
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            samples.append(elapsed)
+            statuses[status] = statuses.get(status, 0) + 1
+        return data
+
+    warmup_rng = random.Random(seed_value - 1)
+    for _ in range(warmup):
+        scenario(lambda *args: driver.request(*args)[1], warmup_rng, size,
+                 max_page)
+
+    def worker(index):
+        rng = random.Random(seed_value * 1000 + index)
+        for _ in range(units // concurrency
+                       + (1 if index < units % concurrency else 0)):
+            scenario(send, rng, size, max_page)
+
+    start = time.perf_counter()
+    if concurrency == 1:
+        worker(0)
+    else:
+        with ThreadPoolExecutor(concurrency) as executor:
+            list(executor.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    samples.sort()
+    result = summary(samples)
+    result.update({
+        'requests': len(samples),
+        'throughput': len(samples) / elapsed,
+        'statuses': {str(status): count
+                     for status, count in sorted(statuses.items())},
+        'errors': sum(count for status, count in statuses.items()
+                      if status >= 500),
+    })
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL
+        ).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance):
+    """ Prints the p95 and throughput change of every run also found in
+        baseline. Returns True if any got worse by more than tolerance.
+    """
+    regressed = False
+    print('\n{0:>7} {1:>19} {2:>13} {3:>13} {4:>9} {5:>10}'.format(
+        'driver', 'scenario', 'base p95 ms', 'p95 ms', 'p95', 'req/s'))
+    for driver, runs in sorted(results['runs'].items()):
+        for name, result in sorted(runs.items()):
+            base = baseline.get('runs', {}).get(driver, {}).get(name)
+            if base is None:
+                continue
+            p95_change = result['p95'] / base['p95'] - 1
+            throughput_change = result['throughput'] / base['throughput'] - 1
+            worse = p95_change > tolerance or throughput_change < -tolerance
+            regressed = regressed or worse
+            print('{0:>7} {1:>19} {2:>13.3f} {3:>13.3f} {4:>+8.0%} '
+                  '{5:>+9.0%}{6}'.format(
+                      driver, name, base['p95'], result['p95'], p95_change,
+                      throughput_change, '  REGRESSION' if worse else ''))
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size', type=int, default=10000)
+    parser.add_argument('--database-url', default=None)
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS),
+                        default=sorted(SCENARIOS))
+    parser.add_argument('--drivers', nargs='+', choices=['client', 'server'],
+                        default=['client', 'server'])
+    parser.add_argument('--units', type=int, default=500,
+                        help='units of work per scenario, a quiz unit '
+                             'makes several requests')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='concurrent clients of the WSGI server')
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--max-page', type=int, default=100,
+                        help='pages are picked at random up to this one')
+    parser.add_argument('--output', default=None,
+                        help='write the results to this JSON file')
+    parser.add_argument('--compare', default=None,
+                        help='JSON results of a previous run')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='p95 or throughput change flagged as a '
+                             'regression')
+    args = parser.parse_args()
+
+    # Big banks make slow queries on purpose, keep the report readable
+    logging.getLogger('flaskr.metrics').setLevel(logging.ERROR)
+    app = make_app(args.database_url)
+    with app.app_context():
+        seed(args.size)
+        from models import db
+        dialect = db.engine.dialect.name
+
+    results = {
+        'commit': git_commit(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'database': dialect,
+        'size': args.size,
+        'units': args.units,
+        'concurrency': args.concurrency,
+        'runs': {},
+    }
+    print('{0:>7} {1:>19} {2:>8} {3:>9} {4:>9} {5:>9} {6:>9} {7:>6}'.format(
+        'driver', 'scenario', 'requests', 'p50 ms', 'p95 ms', 'p99 ms',
+        'req/s', 'errors'))
+    for driver_name in args.drivers:
+        if driver_name == 'client':
+            driver, concurrency = TestClientDriver(app), 1
+        else:
+            driver, concurrency = ServerDriver(app), args.concurrency
+        runs = results['runs'][driver_name] = {}
+        try:
+            for number, name in enumerate(args.scenarios):
+                result = runs[name] = run(
+                    driver, SCENARIOS[name], args.units, concurrency,
+                    args.size, args.max_page, args.warmup, number
+                )
+                print('{0:>7} {1:>19} {2:>8} {3:>9.3f} {4:>9.3f} {5:>9.3f} '
+                      '{6:>9.0f} {7:>6}'.format(
+                          driver_name, name, result['requests'],
+                          result['p50'], result['p95'], result['p99'],
+                          result['throughput'], result['errors']))
+        finally:
+            if driver_name == 'server':
+                driver.close()
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+""" Request metrics overhead benchmark.
+description: Runs the hooks flaskr.metrics.Metrics adds to every request
+    (request_started, statement_executed for each SQL statement,
+    response_ready and request_finished) without the request itself, for
+    requests of several statement counts, and the time to render /metrics.
+    A request with five statements should cost well under 50 us.
+
+    python -m benchmarks.metrics
+    python -m benchmarks.metrics --statements 0 5 50 --requests 100000
+"""
+import argparse
+
+from .common import make_app, summary, timed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--statements', type=int, nargs='+',
+                        default=[0, 5, 20])
+    parser.add_argument('--requests', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    app = make_app()
+    from flaskr.metrics import Metrics
+
+    response = app.response_class('')
+    print('{0:>10} {1:>12} {2:>12}'.format(
+        'statements', 'mean us', 'p95 us'))
+    with app.test_request_context('/questions'):
+        for statements in args.statements:
+            metrics = Metrics()
+
+            def request():
+                metrics.request_started()
+                for _ in range(statements):
+                    metrics.statement_executed('SELECT 1', 0.0001)
+                metrics.response_ready(response)
+                metrics.request_finished()
+
+            def batch():
+                for _ in range(args.requests):
+                    request()
+
+            # timed() gives ms per batch, ms * 1000 / requests is us each
+            stats = summary(timed(batch, args.repeat))
+            print('{0:>10} {1:>12.2f} {2:>12.2f}'.format(
+                statements, stats['mean'] * 1000 / args.requests,
+                stats['p95'] * 1000 / args.requests))
+        stats = summary(timed(metrics.render, args.repeat))
+        print('/metrics rendered in {0:.3f} ms (p95 {1:.3f} ms)'.format(
+            stats['mean'], stats['p95']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+""" Question listing pagination benchmark.
+description: Latency of the first and a deep page of GET /questions with
+    the old paginate() call (COUNT(*) + OFFSET), the page= mode with
+    OFFSET, the page= mode seeking to the first id of the page found in
+    the question index, and the cursor mode (after=, seeks on the primary
+    key).
+
+    python -m benchmarks.pagination
+    python -m benchmarks.pagination --size 1000000 --pages 1 5000 50000 \
+        --database-url postgresql://postgres@localhost:5432/trivia_bench
+"""
+import argparse
+
+from .common import make_app, seed, summary, timed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size', type=int, default=100000)
+    parser.add_argument('--pages', type=int, nargs='+', default=[1, 5000])
+    parser.add_argument('--per-page', type=int, default=10)
+    parser.add_argument('--database-url', default=None)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    app = make_app(args.database_url)
+    from models import Question
+    from flaskr.pagination import keyset_page, offset_page, seek_page
+    from flaskr.question_pool import QuestionPool
+
+    per_page = args.per_page
+    print('{0:>9} {1:>7} {2:>22} {3:>10} {4:>10}'.format(
+        'rows', 'page', 'mode', 'mean ms', 'p95 ms'))
+    with app.app_context():
+        seed(args.size)
+        pool = QuestionPool()
+        pool.load()
+        for page in args.pages:
+            # seeded ids are 1..size, so page p starts after this id
+            after = (page - 1) * per_page
+            runs = [
+                ('paginate (old)', lambda: Question.query.paginate(
+                    page, per_page, False).items),
+                ('page= (offset)', lambda: (offset_page(
+                    Question.query, Question.id, page, per_page),
+                    pool.count())),
+                ('page= (index seek)', lambda: (seek_page(
+                    Question.query, Question.id,
+                    pool.id_at(pool.ALL, (page - 1) * per_page), per_page),
+                    pool.count())),
+                ('after= (keyset)', lambda: (keyset_page(
+                    Question.query, Question.id, after, per_page),
+                    pool.count())),
+            ]
+            for name, fn in runs:
+                stats = summary(timed(fn, args.repeat))
+                print('{0:>9} {1:>7} {2:>22} {3:>10.3f} {4:>10.3f}'.format(
+                    args.size, page, name, stats['mean'], stats['p95']))
+
+
+if __name__ == '__main__':
+    main()
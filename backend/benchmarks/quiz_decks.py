@@ -0,0 +1,84 @@
+""" Quiz deck benchmark.
+description: What precomputed decks (QUIZ_DECKS) save a quiz session and
+    cost the process: starting a session and drawing its first questions
+    from a copy of the pool ids shuffled as it goes, against a copy of a
+    shuffled deck; the time and memory to build the decks; and the session
+    start latency while the decks are being built in the background.
+
+    python -m benchmarks.quiz_decks
+    python -m benchmarks.quiz_decks --sizes 100000 1000000 \
+        --database-url postgresql://postgres@localhost:5432/trivia_bench
+"""
+import argparse
+import threading
+
+from .common import make_app, seed, summary, timed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000])
+    parser.add_argument('--database-url', default=None)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--decks', type=int, default=2)
+    parser.add_argument('--questions', type=int, default=20,
+                        help='questions drawn in each session')
+    args = parser.parse_args()
+
+    app = make_app(args.database_url)
+    from flaskr.question_pool import QuestionPool
+    from flaskr.quiz_decks import QuizDecks
+    from flaskr.quiz_sessions import QuizSessionStore
+
+    print('{0:>9} {1:>8} {2:>22} {3:>10} {4:>10} {5:>10}'.format(
+        'rows', 'category', 'session', 'mean ms', 'p95 ms', 'p99 ms'))
+    with app.app_context():
+        for size in args.sizes:
+            seed(size)
+            pool = QuestionPool()
+            pool.load()
+            decks = QuizDecks(pool, decks=args.decks, check_interval=0)
+            decks.build()
+            print('{0:>9} {1} decks built in {2:.2f} s, {3:.1f} MB'.format(
+                size, args.decks, decks.stats()['build_seconds'],
+                decks.memory_usage() / 1e6))
+            # Few sessions, so both runs reuse the memory of evicted ones
+            store = QuizSessionStore(max_sessions=10)
+
+            for category in (0, 2):
+                def play(start):
+                    session = start()
+                    for _ in range(args.questions):
+                        session.next()
+
+                runs = (
+                    ('shuffled as it goes', lambda: play(
+                        lambda: store.start(category, pool.ids(category)))),
+                    ('deck', lambda: play(
+                        lambda: store.start(category, decks.deal(category),
+                                            shuffled=True))),
+                )
+                for name, fn in runs:
+                    stats = summary(timed(fn, args.repeat))
+                    print('{0:>9} {1:>8} {2:>22} {3:>10.3f} {4:>10.3f} '
+                          '{5:>10.3f}'.format(size, category, name,
+                                              stats['mean'], stats['p95'],
+                                              stats['p99']))
+
+            # The builds share the GIL with the requests of the process
+            pool.add(size + 1, 1)
+            builder = threading.Thread(target=decks.build)
+            builder.start()
+            samples = []
+            while builder.is_alive():
+                samples += timed(lambda: store.start(2, pool.ids(2)), 1)
+            builder.join()
+            stats = summary(sorted(samples))
+            print('{0:>9} {1:>8} {2:>22} {3:>10.3f} {4:>10.3f} {5:>10.3f}'
+                  .format(size, 2, 'start during a build', stats['mean'],
+                          stats['p95'], stats['p99']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+""" Quiz question selection benchmark.
+description: Compares the ORDER BY random() query that /quizzes used to run
+    against the in-memory QuestionPool, on synthetic banks of several sizes.
+    Also reports the time to load the pool, the memory its id arrays
+    take, and the adaptive mode picks (QuestionPool.pick_nearest()) next
+    to the same difficulty filter in SQL.
+
+    python -m benchmarks.quiz_selection
+    python -m benchmarks.quiz_selection --sizes 10000 100000 1000000 \
+        --database-url postgresql://postgres@localhost:5432/trivia_bench
+"""
+import argparse
+import random
+import time
+
+from sqlalchemy import func
+
+from .common import make_app, seed, summary, timed
+
+
+def order_by_random(Question, category, previous):
+    query = Question.query
+    if category > 0:
+        query = query.filter(Question.category == category)
+    return query.filter(
+        ~Question.id.in_(previous)
+    ).order_by(func.random()).first()
+
+
+def order_by_random_difficulty(Question, category, previous, difficulty):
+    query = Question.query.filter(Question.difficulty == difficulty)
+    if category > 0:
+        query = query.filter(Question.category == category)
+    return query.filter(
+        ~Question.id.in_(previous)
+    ).order_by(func.random()).first()
+
+
+def pool_pick(Question, pool, category, previous):
+    question_id = pool.pick(category, previous)
+    return Question.query.get(question_id)
+
+
+def pool_pick_nearest(Question, pool, category, previous, difficulty):
+    question_id = pool.pick_nearest(category, previous, difficulty, 1)
+    return Question.query.get(question_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000, 1000000])
+    parser.add_argument('--database-url', default=None)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--previous', type=int, default=20,
+                        help='length of previous_questions on each step')
+    args = parser.parse_args()
+
+    app = make_app(args.database_url)
+    from models import Question
+    from flaskr.question_pool import QuestionPool
+
+    print('{0:>9} {1:>8} {2:>16} {3:>10} {4:>10}'.format(
+        'rows', 'category', 'method', 'mean ms', 'p95 ms'))
+    with app.app_context():
+        for size in args.sizes:
+            seed(size)
+            pool = QuestionPool()
+            start = time.perf_counter()
+            pool.load()
+            print('{0:>9} pool loaded in {1:.2f} s, {2:.1f} MB'.format(
+                size, time.perf_counter() - start,
+                pool.memory_usage() / 1e6))
+            for category in (0, 2):
+                ids = list(pool.ids(category))
+                previous = random.sample(ids, min(args.previous, len(ids)))
+                runs = [
+                    ('ORDER BY random', lambda: order_by_random(
+                        Question, category, previous)),
+                    ('QuestionPool', lambda: pool_pick(
+                        Question, pool, category, previous)),
+                    ('ORDER BY (diff.)', lambda: order_by_random_difficulty(
+                        Question, category, previous, 4)),
+                    ('Pool adaptive', lambda: pool_pick_nearest(
+                        Question, pool, category, previous, 4)),
+                ]
+                for name, fn in runs:
+                    stats = summary(timed(fn, args.repeat))
+                    print('{0:>9} {1:>8} {2:>16} {3:>10.3f} {4:>10.3f}'.format(
+                        size, category, name, stats['mean'], stats['p95']))
+                # late quiz: all but 5 ids of the category already played
+                previous = set(ids[5:])
+                stats = summary(timed(lambda: pool_pick(
+                    Question, pool, category, previous), args.repeat))
+                print('{0:>9} {1:>8} {2:>16} {3:>10.3f} {4:>10.3f}'.format(
+                    size, category, 'Pool (late quiz)', stats['mean'],
+                    stats['p95']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+""" Rate limiter benchmark.
+description: What the rate limiter adds to a request: the cost of taking
+    a token from the memory and shared backends, for many clients, the
+    throughput of the shared backend when several processes take tokens
+    from the same file, and the latency of POST /quizzes and GET
+    /categories with RATE_LIMIT off, memory and shared, against the
+    latency of a refused (429) request.
+
+    python -m benchmarks.rate_limit
+    python -m benchmarks.rate_limit --size 100000 --processes 8 \
+        --database-url postgresql://postgres@localhost:5432/trivia_bench
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+from .common import make_app, seed, summary, timed
+
+
+def take_tokens(path, clients, takes):
+    """ Takes tokens of clients buckets from the shared backend at path.
+        Run in each process of the shared backend test.
+    """
+    from flaskr.rate_limit import SharedRateLimitBackend
+    backend = SharedRateLimitBackend(path)
+    for take in range(takes):
+        backend.take('quizzes@{0}'.format(take % clients), 10 ** 9, 1)
+    backend.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size', type=int, default=10000)
+    parser.add_argument('--database-url', default=None)
+    parser.add_argument('--repeat', type=int, default=500)
+    parser.add_argument('--clients', type=int, default=10000)
+    parser.add_argument('--processes', type=int, default=4)
+    args = parser.parse_args()
+
+    app = make_app(args.database_url)
+    from flaskr import create_app
+    from flaskr.rate_limit import (
+        MemoryRateLimitBackend, SharedRateLimitBackend
+    )
+
+    directory = tempfile.mkdtemp(prefix='trivia_rate_limit_')
+    path = os.path.join(directory, 'buckets')
+
+    print('{0:>28} {1:>10}'.format('step', 'mean us'))
+    takes = max(args.clients, 100000)
+    for backend in (MemoryRateLimitBackend(), SharedRateLimitBackend(path)):
+        keys = ['quizzes@10.0.{0}.{1}'.format(client // 256, client % 256)
+                for client in range(args.clients)]
+        start = time.perf_counter()
+        for take in range(takes):
+            backend.take(keys[take % args.clients], 20, 10)
+        print('{0:>28} {1:>10.2f}'.format(
+            'take ({0})'.format(backend.name),
+            (time.perf_counter() - start) * 10 ** 6 / takes))
+    backend.close()
+
+    # Processes sharing the file serialize on its lock
+    takes = 50000
+    for processes in sorted(set([1, args.processes])):
+        workers = [
+            multiprocessing.Process(
+                target=take_tokens, args=(path, args.clients, takes)
+            ) for _ in range(processes)
+        ]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+        print('{0:>28} {1:>10.2f}   {2:.0f} takes/s'.format(
+            'take (shared, {0} procs)'.format(processes),
+            elapsed * 10 ** 6 / (processes * takes),
+            processes * takes / elapsed))
+
+    with app.app_context():
+        seed(args.size)
+    quiz = {'quiz_category': {'id': 0}, 'previous_questions': []}
+    print()
+    print('{0:>28} {1:>10} {2:>10} {3:>10}'.format(
+        'request', 'mean ms', 'p95 ms', 'p99 ms'))
+    for name, limits in (('off', None), ('memory', None), ('shared', None),
+                         ('memory', 'quizzes=1/3600')):
+        client = create_app({
+            'RATE_LIMIT': name, 'RATE_LIMIT_FILE': path,
+            'RATE_LIMITS': limits or 'quizzes=1000000000/1',
+        }).test_client()
+        routes = [('GET /categories', lambda: client.get('/categories'))]
+        if limits is None:
+            routes.append(('POST /quizzes',
+                           lambda: client.post('/quizzes', json=quiz)))
+        else:
+            client.post('/quizzes', json=quiz)
+            routes.append(('POST /quizzes (429)',
+                           lambda: client.post('/quizzes', json=quiz)))
+        for route, request in routes:
+            request()
+            stats = summary(timed(request, args.repeat))
+            print('{0:>28} {1:>10.3f} {2:>10.3f} {3:>10.3f}'.format(
+                '{0} {1}'.format(name, route), stats['mean'], stats['p95'],
+                stats['p99']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+""" Read replica benchmark.
+description: What routing reads to replicas (DB_REPLICA_URLS) costs a
+    request and takes off the primary: the time to pick a replica, the
+    latency of listing and quiz requests without replicas and with one,
+    and the SQL statements each database ran for a mixed workload of
+    players and a curator writing questions, with and without
+    read-your-writes pinning of the curator.
+
+    The replica defaults to the benchmark database itself, which measures
+    the routing alone; pass a streaming replica of --database-url with
+    --replica-url to measure a real one.
+
+    python -m benchmarks.replicas
+    python -m benchmarks.replicas --size 100000 \
+        --database-url postgresql://postgres@primary:5432/trivia_bench \
+        --replica-url postgresql://postgres@replica:5432/trivia_bench
+"""
+import argparse
+import os
+import random
+import time
+
+from sqlalchemy import create_engine, event
+
+from .common import CATEGORIES, make_app, seed, summary
+
+
+def count_statements(engine, counts, name):
+    def executed(conn, cursor, statement, parameters, context, executemany):
+        counts[name] = counts.get(name, 0) + 1
+    event.listen(engine, 'before_cursor_execute', executed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size', type=int, default=10000)
+    parser.add_argument('--database-url', default=None)
+    parser.add_argument('--replica-url', default=None,
+                        help='Default: the benchmark database.')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--write-every', type=int, default=20,
+                        help='requests between two curator writes')
+    args = parser.parse_args()
+
+    app = make_app(args.database_url)
+    from flaskr import create_app
+    from flaskr.replicas import ReplicaRouter
+    from models import db
+
+    replica_url = args.replica_url or os.environ['SQLALCHEMY_DATABASE_URI']
+    with app.app_context():
+        seed(args.size)
+
+    router = ReplicaRouter(
+        [create_engine(replica_url), create_engine(replica_url)],
+        check_interval=0
+    )
+    calls = 100000
+    start = time.perf_counter()
+    for _ in range(calls):
+        router.choose()
+    print('choose(): {0:.2f} us'.format(
+        (time.perf_counter() - start) * 10 ** 6 / calls))
+    router.close()
+
+    print()
+    print('{0:>30} {1:>9} {2:>9} {3:>9} {4:>9} {5:>9}'.format(
+        'setup', 'mean ms', 'p95 ms', 'p99 ms', 'primary', 'replica'))
+    configs = (
+        ('no replica', None, 0),
+        ('replica', replica_url, 0),
+        ('replica, read your writes', replica_url, 5),
+    )
+    for name, urls, read_your_writes in configs:
+        test_app = create_app({
+            'DB_REPLICA_URLS': urls,
+            'DB_REPLICA_CHECK_INTERVAL': 0,
+            'DB_READ_YOUR_WRITES': read_your_writes,
+            'RESPONSE_CACHE': 'off',
+        })
+        router = test_app.extensions['trivia']['replica_router']
+        counts = {}
+        with test_app.app_context():
+            count_statements(db.engine, counts, 'primary')
+        if router is not None:
+            count_statements(router.replicas[0].engine, counts, 'replica')
+        rng = random.Random(0)
+        players = test_app.test_client()
+        curator = test_app.test_client()
+        paths = ['/questions?page={0}'.format(page) for page in (1, 10)] + [
+            '/categories/{0}/questions'.format(category)
+            for category in range(1, len(CATEGORIES) + 1)
+        ]
+        quiz = {'quiz_category': {'id': 0}, 'previous_questions': []}
+        samples = []
+        for step in range(args.requests):
+            if step % args.write_every == 0:
+                curator.post('/questions', json={
+                    'question': 'Replica benchmark {0} {1}?'.format(
+                        name, step),
+                    'answer': 'answer', 'category': 1, 'difficulty': 1,
+                })
+                # The curator checks the listing after writing
+                curator.get('/categories/1/questions')
+                continue
+            started = time.perf_counter()
+            if step % 2:
+                players.post('/quizzes', json=quiz)
+            else:
+                players.get(rng.choice(paths))
+            samples.append((time.perf_counter() - started) * 1000)
+        stats = summary(sorted(samples))
+        print('{0:>30} {1:>9.3f} {2:>9.3f} {3:>9.3f} {4:>9} {5:>9}'.format(
+            name, stats['mean'], stats['p95'], stats['p99'],
+            counts.get('primary', 0), counts.get('replica', 0)))
+        if router is not None:
+            router.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+""" Score recording load test.
+description: Many players post quiz scores to a threaded WSGI server while
+    others read the leaderboards, once per SCORE_FLUSH_SIZE: 1 writes every
+    score in its own transaction, larger sizes buffer them and write them
+    in batches. Reports the latency and throughput of both routes and the
+    batches written.
+
+    python -m benchmarks.scores
+    python -m benchmarks.scores --scores 50000 --writers 32 \
+        --database-url postgresql://postgres@localhost:5432/trivia_bench
+"""
+import argparse
+import logging
+import random
+import threading
+import time
+
+from .common import CATEGORIES, make_app, summary
+from .load import ServerDriver
+
+
+def drive(driver, scores, writers, readers, players):
+    """ Posts scores from writers threads while readers threads read the
+        leaderboards, until every score is posted. Returns the sorted
+        latencies in ms of both routes and the elapsed seconds.
+    """
+    write_samples = []
+    read_samples = []
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def timed_request(samples, method, path, body=None):
+        start = time.perf_counter()
+        status, data = driver.request(method, path, body)
+        elapsed = (time.perf_counter() - start) * 1000
+        if status != 200:
+            raise RuntimeError('{0} {1}: {2}'.format(method, path, status))
+        with lock:
+            samples.append(elapsed)
+
+    def writer(index):
+        rng = random.Random(index)
+        for _ in range(scores // writers):
+            total = rng.randint(5, 20)
+            timed_request(write_samples, 'POST', '/scores', {
+                'player': 'player{0}'.format(rng.randint(1, players)),
+                'quiz_category': {'id': rng.randint(0, len(CATEGORIES))},
+                'score': rng.randint(0, total),
+                'total': total,
+            })
+
+    def reader(index):
+        rng = random.Random(-index - 1)
+        while not done.is_set():
+            timed_request(read_samples, 'GET', '/leaderboard?category={0}'
+                          .format(rng.randint(0, len(CATEGORIES))))
+
+    threads = [threading.Thread(target=writer, args=(index,))
+               for index in range(writers)]
+    reading = [threading.Thread(target=reader, args=(index,))
+               for index in range(readers)]
+    start = time.perf_counter()
+    for thread in threads + reading:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    done.set()
+    for thread in reading:
+        thread.join()
+    return sorted(write_samples), sorted(read_samples), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--database-url', default=None)
+    parser.add_argument('--scores', type=int, default=20000)
+    parser.add_argument('--writers', type=int, default=16)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--players', type=int, default=5000)
+    parser.add_argument('--flush-sizes', type=int, nargs='+',
+                        default=[1, 500])
+    args = parser.parse_args()
+
+    logging.getLogger('flaskr.metrics').setLevel(logging.ERROR)
+    make_app(args.database_url)
+    from flaskr import create_app
+    from flaskr.migrate import upgrade
+    from models import db, Score
+
+    print('{0:>10} {1:>11} {2:>9} {3:>9} {4:>9} {5:>10} {6:>9} {7:>9} '
+          '{8:>8}'.format('flush size', 'route', 'requests', 'p50 ms',
+                          'p95 ms', 'p99 ms', 'req/s', 'rows', 'batches'))
+    for flush_size in args.flush_sizes:
+        app = create_app({'SCORE_FLUSH_SIZE': flush_size})
+        recorder = app.extensions['trivia']['score_recorder']
+        with app.app_context():
+            upgrade()
+            db.session.execute(Score.__table__.delete())
+            db.session.commit()
+        driver = ServerDriver(app)
+        try:
+            writes, reads, elapsed = drive(
+                driver, args.scores, args.writers, args.readers,
+                args.players
+            )
+        finally:
+            driver.close()
+        recorder.close()
+        stats = recorder.stats()
+        with app.app_context():
+            rows = Score.query.count()
+        for route, samples in (('POST scores', writes),
+                               ('GET board', reads)):
+            result = summary(samples)
+            print('{0:>10} {1:>11} {2:>9} {3:>9.3f} {4:>9.3f} {5:>10.3f} '
+                  '{6:>9.0f} {7:>9} {8:>8}'.format(
+                      flush_size, route, len(samples), result['p50'],
+                      result['p95'], result['p99'], len(samples) / elapsed,
+                      rows, stats['flushes']))
+
+
+if __name__ == '__main__':
+    main()
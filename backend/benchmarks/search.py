@@ -0,0 +1,66 @@
+""" Question search benchmark.
+description: Compares the old ILIKE substring search with the full-text
+    search backends on synthetic banks of several sizes. The postgres
+    backend only runs against a PostgreSQL --database-url.
+
+    python -m benchmarks.search
+    python -m benchmarks.search --sizes 10000 100000 \
+        --database-url postgresql://postgres@localhost:5432/trivia_bench
+"""
+import argparse
+import time
+
+from .common import WORDS, make_app, seed, summary, timed
+
+TERMS = [
+    ('common word', WORDS[0]),
+    ('rare word', WORDS[-1]),
+    ('two words', '{0} {1}'.format(WORDS[1], WORDS[10])),
+    ('prefix', WORDS[20][:3]),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000, 1000000])
+    parser.add_argument('--database-url', default=None)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--per-page', type=int, default=10)
+    args = parser.parse_args()
+
+    app = make_app(args.database_url)
+    from models import db
+    from flaskr.search import (
+        IlikeSearch, InvertedIndexSearch, PostgresSearch
+    )
+
+    print('{0:>9} {1:>9} {2:>12} {3:>9} {4:>10} {5:>10}'.format(
+        'rows', 'backend', 'term', 'matches', 'mean ms', 'p95 ms'))
+    with app.app_context():
+        for size in args.sizes:
+            seed(size)
+            backends = [IlikeSearch(), InvertedIndexSearch()]
+            if db.engine.dialect.name == 'postgresql':
+                backends.append(PostgresSearch())
+            for backend in backends:
+                start = time.perf_counter()
+                if isinstance(backend, InvertedIndexSearch):
+                    backend.load()
+                print('{0:>9} {1:>9} {2:>12} {3:>9} {4:>10.1f}'.format(
+                    size, backend.name, '(build)', '',
+                    (time.perf_counter() - start) * 1000))
+                for label, term in TERMS:
+                    total = backend.search(term, 0, args.per_page)[1]
+                    stats = summary(timed(
+                        lambda: backend.search(term, 0, args.per_page),
+                        args.repeat
+                    ))
+                    print('{0:>9} {1:>9} {2:>12} {3:>9} {4:>10.3f} '
+                          '{5:>10.3f}'.format(size, backend.name, label,
+                                              total, stats['mean'],
+                                              stats['p95']))
+
+
+if __name__ == '__main__':
+    main()
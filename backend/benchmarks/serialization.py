@@ -0,0 +1,105 @@
+""" JSON serialization benchmark.
+description: Builds the JSON of a 1,000 question page and of a whole
+    category the old way (ORM objects, Question.format(), jsonify()) and
+    with flaskr.serialization (column tuples, format_rows(), dumps() with
+    orjson, and with the stdlib fallback). Reports the CPU time and the
+    peak memory allocated by Python (tracemalloc) of each.
+
+    python -m benchmarks.serialization
+    python -m benchmarks.serialization --size 100000 \
+        --database-url postgresql://postgres@localhost:5432/trivia_bench
+"""
+import argparse
+import time
+import tracemalloc
+
+from flask import jsonify
+
+from .common import make_app, seed, summary
+
+
+def cpu_timed(fn, repeat):
+    """ Calls fn repeat times, returns the sorted CPU times in ms. """
+    samples = []
+    for _ in range(repeat):
+        start = time.process_time()
+        fn()
+        samples.append((time.process_time() - start) * 1000)
+    samples.sort()
+    return samples
+
+
+def peak_allocated(fn):
+    """ Peak MB allocated by Python while fn runs. """
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size', type=int, default=100000)
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--category', type=int, default=1)
+    parser.add_argument('--database-url', default=None)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    app = make_app(args.database_url)
+    from models import db, Question
+    from flaskr import serialization
+    from flaskr.serialization import QUESTION_COLUMNS, dumps, format_rows
+
+    def stdlib_dumps(data):
+        orjson = serialization.orjson
+        serialization.orjson = None
+        try:
+            return dumps(data)
+        finally:
+            serialization.orjson = orjson
+
+    with app.test_request_context():
+        seed(args.size)
+        # Debug mode is how jsonify() ended up indenting responses
+        app.debug = True
+        offset = args.size // 2
+        listings = [
+            ('{0} question page'.format(args.page_size),
+             lambda query: query.order_by(Question.id).offset(offset).limit(
+                 args.page_size)),
+            ('category {0}'.format(args.category),
+             lambda query: query.filter(
+                 Question.category == args.category).order_by(Question.id)),
+        ]
+        print('{0:>22} {1:>26} {2:>8} {3:>12} {4:>12} {5:>10}'.format(
+            'listing', 'method', 'bytes', 'cpu mean ms', 'cpu p95 ms',
+            'peak MB'))
+        for listing, select in listings:
+            runs = [
+                ('ORM + format + jsonify', lambda: jsonify({
+                    'questions': [qt.format() for qt in
+                                  select(Question.query).all()]
+                }).get_data()),
+                ('tuples + dumps ({0})'.format(serialization.ENCODER),
+                 lambda: dumps({'questions': format_rows(
+                     select(db.session.query(*QUESTION_COLUMNS)).all()
+                 )})),
+                ('tuples + dumps (json)', lambda: stdlib_dumps({
+                    'questions': format_rows(
+                        select(db.session.query(*QUESTION_COLUMNS)).all()
+                    )})),
+            ]
+            for name, fn in runs:
+                size = len(fn())
+                stats = summary(cpu_timed(fn, args.repeat))
+                print('{0:>22} {1:>26} {2:>8} {3:>12.2f} {4:>12.2f} '
+                      '{5:>10.2f}'.format(
+                          listing, name, size, stats['mean'], stats['p95'],
+                          peak_allocated(fn)))
+
+
+if __name__ == '__main__':
+    main()
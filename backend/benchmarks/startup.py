@@ -0,0 +1,136 @@
+""" Startup time.
+description: Times, in new processes, what a server process does before it
+    answers: starting the interpreter, importing flaskr, create_app() and
+    the first GET /categories and GET /questions, without and with the
+    warm-up. Then times a pre-forked worker (the app built before the fork,
+    as gunicorn --preload does): from the fork to its first response.
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --size 100000 --runs 10 \
+        --database-url postgresql://postgres@localhost:5432/trivia_bench
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from .common import make_app, seed, summary
+
+PHASES = ('interpreter', 'import', 'create_app', 'warm_up',
+          'first_categories', 'first_questions')
+
+# Runs in a new interpreter, prints the ms of each phase as JSON
+CHILD = '''
+import json, time
+# STARTED: time.time() of the parent just before it started this process
+timings = {'interpreter': (time.time() - STARTED) * 1000}
+start = time.perf_counter()
+def lap(name):
+    global start
+    now = time.perf_counter()
+    timings[name] = (now - start) * 1000
+    start = now
+from flaskr import create_app
+lap('import')
+app = create_app()
+lap('create_app')
+if WARM:
+    from flaskr.warmup import warm_up
+    warm_up(app)
+    lap('warm_up')
+client = app.test_client()
+assert client.get('/categories').status_code == 200
+lap('first_categories')
+assert client.get('/questions').status_code == 200
+lap('first_questions')
+print(json.dumps(timings))
+'''
+
+# Builds the app, then forks workers that each answer one request
+FORKED = '''
+import json, os, time
+from flaskr import create_app
+from flaskr.warmup import warm_up
+app = create_app()
+if WARM:
+    # Loaded once, before the fork, shared by every worker
+    warm_up(app, dispose=True)
+samples = []
+for _ in range(RUNS):
+    read, write = os.pipe()
+    start = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        client = app.test_client()
+        statuses = (client.get('/categories').status_code,
+                    client.get('/questions').status_code)
+        os.write(write, json.dumps(statuses).encode())
+        os._exit(0)
+    os.close(write)
+    statuses = json.loads(os.read(read, 64).decode())
+    samples.append((time.perf_counter() - start) * 1000)
+    os.close(read)
+    os.waitpid(pid, 0)
+    assert statuses == [200, 200], statuses
+print(json.dumps(samples))
+'''
+
+
+def run(code, database_url, **constants):
+    """ Runs code in a new interpreter, from the backend directory, and
+        returns what it printed, parsed as JSON.
+    """
+    env = dict(os.environ, SQLALCHEMY_DATABASE_URI=database_url,
+               WARMUP='off')
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    constants['STARTED'] = time.time()
+    prelude = ''.join('{0} = {1!r}\n'.format(name, value)
+                      for name, value in constants.items())
+    output = subprocess.run(
+        [sys.executable, '-c', prelude + code], cwd=backend, env=env,
+        check=True, stdout=subprocess.PIPE
+    ).stdout
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--database-url', default=None)
+    parser.add_argument('--size', type=int, default=10000)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    app = make_app(args.database_url)
+    from flaskr.migrate import upgrade
+    with app.app_context():
+        upgrade()
+        seed(args.size)
+    database_url = app.config['SQLALCHEMY_DATABASE_URI']
+
+    print('{0:>10} {1:>17} {2:>9} {3:>9} {4:>9}'.format(
+        'warm-up', 'phase', 'mean ms', 'p50 ms', 'max ms'))
+    for warm in (False, True):
+        runs = [run(CHILD, database_url, WARM=warm)
+                for _ in range(args.runs)]
+        for phase in PHASES:
+            samples = sorted(timings[phase] for timings in runs
+                             if phase in timings)
+            if not samples:
+                continue
+            result = summary(samples)
+            print('{0:>10} {1:>17} {2:>9.1f} {3:>9.1f} {4:>9.1f}'.format(
+                'yes' if warm else 'no', phase, result['mean'],
+                result['p50'], samples[-1]))
+        samples = sorted(run(FORKED, database_url, WARM=warm,
+                             RUNS=args.runs))
+        result = summary(samples)
+        print('{0:>10} {1:>17} {2:>9.1f} {3:>9.1f} {4:>9.1f}'.format(
+            'yes' if warm else 'no', 'forked worker', result['mean'],
+            result['p50'], samples[-1]))
+
+
+if __name__ == '__main__':
+    main()
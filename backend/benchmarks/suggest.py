@@ -0,0 +1,77 @@
+""" Autocomplete benchmark.
+description: What a search box costs per keystroke: the ILIKE search the
+    frontend sent on every change against the suggestion index, for every
+    prefix typed while entering a word. Also reports the index build time,
+    its memory and the cost of adding questions to it.
+
+    python -m benchmarks.suggest
+    python -m benchmarks.suggest --sizes 100000 1000000 \
+        --database-url postgresql://postgres@localhost:5432/trivia_bench
+"""
+import argparse
+import random
+import time
+
+from .common import WORDS, make_app, seed, sentence, summary, timed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000])
+    parser.add_argument('--database-url', default=None)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--max-terms', type=int, default=100000)
+    args = parser.parse_args()
+
+    app = make_app(args.database_url)
+    from flaskr.search import IlikeSearch
+    from flaskr.suggest import SuggestIndex
+
+    # Every prefix of a common, a mid and a rare word, as typed
+    prefixes = [
+        word[:length] for word in (WORDS[0], WORDS[500], WORDS[-1])
+        for length in range(2, len(word) + 1)
+    ]
+    print('{0:>9} {1:>16} {2:>10} {3:>10} {4:>10}'.format(
+        'rows', 'lookup', 'mean ms', 'p95 ms', 'p99 ms'))
+    with app.app_context():
+        for size in args.sizes:
+            seed(size)
+            index = SuggestIndex(max_terms=args.max_terms)
+            start = time.perf_counter()
+            index.load()
+            print('{0:>9} {1:>16} {2:>10.1f}   terms {3}, {4:.1f} MB'.format(
+                size, '(build)', (time.perf_counter() - start) * 1000,
+                index.stats()['terms'], index.memory_usage() / 1024 ** 2))
+
+            def keystrokes(lookup, repeat):
+                samples = []
+                for prefix in prefixes:
+                    samples += timed(lambda: lookup(prefix), repeat)
+                return sorted(samples)
+
+            ilike = IlikeSearch()
+            for name, lookup, repeat in (
+                ('ILIKE search', lambda prefix: ilike.search(prefix, 0, 10),
+                 max(1, args.repeat // 100)),
+                ('suggest', index.complete, args.repeat),
+            ):
+                stats = summary(keystrokes(lookup, repeat))
+                print('{0:>9} {1:>16} {2:>10.4f} {3:>10.4f} {4:>10.4f}'
+                      .format(size, name, stats['mean'], stats['p95'],
+                              stats['p99']))
+
+            rng = random.Random(size)
+            rows = [{'question': 'Which {0}?'.format(sentence(rng, 8))}
+                    for _ in range(1000)]
+            start = time.perf_counter()
+            for row in rows:
+                index.questions_written([row])
+            print('{0:>9} {1:>16} {2:>10.4f}'.format(
+                size, 'add question', (time.perf_counter() - start)
+            ))
+
+
+if __name__ == '__main__':
+    main()
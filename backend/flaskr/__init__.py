@@ -1,16 +1,60 @@
 import os
-from flask import Flask, request, abort, jsonify
+from flask import (
+    Flask, request, abort, g, stream_with_context
+)
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import func
 from flask_cors import CORS
+import json
 import random
+import click
 
-from models import setup_db, Question, Category
+from sqlalchemy.engine.url import make_url
+
+from models import (
+    setup_db, db, primary_reads, Question, Category, REPLICA_KEY, TRUE_VALUES
+)
+from .bulk import (
+    FORMATS, MAX_BATCH_SIZE, delete_questions, duplicate_errors,
+    export_questions, import_questions, insert_questions, validate
+)
+from .answers import (
+    answer_matches, normalize_answer, normalize_missing_answers
+)
+from .category_cache import CategoryCache
+from .duplicates import (
+    MAX_BUCKET, duplicate_clusters, fingerprint, find_duplicates,
+    sign_missing_questions
+)
+from .config import load_settings
+from .leaderboard import Leaderboard, ScoreRecorder
+from .metrics import Metrics, TimedQueuePool
+from .migrate import upgrade
+from .pagination import keyset_page, page_args, seek_page
+from .question_pool import (
+    QuestionPool, questions_deleted, questions_written
+)
+from .quiz_decks import QuizDecks
+from .quiz_sessions import QuizSessionStore
+from .rate_limit import create_rate_limiter
+from .replicas import create_replica_router
+from .response_cache import ResponseCache, create_response_cache
+from .responses import CORS_HEADERS, MisdirectedRequest, error_body
+from .search import (
+    create_search_backend, questions_deleted as search_questions_deleted,
+    questions_written as search_questions_written
+)
+from .suggest import SuggestIndex
+from .serialization import (
+    QUESTION_COLUMNS, dumps, format_rows, json_response
+)
+from .validation import (
+    adaptive_difficulty, allow_duplicates, hide_answer, previous_questions,
+    quiz_answer, quiz_category, quiz_score
+)
+from .warmup import start_warmup
 from dotenv import load_dotenv
 load_dotenv()
 
-QUESTIONS_PER_PAGE = int(os.getenv('QUESTIONS_PER_PAGE'))
-
 
 def create_app(test_config=None):
     # create and configure the app
@@ -21,40 +65,341 @@ def create_app(test_config=None):
     app.config[
         "SQLALCHEMY_TRACK_MODIFICATIONS"
         ] = os.getenv('SQLALCHEMY_TRACK_MODIFICATIONS')
+    if test_config is not None:
+        app.config.update(test_config)
+    # Checked once, here; nothing below connects to the database, the
+    # caches load on the first request or with WARMUP = background
+    settings = load_settings(app.config)
+    app.config.update(settings)
+    questions_per_page = settings['QUESTIONS_PER_PAGE']
+    duplicate_similarity = settings['DUPLICATE_SIMILARITY']
 
-    setup_db(app)
+    setup_db(app, poolclass=TimedQueuePool)
+    question_pool = QuestionPool()
+    category_cache = CategoryCache()
+    search_backend = create_search_backend(
+        settings['SEARCH_BACKEND'],
+        make_url(
+            app.config['SQLALCHEMY_DATABASE_URI'] or 'sqlite://'
+        ).get_backend_name()
+    )
+    suggest_index = SuggestIndex(max_terms=settings['SUGGEST_MAX_TERMS'])
+    suggest_index.init_app(app)
+    quiz_sessions = QuizSessionStore(ttl=settings['QUIZ_SESSION_TTL'])
+    quiz_decks = None
+    if settings['QUIZ_DECKS']:
+        quiz_decks = QuizDecks(
+            question_pool, decks=settings['QUIZ_DECKS'],
+            rotate_interval=settings['QUIZ_DECK_ROTATE']
+        )
+        quiz_decks.init_app(app)
+    metrics = Metrics(settings['SLOW_QUERY_MS'])
+    metrics.init_app(app)
+    response_cache = create_response_cache(
+        settings['RESPONSE_CACHE'],
+        settings['RESPONSE_CACHE_URL'],
+        settings['RESPONSE_CACHE_TTL'],
+        settings['RESPONSE_CACHE_MAX_MB']
+    )
+    score_recorder = ScoreRecorder(
+        flush_size=settings['SCORE_FLUSH_SIZE'],
+        flush_interval=settings['SCORE_FLUSH_INTERVAL']
+    )
+    score_recorder.init_app(app)
+    leaderboard = Leaderboard(
+        size=settings['LEADERBOARD_SIZE'],
+        max_age=settings['LEADERBOARD_MAX_AGE'],
+        pending=score_recorder.pending
+    )
+    score_recorder.leaderboard = leaderboard
+    rate_limiter = create_rate_limiter(
+        settings['RATE_LIMIT'],
+        settings['RATE_LIMITS'],
+        settings['RATE_LIMIT_FILE'],
+        settings['RATE_LIMIT_PROXIES']
+    )
+    replica_router = create_replica_router(
+        settings['DB_REPLICA_URLS'], app.config, TimedQueuePool,
+        settings['DB_REPLICA_CHECK_INTERVAL'], settings['DB_READ_YOUR_WRITES']
+    )
+    if replica_router is not None:
+        replica_router.init_app(app)
+    # Shared with the ASGI entry point
+    app.extensions['trivia'] = {
+        'question_pool': question_pool,
+        'category_cache': category_cache,
+        'search_backend': search_backend,
+        'suggest_index': suggest_index,
+        'quiz_sessions': quiz_sessions,
+        'quiz_decks': quiz_decks,
+        'metrics': metrics,
+        'response_cache': response_cache,
+        'score_recorder': score_recorder,
+        'leaderboard': leaderboard,
+        'rate_limiter': rate_limiter,
+        'replica_router': replica_router,
+        'questions_per_page': questions_per_page,
+    }
     # pylint: disable=unused-variable
+
+    @app.cli.command('migrate')
+    def migrate_command():
+        """Create missing tables and apply pending migrations."""
+        for name in upgrade():
+            click.echo('Applied {0}'.format(name))
+        updated = normalize_missing_answers()
+        if updated:
+            click.echo('Normalized {0} answers'.format(updated))
+        signed = sign_missing_questions()
+        if signed:
+            click.echo('Signed {0} questions'.format(signed))
+
+    @app.cli.command('import-questions')
+    @click.argument('source', type=click.File('rb'))
+    @click.option('--format', 'file_format', type=click.Choice(FORMATS),
+                  default='jsonl')
+    @click.option('--batch-size', default=1000)
+    @click.option('--method', type=click.Choice(['copy', 'executemany']),
+                  default=None, help='Default: copy on PostgreSQL.')
+    @click.option('--allow-duplicates', is_flag=True,
+                  help='Import duplicates of existing questions too.')
+    def import_questions_command(source, file_format, batch_size, method,
+                                 allow_duplicates):
+        """Import questions from a JSON Lines or CSV file ('-' for stdin)."""
+        categories = set(row.id for row in Category.query.all())
+        report = import_questions(
+            source, file_format, categories, batch_size, method,
+            None if allow_duplicates else duplicate_similarity
+        )
+        search_backend.refresh()
+        suggest_index.refresh()
+        for error in report['errors']:
+            click.echo('line {line}: {error}'.format(**error), err=True)
+        click.echo('Inserted {inserted}, failed {failed}'.format(**report))
+
+    @app.cli.command('export-questions')
+    @click.argument('target', type=click.File('w'))
+    @click.option('--format', 'file_format', type=click.Choice(FORMATS),
+                  default='jsonl')
+    def export_questions_command(target, file_format):
+        """Export every question as JSON Lines or CSV ('-' for stdout)."""
+        for chunk in export_questions(file_format):
+            target.write(chunk)
+
+    @app.cli.command('dedup-report')
+    @click.argument('target', type=click.File('w'), default='-')
+    @click.option('--similarity', type=float, default=None,
+                  help='Default: DUPLICATE_SIMILARITY.')
+    @click.option('--max-bucket', default=MAX_BUCKET,
+                  help='Skip LSH buckets shared by more questions.')
+    def dedup_report_command(target, similarity, max_bucket):
+        """Write the clusters of duplicate questions as JSON Lines."""
+        stats = {}
+        clusters = duplicate_clusters(
+            duplicate_similarity if similarity is None else similarity,
+            max_bucket, stats=stats
+        )
+        table = Question.__table__
+        for cluster in clusters:
+            questions = dict(db.session.execute(
+                db.select([table.c.id, table.c.question])
+                .where(table.c.id.in_(cluster))
+            ).fetchall())
+            target.write(json.dumps({
+                'ids': cluster,
+                'questions': [questions.get(qid) for qid in cluster],
+            }) + '\n')
+        click.echo(
+            '{clusters} clusters, {duplicates} duplicates, {compared} pairs '
+            'compared, {skipped_buckets} buckets skipped'.format(**stats),
+            err=True
+        )
+
+    @app.before_request
+    def limit_rate():
+        # Requests the ASGI app handed over were counted there
+        if (rate_limiter is None or request.method == 'OPTIONS'
+                or request.environ.get('trivia.rate_limit_checked')):
+            return None
+        wait = rate_limiter.check(
+            request.endpoint, request.args, request.remote_addr,
+            request.headers.get('X-Forwarded-For')
+        )
+        if wait:
+            g.retry_after = rate_limiter.retry_after(wait)
+            abort(429)
+        return None
+
     # CORS Headers
 
     @app.after_request
     def after_request(response):
-        response.headers.add(
-            'Access-Control-Allow-Headers',
-            'Content-Type,Authorization,true'
-        )
-        response.headers.add(
-            'Access-Control-Allow-Methods',
-            'GET,PUT,POST,DELETE,OPTIONS'
-        )
-        response.headers.add('Access-Control-Allow-Origin', '*')
+        for name, value in CORS_HEADERS:
+            response.headers.add(name, value)
         return response
 
     def get_formatted_categories():
         """ Formatted Categories.
         get:
             summary: Return formatted categories.
-            description: function to return an array of categories objects
+            description: function to return an array of categories objects,
+                served from the in-process category cache
             return:
                 array: formatted categories
         """
-        categories = Category.query.order_by(Category.id.asc()).all()
-        if categories is None:
-            return None
-        else:
-            format_categories = {
-                category.id: category.type for category in categories
-            }
-            return format_categories
+        return category_cache.categories()
+
+    def cached_body():
+        """ Cached body.
+        description: Looks the current request up in the response cache.
+            The key is the path, its GET args and the categories ETag,
+            since the cached bodies embed the categories. The question
+            pool is checked first: when it reloaded for the writes of
+            another process, the in-process cache is dropped.
+            return:
+                tuple: (key, cache generation, body bytes or None), key
+                    is None when the cache is off
+        """
+        if response_cache is None:
+            return None, None, None
+        if question_pool.stale:
+            question_pool.refresh()
+        response_cache.sync(question_pool.loads)
+        key = response_cache.key(
+            request.path, request.args, category_cache.response()[1]
+        )
+        generation = response_cache.generation()
+        return key, generation, response_cache.get(key)
+
+    def cache_response(key, generation, response, tags):
+        """ Stores the body of response under key (from cached_body()),
+            tagged with what it depends on, and returns response. Bodies
+            read from a replica right after a write are not stored: the
+            replica may not have it yet. Neither are the ones computed
+            while a write dropped entries (generation moved).
+        """
+        if key is not None and not (
+                replica_router is not None
+                and replica_router.stale(db.session.info.get(REPLICA_KEY))):
+            response_cache.set(key, response.get_data(), tags, generation)
+        return response
+
+    def json_body(body):
+        return app.response_class(body, mimetype='application/json')
+
+    def paginate_questions(query, response, category=QuestionPool.ALL):
+        """ Paginate questions.
+        description: Returns the page of query asked for by the page, or
+            after and limit, GET args and adds current_page or next_cursor
+            to response. Aborts with 400 on invalid args.
+            Numbered pages seek to their first id, found in the question
+            index of category, instead of skipping rows with OFFSET.
+            return:
+                array: questions of the page
+        """
+        try:
+            current_page, after_id, limit = page_args(
+                request.args, questions_per_page
+            )
+        except ValueError:
+            abort(400)
+        if after_id is not None:
+            questions, next_cursor = keyset_page(
+                query, Question.id, after_id, limit
+            )
+            response['next_cursor'] = next_cursor
+            return questions
+        response['current_page'] = current_page
+        first_id = question_pool.id_at(
+            category, max(current_page - 1, 0) * questions_per_page
+        )
+        if first_id is None:
+            return []
+        return seek_page(query, Question.id, first_id, questions_per_page)
+
+    def stream_questions(query, response, batch_size=500):
+        """ Stream questions.
+        description: Streams response as a JSON object whose questions
+            array is written while query (of QUESTION_COLUMNS) is read
+            through a server-side cursor, batch_size rows at a time, so
+            memory use doesn't grow with the number of rows. Each batch is
+            encoded with one dumps() call. total_questions is written last.
+            Aborts with 404 if query has no rows.
+        """
+        rows = iter(query.order_by(Question.id.asc()).yield_per(batch_size))
+        first = next(rows, None)
+        if first is None:
+            abort(404)
+
+        def generate():
+            yield dumps(response)[:-1] + b',"questions":['
+            batch = [first]
+            total = 0
+            separator = b''
+            for row in rows:
+                batch.append(row)
+                if len(batch) == batch_size:
+                    total += len(batch)
+                    yield separator + dumps(format_rows(batch))[1:-1]
+                    batch = []
+                    separator = b','
+            if batch:
+                total += len(batch)
+                yield separator + dumps(format_rows(batch))[1:-1]
+            yield '],"total_questions":{0}}}\n'.format(total).encode('ascii')
+
+        return app.response_class(
+            stream_with_context(generate()), mimetype='application/json'
+        )
+
+    def save_questions(rows):
+        """ Save questions.
+        description: Inserts validated question rows with one statement and
+            commits. The question pool, the search backend, the
+            suggestions and the response cache are told about them. Raises
+            the database error after a rollback.
+            return:
+                array: the rows, with their new id
+        """
+        try:
+            created = insert_questions(rows)
+            search_questions_written(db.session, created)
+            questions_written(db.session, created)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        suggest_index.questions_written(created)
+        if response_cache is not None:
+            response_cache.questions_changed(created)
+        return created
+
+    def remove_questions(ids):
+        """ Remove questions.
+        description: Deletes the questions of ids with one statement and
+            commits. The question pool, the search backend, the
+            suggestions and the response cache are told about them. Raises
+            the database error after a rollback.
+            return:
+                array: (id, category, question, answer) of the deleted
+                    rows
+        """
+        try:
+            deleted = delete_questions(ids)
+            search_questions_deleted(db.session, [row.id for row in deleted])
+            questions_deleted(
+                db.session, [(row.id, row.category) for row in deleted]
+            )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        suggest_index.questions_deleted(deleted)
+        if response_cache is not None:
+            response_cache.questions_changed([
+                dict(row.items()) for row in deleted
+            ])
+        return deleted
 
     @app.route('/categories', methods=['GET'])
     def get_categories():
@@ -70,18 +415,39 @@ def create_app(test_config=None):
                     success: True
                     categories: Categories Array
                     count: amount of categories
-                404:
-                    description: if no categories on db.
+                304:
+                    description: if If-None-Match matches the ETag.
         """
-        categories = get_formatted_categories()
-        if categories is None:
-            abort(404)
+        # The body is serialized once per cache version; browsers revalidate
+        # with If-None-Match and get a 304 while categories don't change
+        body, etag = category_cache.response()
+        response = app.response_class(body, mimetype='application/json')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
 
-        return jsonify({
-            'success': True,
-            'categories': categories,
-            'count': len(categories)
-        })
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        """ Metrics route.
+        get:
+            summary: Request and database metrics.
+            description: Latency histogram, responses by status, SQL
+                statements, time spent in them and waiting for a pool
+                connection, by route, since the app started, the pool
+                size, the response cache hits, misses and memory, the
+                quiz scores received and written, the requests refused
+                by the rate limiter, the quiz decks dealt and the reads
+                served by each read replica.
+                Prometheus text format.
+            responses:
+                200:
+                    text/plain metrics
+        """
+        return app.response_class(
+            metrics.render(db.engine.pool, response_cache, score_recorder,
+                           rate_limiter, quiz_decks, replica_router),
+            content_type='text/plain; version=0.0.4; charset=utf-8'
+        )
 
     @app.route('/questions', methods=['GET'])
     def get_questions():
@@ -89,7 +455,9 @@ def create_app(test_config=None):
         GET:
             summary: return array with questions
             description: Get paginated questions. If a search string is
-                provided, it will return the seach result.
+                provided, it will return the seach result, best match first.
+                Every word of the search string is matched as a prefix of
+                the words of the question and the answer.
             parameters:
                 - Page: int
                     type: GET arg: ie '?page=1'
@@ -99,44 +467,125 @@ def create_app(test_config=None):
                     type: GET arg: ie '?question=know'
                     Desc: Search term. If present it will conduct a search
                     required: no
+                - after: str
+                    type: GET arg: ie '?after=MTA'
+                    Desc: next_cursor of the previous page (or a question
+                        id). If present, returns the questions after it
+                        instead of a page. Not allowed with a search.
+                    required: no
+                - limit: int
+                    type: GET arg: ie '?after=MTA&limit=20'
+                    Desc: questions per cursor page, up to 100
+                    required: no
+                - count: str
+                    type: GET arg: ie '?count=exact'
+                    Desc: count the questions in db instead of using the
+                        cached total
+                    required: no
             responses:
                 200:
                     success: True,
-                    questions: array of formatted questions,
-                    current_page: (int) current page,
+                    questions: array of formatted questions, on a search
+                        each one has a relevance score (None with the
+                        ilike backend)
+                    current_page: (int) current page, without after
+                    next_cursor: str, with after. None on the last page
                     total_questions: (int) total questions in db,
                     categories: format_categories,
                 404:
                     success: False,
                     message: error message.
                     code: 404
+                429:
+                    description: searches only, if the client made too
+                        many (RATE_LIMIT). Retry-After: seconds to wait.
         """
-        current_page = int(request.args.get('page', 1))
         search = request.args.get('question', None)
-        q = Question.query
-        # if it's a search, let's add it to the ORM as filter
+        after = request.args.get('after', None)
+        key, generation, body = None, None, None
+        if request.args.get('count') != 'exact':
+            key, generation, body = cached_body()
+        if body is not None:
+            return json_body(body)
+        response = {'success': True}
+        # if it's a search, let the search backend find and rank matches
         if search:
-            q = q.filter(
-                Question.question.ilike(
-                    "%{0}%".format(search)
-                )
+            if after is not None:
+                abort(400)
+            try:
+                current_page = int(request.args.get('page', 1))
+            except ValueError:
+                abort(400)
+            results, total = search_backend.search(
+                search,
+                max(current_page - 1, 0) * questions_per_page,
+                questions_per_page
             )
-        # Using paginate built-in SQLAlquemy methods
-        questions = q.paginate(
-            current_page,
-            QUESTIONS_PER_PAGE,
-            False
-        )
-        if len(questions.items) == 0:
+            format_questions = []
+            for qt, score in results:
+                question = qt.format()
+                question['score'] = score
+                format_questions.append(question)
+            response['current_page'] = current_page
+        else:
+            # The total comes from the question pool, so listing a page
+            # doesn't need a COUNT(*) unless an exact count is asked for
+            if request.args.get('count') == 'exact':
+                total = Question.query.count()
+            else:
+                total = question_pool.count()
+            format_questions = format_rows(paginate_questions(
+                db.session.query(*QUESTION_COLUMNS), response
+            ))
+        if len(format_questions) == 0:
             abort(404)
-        format_questions = [qt.format() for qt in questions.items]
-        format_categories = get_formatted_categories()
-        return jsonify({
-            'success': True,
+        response.update({
             'questions': format_questions,
-            'current_page': current_page,
-            'total_questions': questions.total,
-            'categories': format_categories,
+            'total_questions': total,
+            'categories': get_formatted_categories(),
+        })
+        tags = [ResponseCache.search_tag(search)] if search \
+            else ['questions']
+        return cache_response(key, generation, json_response(response), tags)
+
+    @app.route('/questions/suggest', methods=['GET'])
+    def suggest_questions():
+        """ Suggestions route.
+        GET:
+            summary: Search-as-you-type suggestions.
+            description: Completes the last word of prefix with the words
+                of the question texts, most common first. Served from an
+                in-memory index, never from the questions table.
+            parameters:
+                - prefix: str
+                    type: GET arg: ie '?prefix=which cap'
+                    Desc: text typed in the search box
+                    required: yes
+                - limit: int
+                    type: GET arg: ie '?prefix=cap&limit=5'
+                    Desc: suggestions returned, up to 20 (default 10)
+                    required: no
+            responses:
+                200:
+                    success: True,
+                    prefix: the prefix
+                    suggestions: array of prefix with its last word
+                        completed, empty if the last word is shorter than
+                        2 characters
+                400:
+                    description: if prefix is missing or limit is not a
+                        number.
+        """
+        prefix = request.args.get('prefix')
+        limit = request.args.get('limit', type=int)
+        if 'limit' not in request.args:
+            limit = 10
+        if prefix is None or limit is None or limit < 0:
+            abort(400)
+        return json_response({
+            'success': True,
+            'prefix': prefix,
+            'suggestions': suggest_index.complete(prefix, limit),
         })
 
     @app.route('/questions/<int:question_id>', methods=['DELETE'])
@@ -144,8 +593,8 @@ def create_app(test_config=None):
         """ Question Delete Route.
         DELETE:
             summary: Deletes a question.
-            description: Seaches for a question based on an id
-                If found, it deletes the question.
+            description: Deletes the question with the given id with a
+                single statement, if it exists.
             parameters:
                 - question_id: int
                     type: path parameter, ie: '/questions/4'
@@ -161,20 +610,58 @@ def create_app(test_config=None):
                     code: 422
         """
         try:
-            question = Question.query.filter(
-                Question.id == question_id
-            ).one_or_none()
-            if question is None:
-                abort(404)
-
-            question.delete()
-            return jsonify({
-                'success': True,
-                'deleted': question_id,
-            })
+            deleted = remove_questions([question_id])
+        except Exception:
+            abort(422)
+        if not deleted:
+            abort(422)
+        return json_response({
+            'success': True,
+            'deleted': question_id,
+        })
 
+    @app.route('/questions', methods=['DELETE'])
+    def delete_questions_batch():
+        """ Questions Batch Delete Route.
+        DELETE:
+            summary: Deletes many questions.
+            description: Deletes the questions of the ids GET arg with one
+                statement, in one transaction.
+            parameters:
+                - ids: str
+                    type: GET arg: ie '?ids=4,5,6'
+                    Desc: comma separated question ids, up to 1000
+                    required: yes
+            responses:
+                200:
+                    success: True,
+                    deleted: array of deleted question ids
+                    not_found: array of ids that didn't exist
+                400:
+                    description: if ids is missing, too long or not a list
+                        of numbers.
+                422:
+                    description: if the database refused the delete.
+        """
+        try:
+            ids = sorted(set(
+                int(question_id)
+                for question_id in request.args.get('ids', '').split(',')
+            ))
+        except ValueError:
+            abort(400)
+        if len(ids) > MAX_BATCH_SIZE:
+            abort(400)
+        try:
+            deleted = remove_questions(ids)
         except Exception:
             abort(422)
+        deleted_ids = set(row.id for row in deleted)
+        return json_response({
+            'success': True,
+            'deleted': sorted(deleted_ids),
+            'not_found': [qid for qid in ids if qid not in deleted_ids],
+        })
 
     @app.route('/questions', methods=['POST'])
     def create_question():
@@ -182,84 +669,332 @@ def create_app(test_config=None):
         POST:
             summary: Inserts a new question on db.
             description: Takes vars from a form POST and insert
-                the new question in db.
+                the new question in db: one SELECT for its duplicates,
+                then one INSERT for it and one for its LSH buckets.
             parameters:
                 - question: text
                 - answer: text
                 - difficulty: int, 1 to 5
                 - category: int, category id.
+                - allow_duplicates: bool, insert it even if it duplicates
+                    a question. Default false
             responses:
                 200:
                     success: True,
                     created: int, question id
                     question: question object
+                400:
+                    description: if allow_duplicates is not a boolean.
+                409:
+                    success: False,
+                    message: error message.
+                    duplicates: array of {id, question, similarity} of
+                        the questions it duplicates, most similar first
                 422:
                     success: False,
                     message: error message.
                     code: 422
         """
         body = request.get_json()
+        if body is None:
+            abort(422)
+        try:
+            allow = allow_duplicates(body)
+        except ValueError:
+            abort(400)
 
-        new_question = body.get('question', None)
-        new_answer = body.get('answer', None)
-        new_difficulty = body.get('difficulty', None)
-        new_category = body.get('category', None)
+        question, error = validate(body, set(get_formatted_categories()))
+        if error is not None:
+            abort(422)
+        if not allow:
+            found = find_duplicates(
+                [fingerprint(question['question'])], duplicate_similarity
+            )[0]
+            if found:
+                response = error_body(409)
+                response['duplicates'] = [
+                    {'id': question_id, 'question': text,
+                     'similarity': score}
+                    for question_id, text, score in found
+                ]
+                return json_response(response), 409
+        try:
+            question = save_questions([question])[0]
+        except Exception:
+            abort(422)
 
+        return json_response({
+            'success': True,
+            'created': question['id'],
+            'question': question
+        })
+
+    @app.route('/questions/batch', methods=['POST'])
+    def create_questions_batch():
+        """ add questions Route.
+        POST:
+            summary: Inserts many questions.
+            description: Validates every question of the questions array
+                and inserts the valid ones with one statement, in one
+                transaction. Invalid questions are skipped and reported.
+            parameters:
+                - questions: array of question objects, up to 1000, with
+                    the fields of POST '/questions'
+                - allow_duplicates: bool, insert duplicates of existing
+                    questions or of earlier questions of the array too,
+                    instead of reporting them. Default false
+            responses:
+                200:
+                    success: True,
+                    created: array of new question ids, in request order
+                    errors: array of {index, error} for skipped questions,
+                        invalid or duplicates
+                400:
+                    description: if questions is missing or too long, or
+                        allow_duplicates is not a boolean.
+                422:
+                    description: if the database refused the insert,
+                        nothing is inserted then.
+        """
+        body = request.get_json()
+        if body is None or not isinstance(body.get('questions'), list):
+            abort(400)
+        if len(body['questions']) > MAX_BATCH_SIZE:
+            abort(400)
         try:
-            if new_question and new_answer:
-                question = Question(
-                    question=new_question,
-                    answer=new_answer,
-                    difficulty=new_difficulty,
-                    category=new_category
-                )
-                question.insert()
-
-                return jsonify({
-                    'success': True,
-                    'created': question.id,
-                    'question': question.format()
-                })
+            allow = allow_duplicates(body)
+        except ValueError:
+            abort(400)
+
+        categories = set(get_formatted_categories())
+        rows = []
+        indexes = []
+        errors = []
+        for index, item in enumerate(body['questions']):
+            if isinstance(item, dict):
+                row, error = validate(item, categories)
             else:
-                raise Exception("Parameters are Empty")
+                row, error = None, 'Expected a question object'
+            if error is not None:
+                errors.append({'index': index, 'error': error})
+            else:
+                rows.append(row)
+                indexes.append(index)
+        if not allow:
+            duplicates = duplicate_errors(
+                rows, duplicate_similarity,
+                lambda position: 'index {0}'.format(indexes[position])
+            )
+            errors.extend(
+                {'index': index, 'error': error}
+                for index, error in zip(indexes, duplicates)
+                if error is not None
+            )
+            errors.sort(key=lambda error: error['index'])
+            rows = [
+                row for row, error in zip(rows, duplicates) if error is None
+            ]
+        try:
+            created = save_questions(rows)
         except Exception:
             abort(422)
 
+        return json_response({
+            'success': True,
+            'created': [row['id'] for row in created],
+            'errors': errors
+        })
+
+    def get_bulk_format():
+        """ Bulk format.
+        description: Reads the format GET arg, or guesses it from the
+            Content-Type. Aborts with 400 if it is not jsonl or csv.
+        """
+        file_format = request.args.get('format')
+        if file_format is None:
+            file_format = 'csv' if request.mimetype == 'text/csv' \
+                else 'jsonl'
+        if file_format not in FORMATS:
+            abort(400)
+        return file_format
+
+    @app.route('/questions/import', methods=['POST'])
+    def import_questions_route():
+        """ import questions Route.
+        POST:
+            summary: Inserts many questions at once.
+            description: Reads the request body as it is streamed, as JSON
+                Lines (one question object per line) or CSV with a
+                question,answer,category,difficulty header. Rows are
+                validated and inserted in batches in one transaction;
+                invalid rows, and duplicates of existing questions or of
+                earlier rows, are skipped and reported.
+            parameters:
+                - format: str
+                    type: GET arg: ie '?format=csv'
+                    Desc: jsonl or csv. By default csv if the Content-Type
+                        is text/csv, jsonl otherwise
+                    required: no
+                - allow_duplicates: str
+                    type: GET arg: ie '?allow_duplicates=true'
+                    Desc: import duplicates too
+                    required: no
+            responses:
+                200:
+                    success: True,
+                    inserted: int, questions inserted
+                    failed: int, rows skipped
+                    errors: array of {line, error}, up to 1000
+                400:
+                    description: if the format is unknown.
+                422:
+                    description: if the database refused the import,
+                        nothing is inserted then.
+        """
+        file_format = get_bulk_format()
+        allow = request.args.get('allow_duplicates', '').lower() \
+            in TRUE_VALUES
+        try:
+            report = import_questions(
+                request.stream, file_format, set(get_formatted_categories()),
+                duplicate_similarity=None if allow else duplicate_similarity
+            )
+        except Exception:
+            abort(422)
+        finally:
+            question_pool.invalidate()
+            search_backend.refresh()
+            suggest_index.refresh()
+            if response_cache is not None:
+                response_cache.clear()
+
+        report['success'] = True
+        return json_response(report)
+
+    @app.route('/questions/export', methods=['GET'])
+    def export_questions_route():
+        """ export questions Route.
+        GET:
+            summary: Streams every question.
+            description: Returns every question, in id order, as JSON
+                Lines or CSV with an id,question,answer,category,difficulty
+                header. The rows are read and written in batches.
+            parameters:
+                - format: str
+                    type: GET arg: ie '?format=csv'
+                    Desc: jsonl (default) or csv
+                    required: no
+            responses:
+                200:
+                    JSON Lines or CSV
+                400:
+                    description: if the format is unknown.
+        """
+        file_format = get_bulk_format()
+        mimetype = 'text/csv' if file_format == 'csv' \
+            else 'application/x-ndjson'
+        return app.response_class(
+            stream_with_context(export_questions(file_format)),
+            mimetype=mimetype
+        )
+
     @app.route('/categories/<int:category_id>/questions')
     def get_category_questions(category_id):
         """ Cagetories/$/questions route.
         GET:
             summary: Questions by category.
             description: Return a list of questions
-                depending on the category
+                depending on the category, paginated like /questions
             parameters:
                 - cateogory id: int
                     type: path parameter, ie: '/categories/4/questions'
                     Desc: category db id
+                - page, after, limit:
+                    type: GET args, same as in /questions
+                    required: no
+                - stream: str
+                    type: GET arg: ie '?stream=true'
+                    Desc: return every question of the category in one
+                        streamed response instead of a page
+                    required: no
             responses:
                 200:
                     success: True,
                     questions: array of question objects
-                    total_questions: (int) total questions
+                    total_questions: (int) total questions in the category
                     categories: array of categories,
                     current_category: (int) current category
+                    current_page or next_cursor: as in /questions,
+                        not present when streaming
+                400:
+                    description: if page, after or limit are not valid.
                 404:
                     description: if no questions on db.
         """
-        questions = Question.query.filter(
+        key, generation, body = None, None, None
+        if request.args.get('stream') != 'true':
+            key, generation, body = cached_body()
+        if body is not None:
+            return json_body(body)
+        query = db.session.query(*QUESTION_COLUMNS).filter(
             Question.category == category_id
-            ).all()
-        if len(questions) == 0:
-            abort(404)
-
-        format_questions = [qt.format() for qt in questions]
-        return jsonify({
+        )
+        response = {
             'success': True,
-            'questions': format_questions,
-            'total_questions': len(format_questions),
             'categories': get_formatted_categories(),
             'current_category': category_id
+        }
+        if request.args.get('stream') == 'true':
+            return stream_questions(query, response)
+
+        questions = paginate_questions(query, response, category_id)
+        if len(questions) == 0:
+            abort(404)
+
+        response.update({
+            'questions': format_rows(questions),
+            'total_questions': question_pool.count(category_id),
         })
+        return cache_response(
+            key, generation, json_response(response),
+            ['category:{0}'.format(category_id)]
+        )
+
+    def get_quiz_category(body):
+        """ Quiz category.
+        description: Reads the quiz_category object of a quiz request.
+            Aborts with 400 if it is missing or its id is not a number.
+            return:
+                int: category id, 0 (all categories) for ids below 1
+        """
+        try:
+            return quiz_category(body)
+        except ValueError:
+            abort(400)
+
+    def load_quiz_question(next_id, discard=None):
+        """ Quiz question.
+        description: Loads the question returned by next_id by its primary
+            key. If the row was deleted by another process it is skipped
+            (and passed to discard) and next_id is called again. Rows
+            missing on a read replica are looked up on the primary first,
+            since they may be new.
+            return:
+                Question or None when next_id runs out of ids
+        """
+        while True:
+            question_id = next_id()
+            if question_id is None:
+                return None
+            question = Question.query.get(question_id)
+            if question is None \
+                    and db.session.info.get(REPLICA_KEY) is not None:
+                with primary_reads():
+                    question = Question.query.get(question_id)
+            if question is not None:
+                return question
+            if discard is not None:
+                discard(question_id)
 
     @app.route('/quizzes', methods=['POST'])
     def play_quiz():
@@ -279,86 +1014,356 @@ def create_app(test_config=None):
                     type: POST parameter
                     Desc: array of int: question ids
                     required: yes, but it can be empty
+                - adaptive: bool
+                    type: POST parameter
+                    Desc: pick the question by difficulty, from the
+                        player's level and last answer
+                    required: no
+                - difficulty: int
+                    type: POST parameter
+                    Desc: adaptive mode, the difficulty returned by the
+                        last call
+                    required: no, defaults to 3
+                - last_answer_correct: bool
+                    type: POST parameter
+                    Desc: adaptive mode, whether the last question was
+                        answered right (one level up) or wrong (one
+                        level down)
+                    required: no
+                - hide_answer: bool
+                    type: POST parameter
+                    Desc: leave the answer out of the question, to check
+                        it with POST '/quizzes/answer'
+                    required: no
             responses:
                 200:
                     success: True,
                     question: question object
+                    difficulty: (int) adaptive mode, the player's level.
+                        The question is of this difficulty, or of the
+                        nearest one left.
                 404:
                     description: if no questions on db.
+                429:
+                    description: if the client played too many questions
+                        (RATE_LIMIT). Retry-After: seconds to wait.
         """
         # Get category and prev questions
         body = request.get_json()
-        if body is None:
-            abort(400)
-        quiz_cat = body.get('quiz_category', None)
-        if quiz_cat is None:
-            abort(400)
-        category = quiz_cat.get('id')
-        previous_questions = body.get('previous_questions', None)
+        category = get_quiz_category(body)
 
         # Both vars are requied, so if not provided return error
-        if category is None or previous_questions is None:
+        try:
+            previous = previous_questions(body)
+            difficulty, direction = adaptive_difficulty(body)
+            hide = hide_answer(body)
+        except ValueError:
             abort(400)
-        Q = Question.query
 
-        # if provided with category, added to the filter
-        if int(category) > 0:
-            Q = Question.query.filter(Question.category == category)
-
-        # Return first random question NOT IN previous questions
-        question = Q.filter(
-                ~Question.id.in_(previous_questions)
-            ).order_by(func.random()).first()
+        # Pick a random id from the in-memory pool and load only that row
+        if difficulty is None:
+            question = load_quiz_question(
+                lambda: question_pool.pick(category, previous),
+                question_pool.discard
+            )
+        else:
+            question = load_quiz_question(
+                lambda: question_pool.pick_nearest(
+                    category, previous, difficulty, direction
+                ),
+                question_pool.discard
+            )
 
         # If question is an object, format it, otherwise var is None
         # which is the right functionality
         if question:
             question = question.format()
-        return jsonify({
-                'success': True,
-                'question': question
-            })
+            if hide:
+                del question['answer']
+        response = {
+            'success': True,
+            'question': question
+        }
+        if difficulty is not None:
+            response['difficulty'] = difficulty
+        return json_response(response)
+
+    @app.route('/quizzes/answer', methods=['POST'])
+    def check_quiz_answer():
+        """ quiz answer route.
+        POST:
+            summary: Checks the answer to a quiz question.
+            description: Compares the answer with the answer of the
+                question, both case-folded and without accents,
+                punctuation or articles (a, an, the). A few typos are
+                accepted in longer answers, but numbers must be exact.
+            parameters:
+                - question_id: int
+                    type: POST parameter
+                    Desc: question db id
+                    required: yes
+                - answer: str
+                    type: POST parameter
+                    Desc: the player's answer
+                    required: yes
+            responses:
+                200:
+                    success: True,
+                    question_id: (int) the question id
+                    correct: (bool) whether the answer is right
+                    answer: (str) the right answer
+                400:
+                    description: if question_id or answer is missing.
+                404:
+                    description: if the question does not exist.
+        """
+        try:
+            question_id, guess = quiz_answer(request.get_json())
+        except ValueError:
+            abort(400)
+
+        row = db.session.query(
+            Question.answer, Question.answer_normalized
+        ).filter(Question.id == question_id).first()
+        if row is None:
+            abort(404)
+        answer, normalized = row
+        if normalized is None:
+            normalized = normalize_answer(answer)
+        return json_response({
+            'success': True,
+            'question_id': question_id,
+            'correct': answer_matches(guess, normalized),
+            'answer': answer
+        })
+
+    @app.route('/scores', methods=['POST'])
+    def record_score():
+        """ scores route.
+        POST:
+            summary: Records the score of a finished quiz.
+            description: Scores are buffered and written in batches, but
+                they are in the leaderboards right away.
+            parameters:
+                - player: str
+                    type: POST parameter
+                    Desc: player name, up to 64 characters
+                    required: yes
+                - quiz_category id: int
+                    type: POST parameter
+                    Desc: category db id, 0 for all categories
+                    required: yes
+                - score: int
+                    type: POST parameter
+                    Desc: questions answered right
+                    required: yes
+                - total: int
+                    type: POST parameter
+                    Desc: questions of the quiz, at least score
+                    required: yes
+            responses:
+                200:
+                    success: True,
+                    rank: (int) rank in the category leaderboard, None if
+                        the score is not in it
+                400:
+                    description: if a parameter is missing or invalid.
+        """
+        try:
+            player, category, score, total = quiz_score(request.get_json())
+        except ValueError:
+            abort(400)
+
+        # Loads the boards before the first score, so it gets a rank
+        leaderboard.refresh()
+        return json_response({
+            'success': True,
+            'rank': score_recorder.record(player, category, score, total)
+        })
+
+    @app.route('/leaderboard', methods=['GET'])
+    def get_leaderboard():
+        """ leaderboard route.
+        get:
+            summary: Best players.
+            description: Returns the best score of the best players, best
+                first, of every quiz or of the quizzes of one category.
+                Served from memory, never from the scores table.
+            parameters:
+                - category: int
+                    type: GET parameter
+                    Desc: category db id, 0 for the quizzes over all
+                        categories, every quiz if missing
+                    required: no
+                - limit: int
+                    type: GET parameter
+                    Desc: players returned, up to LEADERBOARD_SIZE
+                    required: no
+            responses:
+                200:
+                    success: True,
+                    category: category id or None
+                    leaderboard: array of {rank, player, score, total}
+                400:
+                    description: if category or limit is not a number.
+        """
+        category = request.args.get('category', Leaderboard.GLOBAL, type=int)
+        limit = request.args.get('limit', leaderboard.size, type=int)
+        if ('category' in request.args and category is None) \
+                or limit is None or limit < 0:
+            abort(400)
+        return json_response({
+            'success': True,
+            'category': category,
+            'leaderboard': leaderboard.top(category, limit)
+        })
+
+    @app.route('/quizzes/sessions', methods=['POST'])
+    def start_quiz_session():
+        """ quiz sessions route.
+        POST:
+            summary: Starts a quiz session.
+            description: Creates a server-side quiz over the questions of
+                a category, so following calls only have to send the
+                session token instead of every previous question. With
+                QUIZ_DECKS, the quiz plays a precomputed shuffled deck.
+            parameters:
+                - quiz_category id: int
+                    type: POST parameter
+                    Desc: category db id, 0 for all categories
+                    required: yes
+            responses:
+                200:
+                    success: True,
+                    session: str, session token
+                    total_questions: (int) questions in the quiz
+                    expires_in: (int) seconds the session lives unused
+                400:
+                    description: if quiz_category is missing.
+                429:
+                    description: if the client played too many questions
+                        (RATE_LIMIT). Retry-After: seconds to wait.
+        """
+        category = get_quiz_category(request.get_json())
+        deck = quiz_decks.deal(category) if quiz_decks else None
+        if deck is None:
+            session = quiz_sessions.start(
+                category, question_pool.ids(category)
+            )
+        else:
+            session = quiz_sessions.start(category, deck, shuffled=True)
+        return json_response({
+            'success': True,
+            'session': session.token,
+            'total_questions': session.remaining,
+            'expires_in': quiz_sessions.ttl
+        })
+
+    def missing_quiz_session(token):
+        """ Aborts a request for a session this process doesn't have:
+            421 when another process started it, else 404.
+        """
+        if not quiz_sessions.owns(token):
+            raise MisdirectedRequest()
+        abort(404)
+
+    @app.route('/quizzes/sessions/<token>', methods=['POST'])
+    def play_quiz_session(token):
+        """ quiz session route.
+        POST:
+            summary: Return the next question of a quiz session.
+            description: Returns a question of the session category that
+                has not been returned before in this session.
+            parameters:
+                - token: str
+                    type: path parameter, ie: '/quizzes/sessions/abc'
+                    Desc: session token returned when the session started
+            responses:
+                200:
+                    success: True,
+                    question: question object, or None once no question
+                        is left, like POST '/quizzes'. The session ends
+                        with it.
+                    remaining: (int) questions left after this one, not
+                        set once no question is left
+                404:
+                    description: if the session is unknown, expired or
+                        over.
+                421:
+                    description: if the session was started by another
+                        server process.
+                429:
+                    description: if the client played too many questions
+                        (RATE_LIMIT). Retry-After: seconds to wait.
+        """
+        session = quiz_sessions.get(token)
+        if session is None:
+            missing_quiz_session(token)
+
+        question = load_quiz_question(lambda: quiz_sessions.next(token)[1])
+        if question is None:
+            return json_response({'success': True, 'question': None})
+        return json_response({
+            'success': True,
+            'question': question.format(),
+            'remaining': session.remaining
+        })
+
+    @app.route('/quizzes/sessions/<token>', methods=['DELETE'])
+    def end_quiz_session(token):
+        """ quiz session route.
+        DELETE:
+            summary: Ends a quiz session.
+            responses:
+                200:
+                    success: True,
+                    deleted: str, session token
+                404:
+                    description: if the session is unknown or expired.
+                421:
+                    description: if the session was started by another
+                        server process.
+        """
+        if not quiz_sessions.end(token):
+            missing_quiz_session(token)
+        return json_response({
+            'success': True,
+            'deleted': token
+        })
 
     @app.errorhandler(400)
     def err_malformed(error):
-        return jsonify({
-            "success": False,
-            "error": 400,
-            "message": "Malformed request"
-        }), 400
+        return json_response(error_body(400)), 400
 
     @app.errorhandler(404)
     def err_not_found(error):
-        return jsonify({
-            "success": False,
-            "error": 404,
-            "message": "Resource not found"
-        }), 404
+        return json_response(error_body(404)), 404
 
     @app.errorhandler(405)
     def err_not_allowed(error):
-        return jsonify({
-            "success": False,
-            "error": 405,
-            "message": "Method not allowed"
-        }), 405
+        return json_response(error_body(405)), 405
+
+    @app.errorhandler(MisdirectedRequest)
+    def err_misdirected(error):
+        return json_response(error_body(421)), 421
 
     @app.errorhandler(422)
     def err_unprocessable(error):
-        return jsonify({
-            "success": False,
-            "error": 422,
-            "message": "Unprocessable Entity"
-        }), 422
+        return json_response(error_body(422)), 422
+
+    @app.errorhandler(429)
+    def err_too_many_requests(error):
+        return json_response(error_body(429)), 429, {
+            'Retry-After': getattr(g, 'retry_after', '1')
+        }
 
     # Rubric requires add error 500 but this won't be shown because if an error
     # 500 occurs, the server won't execute properly this script
     @app.errorhandler(500)
     def err_internalserver(error):
-        return jsonify({
-            "success": False,
-            "error": 500,
-            "message": "Internal server error"
-        }), 500
+        return json_response(error_body(500)), 500
+
+    if settings['WARMUP'] == 'background':
+        start_warmup(app)
 
     return app
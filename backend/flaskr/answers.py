@@ -0,0 +1,126 @@
+import re
+import unicodedata
+
+from sqlalchemy import event
+
+from models import db, Question
+
+ARTICLES = frozenset(['a', 'an', 'the'])
+WORD = re.compile(r'\w+')
+NUMBER = re.compile(r'\d+')
+
+
+def normalize_answer(text):
+    """ Normalized answer.
+    description: Case-folds text, strips accents, punctuation and the
+        articles a, an and the, and joins the remaining words with single
+        spaces, ie: 'The Palace of Versailles!' -> 'palace of versailles'.
+        Questions store it in answer_normalized when they are written.
+    """
+    if not text:
+        return ''
+    text = unicodedata.normalize('NFKD', text.casefold())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(
+        word for word in WORD.findall(text) if word not in ARTICLES
+    )
+
+
+def allowed_edits(answer):
+    """ Typos accepted in a guess of a normalized answer: none up to 3
+        characters, 1 up to 7, then 1 per 5 characters, at most 3.
+    """
+    if len(answer) <= 3:
+        return 0
+    if len(answer) <= 7:
+        return 1
+    return min(len(answer) // 5, 3)
+
+
+def within_edits(first, second, limit):
+    """ True if the Levenshtein distance of first and second is at most
+        limit. Only the cells less than limit away from the diagonal are
+        computed, and it stops as soon as a row is over limit, so it takes
+        O(len * limit) at worst.
+    """
+    if abs(len(first) - len(second)) > limit:
+        return False
+    if first == second:
+        return True
+    too_far = limit + 1
+    previous = list(range(len(second) + 1))
+    for row, char in enumerate(first, 1):
+        start = max(1, row - limit)
+        end = min(len(second), row + limit)
+        current = [too_far] * (len(second) + 1)
+        if start == 1:
+            current[0] = row
+        best = current[0]
+        for column in range(start, end + 1):
+            cost = 0 if second[column - 1] == char else 1
+            value = min(
+                previous[column - 1] + cost,
+                previous[column] + 1,
+                current[column - 1] + 1,
+            )
+            current[column] = value
+            if value < best:
+                best = value
+        if best > limit:
+            return False
+        previous = current
+    return previous[len(second)] <= limit
+
+
+def answer_matches(guess, normalized):
+    """ Answer check.
+    description: Compares a guess with the normalized answer of a question.
+        The normalized guess must be equal, or within allowed_edits() typos
+        when both have the same numbers (so 1990 never matches 1991).
+        Empty guesses never match.
+    """
+    guess = normalize_answer(guess)
+    if not guess or not normalized:
+        return False
+    if guess == normalized:
+        return True
+    if NUMBER.findall(guess) != NUMBER.findall(normalized):
+        return False
+    return within_edits(guess, normalized, allowed_edits(normalized))
+
+
+def _normalize_target(mapper, connection, target):
+    target.answer_normalized = normalize_answer(target.answer)
+
+
+# Questions written through the model; set-based inserts (flaskr.bulk)
+# fill answer_normalized themselves
+event.listen(Question, 'before_insert', _normalize_target)
+event.listen(Question, 'before_update', _normalize_target)
+
+
+def normalize_missing_answers(batch_size=1000):
+    """ Fills answer_normalized of the questions that have none (rows
+        written before the column existed), batch_size rows per statement.
+        Commits and returns how many rows were updated.
+    """
+    table = Question.__table__
+    updated = 0
+    while True:
+        rows = db.session.execute(
+            db.select([table.c.id, table.c.answer]).where(
+                table.c.answer_normalized.is_(None)
+            ).order_by(table.c.id).limit(batch_size)
+        ).fetchall()
+        if not rows:
+            break
+        db.session.execute(
+            table.update().where(
+                table.c.id == db.bindparam('row_id')
+            ).values(answer_normalized=db.bindparam('normalized')),
+            [{'row_id': question_id, 'normalized': normalize_answer(answer)}
+             for question_id, answer in rows]
+        )
+        db.session.commit()
+        updated += len(rows)
+    return updated
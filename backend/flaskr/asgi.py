@@ -0,0 +1,771 @@
+""" ASGI entry point.
+description: Serves the trivia API from an asyncio event loop, so waiting
+    for the database doesn't hold a thread per request:
+
+        uvicorn --factory flaskr.asgi:create_asgi_app
+
+    The read routes of a quiz player (GET /categories, GET /questions
+    without a search, GET /categories/<id>/questions, /quizzes and the quiz
+    session routes) have async handlers that read questions with asyncpg.
+    They use the question pool, category cache and quiz sessions of the
+    Flask app built by create_app(), and the same validation and JSON
+    encoder (flaskr.serialization), so they return the same JSON. Every
+    other request (writes, search, import/export, streaming, /metrics) runs
+    on the Flask app in a thread pool of ASGI_THREADS threads.
+
+    Without asyncpg, or when the database is not PostgreSQL, the async
+    handlers read through SQLAlchemy on the thread pool instead
+    (ASYNC_DB_DRIVER=threads forces it). With DB_REPLICA_URLS, their reads
+    go to the replicas like those of the Flask app (flaskr.replicas).
+"""
+import asyncio
+import io
+import json
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from sqlalchemy.engine.url import make_url
+from werkzeug.http import parse_cookie, parse_etags
+from werkzeug.urls import url_decode
+
+from models import db, Question, REPLICA_KEY, TRUE_VALUES, get_setting
+from . import create_app
+from .metrics import count_statements
+from .pagination import encode_cursor, page_args
+from .question_pool import QuestionPool
+from .replicas import PIN_COOKIE
+from .responses import CORS_HEADERS, error_body
+from .serialization import (
+    QUESTION_COLUMNS, QUESTION_FIELDS, dumps, format_rows
+)
+from .validation import (
+    adaptive_difficulty, hide_answer, previous_questions, quiz_category
+)
+
+try:
+    import asyncpg
+except ImportError:  # optional, the threads driver is used without it
+    asyncpg = None
+
+SELECT_COLUMNS = ', '.join(QUESTION_FIELDS)
+
+
+class HTTPError(Exception):
+    """ Raised by async handlers to answer with a JSON error. """
+
+    def __init__(self, code):
+        super(HTTPError, self).__init__(code)
+        self.code = code
+
+
+class Request(object):
+    """ Request served by an async handler. statements and db_seconds add
+        up the database reads made for it, for the metrics. replica is the
+        engine of the read replica it reads from, None for the primary.
+    """
+    __slots__ = ('method', 'path', 'args', 'headers', 'body', 'statements',
+                 'db_seconds', 'replica')
+
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.args = url_decode(scope['query_string'])
+        self.headers = {
+            name.decode('latin-1').lower(): value.decode('latin-1')
+            for name, value in scope['headers']
+        }
+        self.body = body
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.replica = None
+
+    def get_json(self):
+        """ Like Flask's request.get_json(): None unless the body is sent
+            as JSON, a 400 error if it doesn't parse.
+        """
+        mimetype = self.headers.get('content-type', '').split(';')[0]
+        mimetype = mimetype.strip().lower()
+        if mimetype != 'application/json' and not (
+                mimetype.startswith('application/')
+                and mimetype.endswith('+json')):
+            return None
+        try:
+            return json.loads(self.body.decode('utf-8'))
+        except ValueError:
+            raise HTTPError(400)
+
+
+class AsyncpgDatabase(object):
+    """ Question reads with asyncpg.
+    description: The connection pool is created on first use, in the
+        running event loop, and closed by close(). Reads of requests
+        routed to a read replica go to its AsyncpgDatabase in replicas,
+        by replica engine.
+    """
+    name = 'asyncpg'
+
+    def __init__(self, dsn, min_size=1, max_size=15, **options):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.options = options
+        self.replicas = {}
+        self._pool = None
+        self._lock = None
+
+    @classmethod
+    def from_config(cls, config, uri=None):
+        """ Pool settings from the DB_* settings used by setup_db(), for
+            uri or the primary. In PgBouncer mode prepared statements are
+            not cached and no startup options are sent.
+        """
+        url = make_url(
+            uri or get_setting(config, 'SQLALCHEMY_DATABASE_URI')
+        )
+        url.drivername = 'postgresql'
+        max_size = int(get_setting(config, 'DB_POOL_SIZE', 5)) \
+            + int(get_setting(config, 'DB_MAX_OVERFLOW', 10))
+        options = {}
+        if str(get_setting(config, 'DB_PGBOUNCER', '')).lower() \
+                in TRUE_VALUES:
+            options['statement_cache_size'] = 0
+        else:
+            statement_timeout = get_setting(config, 'DB_STATEMENT_TIMEOUT')
+            if statement_timeout is not None:
+                options['server_settings'] = {
+                    'statement_timeout': str(int(statement_timeout))
+                }
+        return cls(str(url), max_size=max(max_size, 1), **options)
+
+    async def _get_pool(self):
+        if self._pool is None:
+            if self._lock is None:
+                self._lock = asyncio.Lock()
+            async with self._lock:
+                if self._pool is None:
+                    self._pool = await asyncpg.create_pool(
+                        self.dsn, min_size=self.min_size,
+                        max_size=self.max_size, **self.options
+                    )
+        return self._pool
+
+    async def fetch(self, request, sql, *args):
+        replica = self.replicas.get(request.replica)
+        if replica is not None:
+            return await replica.fetch(request, sql, *args)
+        pool = await self._get_pool()
+        start = time.perf_counter()
+        rows = await pool.fetch(sql, *args)
+        request.statements += 1
+        request.db_seconds += time.perf_counter() - start
+        return rows
+
+    async def question(self, request, question_id):
+        rows = await self.fetch(
+            request,
+            'SELECT {0} FROM questions WHERE id = $1'.format(
+                SELECT_COLUMNS
+            ),
+            question_id
+        )
+        return dict(rows[0]) if rows else None
+
+    async def questions(self, request, category, offset, after, limit):
+        """ Questions in id order, of category if not None, with an id
+            greater than after if not None.
+        """
+        where = []
+        params = []
+        if category is not None:
+            params.append(category)
+            where.append('category = ${0}'.format(len(params)))
+        if after is not None:
+            params.append(after)
+            where.append('id > ${0}'.format(len(params)))
+        sql = 'SELECT {0} FROM questions'.format(SELECT_COLUMNS)
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        params.extend([limit, offset])
+        sql += ' ORDER BY id LIMIT ${0} OFFSET ${1}'.format(
+            len(params) - 1, len(params)
+        )
+        return [dict(row) for row in await self.fetch(request, sql, *params)]
+
+    async def count(self, request):
+        rows = await self.fetch(request, 'SELECT count(*) FROM questions')
+        return rows[0][0]
+
+    async def close(self):
+        for replica in self.replicas.values():
+            await replica.close()
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+
+class ThreadedDatabase(object):
+    """ The same reads through SQLAlchemy, on the thread pool. """
+    name = 'threads'
+
+    def __init__(self, run_sync):
+        self.run_sync = run_sync
+
+    async def run(self, request, fn):
+        """ Runs fn on the thread pool, reading from the replica of
+            request. Adds the statements it ran to those of request.
+        """
+        def routed():
+            if request.replica is not None:
+                db.session.info[REPLICA_KEY] = request.replica
+            result, statements, seconds = count_statements(fn)
+            request.statements += statements
+            request.db_seconds += seconds
+            return result
+        return await self.run_sync(routed)
+
+    async def question(self, request, question_id):
+        def load():
+            question = Question.query.get(question_id)
+            return None if question is None else question.format()
+        return await self.run(request, load)
+
+    async def questions(self, request, category, offset, after, limit):
+        def load():
+            query = db.session.query(*QUESTION_COLUMNS)
+            if category is not None:
+                query = query.filter(Question.category == category)
+            if after is not None:
+                query = query.filter(Question.id > after)
+            return format_rows(query.order_by(
+                Question.id.asc()
+            ).offset(offset).limit(limit).all())
+        return await self.run(request, load)
+
+    async def count(self, request):
+        return await self.run(request, lambda: Question.query.count())
+
+    async def close(self):
+        pass
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] != 'http.request':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            break
+    return b''.join(chunks)
+
+
+def wsgi_environ(scope, body):
+    """ WSGI environ of an ASGI http scope with its whole body. """
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode(
+            'latin-1'
+        ),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': client[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_LENGTH':
+            continue
+        if name == 'CONTENT_TYPE':
+            environ[name] = value
+            continue
+        key = 'HTTP_' + name
+        environ[key] = environ[key] + ',' + value if key in environ \
+            else value
+    return environ
+
+
+class AsgiApp(object):
+    """ ASGI application over a Flask app built by create_app(). """
+
+    def __init__(self, app, threads=16, database=None):
+        self.app = app
+        trivia = app.extensions['trivia']
+        self.question_pool = trivia['question_pool']
+        self.category_cache = trivia['category_cache']
+        self.quiz_sessions = trivia['quiz_sessions']
+        self.quiz_decks = trivia['quiz_decks']
+        self.metrics = trivia['metrics']
+        self.response_cache = trivia['response_cache']
+        self.rate_limiter = trivia['rate_limiter']
+        self.replica_router = trivia['replica_router']
+        self.per_page = trivia['questions_per_page']
+        self.executor = ThreadPoolExecutor(
+            threads, thread_name_prefix='trivia-asgi'
+        )
+        self.database = database or ThreadedDatabase(self.run_sync)
+        # Created in the event loop, by load()
+        self._load_lock = None
+        session = r'/quizzes/sessions/(?P<token>[^/]+)'
+        self.routes = [
+            ('GET', r'/categories', self.get_categories),
+            ('GET', r'/questions', self.get_questions),
+            ('GET', r'/categories/(?P<category_id>\d+)/questions',
+             self.get_category_questions),
+            ('POST', r'/quizzes', self.play_quiz),
+            ('POST', r'/quizzes/sessions', self.start_quiz_session),
+            ('POST', session, self.play_quiz_session),
+            ('DELETE', session, self.end_quiz_session),
+        ]
+        self.routes = [
+            (method, re.compile(pattern), handler)
+            for method, pattern, handler in self.routes
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise RuntimeError('Unsupported ASGI scope: ' + scope['type'])
+        for method, pattern, handler in self.routes:
+            match = pattern.fullmatch(scope['path'])
+            if match is not None and scope['method'] == method:
+                break
+        else:
+            return await self.call_wsgi(scope, receive, send)
+
+        started = time.perf_counter()
+        request = Request(scope, await read_body(receive))
+        wait = self.limit_rate(scope, request, handler.__name__)
+        if not wait:
+            request.replica = self.route(request, handler.__name__)
+        try:
+            if wait:
+                result = 429, error_body(429), [
+                    ('Retry-After', self.rate_limiter.retry_after(wait))
+                ]
+            else:
+                result = await handler(request, **match.groupdict())
+        except HTTPError as error:
+            result = error.code, error_body(error.code)
+        except Exception:
+            # Logged and answered like the Flask app does
+            self.app.logger.error('Exception on %s [%s]', scope['path'],
+                                  scope['method'], exc_info=True)
+            result = 500, error_body(500)
+        if result is None:
+            # left to the Flask app, ie: a search, already counted by the
+            # rate limiter
+            return await self.call_wsgi(scope, receive, send, request.body,
+                                        rate_limit_checked=True)
+
+        status, data = result[:2]
+        headers = list(result[2]) if len(result) > 2 else []
+        if isinstance(data, dict):
+            data = self.render(data)
+        headers.extend(CORS_HEADERS)
+        if status != 304:
+            headers.extend([
+                ('Content-Type', 'application/json'),
+                ('Content-Length', str(len(data))),
+            ])
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in headers
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': data})
+        self.metrics.record(
+            handler.__name__, status, time.perf_counter() - started,
+            request.statements, request.db_seconds
+        )
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def limit_rate(self, scope, request, endpoint):
+        """ Like limit_rate() in create_app(): None, or the seconds the
+            client has to wait. The shared backend only locks a file for
+            a few microseconds, so it is called in the event loop.
+        """
+        if self.rate_limiter is None:
+            return None
+        client = scope.get('client') or ('', 0)
+        return self.rate_limiter.check(
+            endpoint, request.args, client[0],
+            request.headers.get('x-forwarded-for')
+        )
+
+    def route(self, request, endpoint):
+        """ Like the replica router hooks of create_app(): the engine of
+            the replica request reads from, or None.
+        """
+        if self.replica_router is None:
+            return None
+        cookies = parse_cookie(request.headers.get('cookie', ''))
+        return self.replica_router.replica_for(
+            endpoint, cookies.get(PIN_COOKIE)
+        )
+
+    def render(self, data):
+        """ JSON body of data, as json_response() of the Flask app. """
+        return dumps(data)
+
+    async def cache_call(self, method, *args):
+        """ Calls a response cache method. The shared backend does I/O,
+            so it is called on the thread pool.
+        """
+        if self.response_cache.backend.name == 'memory':
+            return method(*args)
+        return await self.run_sync(method, *args)
+
+    async def cached_body(self, request):
+        """ Like cached_body() in create_app(): (key, cache generation,
+            body or None).
+        """
+        if self.response_cache is None:
+            return None, None, None
+        await self.ensure_pool()
+        self.response_cache.sync(self.question_pool.loads)
+        await self.load(self.category_cache, self.category_cache.response)
+        key = self.response_cache.key(
+            request.path, request.args, self.category_cache.response()[1]
+        )
+        generation = await self.cache_call(self.response_cache.generation)
+        return key, generation, await self.cache_call(
+            self.response_cache.get, key
+        )
+
+    async def cache_response(self, request, key, generation, response,
+                             tags):
+        """ Renders response, stores it under key (from cached_body())
+            unless request read a stale replica or a write dropped entries
+            since generation, and returns the body.
+        """
+        body = self.render(response)
+        if key is not None and not (
+                self.replica_router is not None
+                and self.replica_router.stale(request.replica)):
+            await self.cache_call(self.response_cache.set, key, body, tags,
+                                  generation)
+        return body
+
+    async def close(self):
+        await self.database.close()
+        self.executor.shutdown(wait=False)
+
+    def _in_app_context(self, fn, *args):
+        with self.app.app_context():
+            return fn(*args)
+
+    async def run_sync(self, fn, *args):
+        """ Runs fn in the thread pool, inside an app context. """
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, partial(self._in_app_context, fn, *args)
+        )
+
+    async def call_wsgi(self, scope, receive, send, body=None,
+                        rate_limit_checked=False):
+        """ Serves the request with the Flask app on the thread pool. The
+            response is sent chunk by chunk as the app yields it.
+        """
+        if body is None:
+            body = await read_body(receive)
+        loop = asyncio.get_running_loop()
+
+        def send_from_thread(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        environ = wsgi_environ(scope, body)
+        if rate_limit_checked:
+            environ['trivia.rate_limit_checked'] = True
+        await loop.run_in_executor(
+            self.executor, self._run_wsgi, environ, send_from_thread
+        )
+
+    def _run_wsgi(self, environ, send):
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [
+                (name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in headers
+            ]
+
+        result = self.app(environ, start_response)
+        try:
+            send({
+                'type': 'http.response.start',
+                'status': response['status'],
+                'headers': response['headers'],
+            })
+            for chunk in result:
+                if chunk:
+                    send({
+                        'type': 'http.response.body',
+                        'body': chunk,
+                        'more_body': True,
+                    })
+            send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+    async def load(self, cache, fn):
+        """ Runs fn on the thread pool if cache is stale, once for all
+            the requests waiting for it.
+        """
+        if cache.stale:
+            if self._load_lock is None:
+                self._load_lock = asyncio.Lock()
+            async with self._load_lock:
+                if cache.stale:
+                    await self.run_sync(fn)
+
+    async def categories(self):
+        await self.load(self.category_cache, self.category_cache.categories)
+        return self.category_cache.categories()
+
+    async def ensure_pool(self):
+        await self.load(self.question_pool, self.question_pool.refresh)
+
+    async def questions_page(self, request, category, response):
+        """ Page of questions asked for by the page, or after and limit,
+            GET args, like paginate_questions() in create_app().
+        """
+        try:
+            page, after, limit = page_args(request.args, self.per_page)
+        except ValueError:
+            raise HTTPError(400)
+        if after is None:
+            response['current_page'] = page
+            await self.ensure_pool()
+            first_id = self.question_pool.id_at(
+                QuestionPool.ALL if category is None else category,
+                max(page - 1, 0) * limit
+            )
+            if first_id is None:
+                return []
+            # Seeks to the first id of the page, like seek_page()
+            return await self.database.questions(
+                request, category, 0, first_id - 1, limit
+            )
+        rows = await self.database.questions(
+            request, category, 0, after, limit + 1
+        )
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]['id'])
+        response['next_cursor'] = next_cursor
+        return rows
+
+    async def load_question(self, request, next_id, discard=None):
+        """ Like load_quiz_question() in create_app(). """
+        while True:
+            question_id = next_id()
+            if question_id is None:
+                return None
+            question = await self.database.question(request, question_id)
+            if question is None and request.replica is not None:
+                # Maybe too new for the replica
+                replica, request.replica = request.replica, None
+                question = await self.database.question(request, question_id)
+                request.replica = replica
+            if question is not None:
+                return question
+            if discard is not None:
+                discard(question_id)
+
+    async def get_categories(self, request):
+        await self.load(self.category_cache, self.category_cache.response)
+        body, etag = self.category_cache.response()
+        headers = [
+            ('ETag', '"{0}"'.format(etag)),
+            ('Cache-Control', 'no-cache'),
+        ]
+        if parse_etags(request.headers.get('if-none-match')).contains(etag):
+            return 304, b'', headers
+        return 200, body, headers
+
+    async def get_questions(self, request):
+        if request.args.get('question'):
+            return None
+        key, generation, body = None, None, None
+        if request.args.get('count') == 'exact':
+            total = await self.database.count(request)
+        else:
+            key, generation, body = await self.cached_body(request)
+            if body is not None:
+                return 200, body
+            await self.ensure_pool()
+            total = self.question_pool.count()
+        response = {'success': True}
+        questions = await self.questions_page(request, None, response)
+        if not questions:
+            raise HTTPError(404)
+        response.update({
+            'questions': questions,
+            'total_questions': total,
+            'categories': await self.categories(),
+        })
+        return 200, await self.cache_response(
+            request, key, generation, response, ['questions']
+        )
+
+    async def get_category_questions(self, request, category_id):
+        if request.args.get('stream') == 'true':
+            return None
+        category_id = int(category_id)
+        key, generation, body = await self.cached_body(request)
+        if body is not None:
+            return 200, body
+        response = {
+            'success': True,
+            'categories': await self.categories(),
+            'current_category': category_id
+        }
+        questions = await self.questions_page(request, category_id, response)
+        if not questions:
+            raise HTTPError(404)
+        await self.ensure_pool()
+        response.update({
+            'questions': questions,
+            'total_questions': self.question_pool.count(category_id),
+        })
+        return 200, await self.cache_response(
+            request, key, generation, response,
+            ['category:{0}'.format(category_id)]
+        )
+
+    async def play_quiz(self, request):
+        body = request.get_json()
+        try:
+            category = quiz_category(body)
+            previous = previous_questions(body)
+            difficulty, direction = adaptive_difficulty(body)
+            hide = hide_answer(body)
+        except ValueError:
+            raise HTTPError(400)
+        await self.ensure_pool()
+        if difficulty is None:
+            next_id = partial(self.question_pool.pick, category, previous)
+        else:
+            next_id = partial(
+                self.question_pool.pick_nearest,
+                category, previous, difficulty, direction
+            )
+        question = await self.load_question(
+            request, next_id, self.question_pool.discard
+        )
+        if question and hide:
+            del question['answer']
+        response = {'success': True, 'question': question}
+        if difficulty is not None:
+            response['difficulty'] = difficulty
+        return 200, response
+
+    async def start_quiz_session(self, request):
+        try:
+            category = quiz_category(request.get_json())
+        except ValueError:
+            raise HTTPError(400)
+        await self.ensure_pool()
+        deck = None
+        if self.quiz_decks is not None:
+            deck = self.quiz_decks.deal(category)
+        if deck is None:
+            session = self.quiz_sessions.start(
+                category, self.question_pool.ids(category)
+            )
+        else:
+            session = self.quiz_sessions.start(category, deck, shuffled=True)
+        return 200, {
+            'success': True,
+            'session': session.token,
+            'total_questions': session.remaining,
+            'expires_in': self.quiz_sessions.ttl
+        }
+
+    def missing_quiz_session(self, token):
+        """ Like missing_quiz_session() in create_app(). """
+        raise HTTPError(404 if self.quiz_sessions.owns(token) else 421)
+
+    async def play_quiz_session(self, request, token):
+        session = self.quiz_sessions.get(token)
+        if session is None:
+            self.missing_quiz_session(token)
+        question = await self.load_question(
+            request, lambda: self.quiz_sessions.next(token)[1]
+        )
+        if question is None:
+            return 200, {'success': True, 'question': None}
+        return 200, {
+            'success': True,
+            'question': question,
+            'remaining': session.remaining
+        }
+
+    async def end_quiz_session(self, request, token):
+        if not self.quiz_sessions.end(token):
+            self.missing_quiz_session(token)
+        return 200, {'success': True, 'deleted': token}
+
+
+def create_asgi_app(test_config=None):
+    """ ASGI app factory.
+    description: Builds the Flask app with create_app(test_config) and
+        serves it as an AsgiApp. ASYNC_DB_DRIVER picks how the async
+        handlers read questions: 'asyncpg' or 'threads'. By default
+        asyncpg on PostgreSQL when it is installed.
+    """
+    app = create_app(test_config)
+    config = app.config
+    asgi_app = AsgiApp(app, int(get_setting(config, 'ASGI_THREADS', 16)))
+    driver = get_setting(config, 'ASYNC_DB_DRIVER')
+    if driver is None:
+        uri = get_setting(config, 'SQLALCHEMY_DATABASE_URI') or ''
+        driver = AsyncpgDatabase.name \
+            if asyncpg is not None and uri.startswith('postgresql') \
+            else ThreadedDatabase.name
+    if driver == AsyncpgDatabase.name:
+        if asyncpg is None:
+            raise RuntimeError('ASYNC_DB_DRIVER is asyncpg but asyncpg is '
+                               'not installed')
+        asgi_app.database = AsyncpgDatabase.from_config(config)
+        if asgi_app.replica_router is not None:
+            asgi_app.database.replicas = {
+                replica.engine: AsyncpgDatabase.from_config(
+                    config, str(replica.engine.url)
+                ) for replica in asgi_app.replica_router.replicas
+            }
+    elif driver != ThreadedDatabase.name:
+        raise ValueError('Unknown ASYNC_DB_DRIVER: {0}'.format(driver))
+    return asgi_app
@@ -0,0 +1,315 @@
+import csv
+import io
+import json
+
+from models import db, Question
+
+from .answers import normalize_answer
+from .duplicates import add_signatures, check_duplicates, question_hash
+
+FIELDS = ['question', 'answer', 'category', 'difficulty']
+# Columns written by the set-based inserts
+INSERT_FIELDS = FIELDS + ['answer_normalized', 'question_hash']
+EXPORT_FIELDS = ['id'] + FIELDS
+FORMATS = ('jsonl', 'csv')
+# Errors kept in the import report, the count of failed rows is always exact
+MAX_REPORTED_ERRORS = 1000
+# Questions created or deleted by one batch request
+MAX_BATCH_SIZE = 1000
+
+
+def read_jsonl(lines):
+    """ Yields (line number, row dict or error message) for JSON Lines.
+        Blank lines are skipped.
+    """
+    for number, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            yield number, 'Invalid JSON: {0}'.format(error)
+            continue
+        if not isinstance(row, dict):
+            yield number, 'Expected a JSON object'
+            continue
+        yield number, row
+
+
+def read_csv(lines):
+    """ Yields (line number, row dict) for CSV with a header row. """
+    decoded = (
+        line.decode('utf-8') if isinstance(line, bytes) else line
+        for line in lines
+    )
+    reader = csv.DictReader(decoded)
+    for row in reader:
+        yield reader.line_num, row
+
+
+READERS = {'jsonl': read_jsonl, 'csv': read_csv}
+
+
+def validate(row, categories):
+    """ Validates one import row.
+    description: question and answer must be non-empty text, difficulty an
+        int from 1 to 5 and category the id of an existing category.
+        difficulty and category can be empty.
+        return:
+            tuple: (values dict, None) or (None, error message)
+    """
+    values = {}
+    for field in ('question', 'answer'):
+        value = row.get(field)
+        if not isinstance(value, str) or not value.strip():
+            return None, 'Missing {0}'.format(field)
+        values[field] = value
+    for field in ('category', 'difficulty'):
+        value = row.get(field)
+        if value is None or value == '':
+            values[field] = None
+            continue
+        try:
+            values[field] = int(value)
+        except (TypeError, ValueError):
+            return None, 'Invalid {0}: {1}'.format(field, value)
+    if values['difficulty'] is not None \
+            and not 1 <= values['difficulty'] <= 5:
+        return None, 'Invalid difficulty: {0}'.format(values['difficulty'])
+    if values['category'] is not None \
+            and values['category'] not in categories:
+        return None, 'Unknown category: {0}'.format(values['category'])
+    return values, None
+
+
+def with_computed_columns(rows):
+    """ Copies of validated rows with their answer_normalized and
+        question_hash.
+    """
+    return [
+        dict(row, answer_normalized=normalize_answer(row['answer']),
+             question_hash=question_hash(row['question']))
+        for row in rows
+    ]
+
+
+def duplicate_errors(rows, similarity, label):
+    """ Error messages of the rows that duplicate a stored question or an
+        earlier row (check_duplicates()), None for the others. label(index)
+        names an earlier row in the messages.
+    """
+    errors = []
+    for found in check_duplicates(rows, similarity):
+        if found is None:
+            errors.append(None)
+        elif found[0] == 'question':
+            errors.append('Duplicate of question {0}'.format(found[1]))
+        else:
+            errors.append('Duplicate of {0}'.format(label(found[1])))
+    return errors
+
+
+def insert_values(values):
+    """ Inserts rows with their computed columns in the current transaction
+        and returns their new ids, in order. PostgreSQL gets a single
+        INSERT ... RETURNING; other databases an executemany, after which
+        the new rows are the ones with the highest ids: SQLite allows one
+        writer at a time, so no other process can insert until the
+        transaction ends, and it gives the rows the next ids in order.
+    """
+    table = Question.__table__
+    if db.engine.dialect.name == 'postgresql':
+        result = db.session.execute(
+            table.insert().values(values).returning(table.c.id)
+        )
+        return [row[0] for row in result]
+    db.session.execute(table.insert(), values)
+    ids = db.session.execute(
+        db.select([table.c.id]).order_by(table.c.id.desc())
+        .limit(len(values))
+    ).fetchall()
+    return [row[0] for row in reversed(ids)]
+
+
+def copy_values(values):
+    """ Inserts rows with their computed columns in the current transaction
+        with COPY (PostgreSQL) and returns their (id, question) pairs. COPY
+        can't return the ids, so the rows are copied into a temporary
+        table, then moved with INSERT ... SELECT ... RETURNING.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in values:
+        writer.writerow([
+            '' if row[field] is None else row[field]
+            for field in INSERT_FIELDS
+        ])
+    buffer.seek(0)
+    fields = ', '.join(INSERT_FIELDS)
+    db.session.execute(
+        'CREATE TEMPORARY TABLE IF NOT EXISTS questions_import '
+        'ON COMMIT DROP AS SELECT {0} FROM questions WITH NO DATA'.format(
+            fields
+        )
+    )
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert(
+        'COPY questions_import ({0}) FROM STDIN WITH (FORMAT csv)'.format(
+            fields
+        ),
+        buffer
+    )
+    rows = db.session.execute(
+        'INSERT INTO questions ({0}) SELECT {0} FROM questions_import '
+        'RETURNING id, question'.format(fields)
+    ).fetchall()
+    db.session.execute('TRUNCATE questions_import')
+    return rows
+
+
+def insert_rows(rows, method):
+    """ Inserts validated rows in the current transaction, with COPY on
+        PostgreSQL ('copy') or a single INSERT ('executemany', see
+        insert_values()), then the buckets of the new rows.
+    """
+    values = with_computed_columns(rows)
+    if method == 'copy':
+        inserted = copy_values(values)
+    else:
+        inserted = zip(insert_values(values), [
+            row['question'] for row in rows
+        ])
+    add_signatures(db.session.connection(), inserted, replace=False)
+
+
+def insert_questions(rows):
+    """ Inserts validated rows in the current transaction and returns them
+        with their new id, see insert_values().
+    """
+    if not rows:
+        return []
+    ids = insert_values(with_computed_columns(rows))
+    add_signatures(db.session.connection(), [
+        (question_id, row['question']) for row, question_id in zip(rows, ids)
+    ], replace=False)
+    return [dict(row, id=question_id) for row, question_id in zip(rows, ids)]
+
+
+def delete_questions(ids):
+    """ Deletes the questions with the given ids in the current transaction
+        and returns (id, category, question, answer) of the rows that
+        existed. PostgreSQL
+        gets a single DELETE ... RETURNING; other databases a SELECT of
+        the rows, then the DELETE.
+    """
+    table = Question.__table__
+    if not ids:
+        return []
+    columns = [table.c.id, table.c.category, table.c.question, table.c.answer]
+    statement = table.delete().where(table.c.id.in_(ids))
+    if db.engine.dialect.name == 'postgresql':
+        return db.session.execute(statement.returning(*columns)).fetchall()
+    deleted = db.session.execute(
+        db.select(columns).where(table.c.id.in_(ids))
+    ).fetchall()
+    db.session.execute(statement)
+    return deleted
+
+
+def import_questions(lines, file_format, categories, batch_size=1000,
+                     method=None, duplicate_similarity=None):
+    """ Bulk question import.
+    description: Reads questions from lines (JSON Lines or CSV with a
+        header), validates them batch_size rows at a time and inserts each
+        batch of valid rows with one statement. Invalid rows are skipped
+        and reported, and so are duplicates of a stored question or of an
+        earlier row when duplicate_similarity is given. Everything is
+        committed once at the end; if the database refuses a batch nothing
+        is imported and the error is raised.
+        parameters:
+            - lines: iterable of str or bytes lines
+            - file_format: 'jsonl' or 'csv'
+            - categories: ids of the existing categories
+            - method: 'copy' (PostgreSQL only) or 'executemany', by
+                default copy on PostgreSQL, see insert_rows()
+            - duplicate_similarity: float, similarity from which rows are
+                duplicates, see flaskr.duplicates. None imports them
+        return:
+            dict: inserted and failed counts, errors as {line, error}
+    """
+    if method is None:
+        method = 'copy' if db.engine.dialect.name == 'postgresql' \
+            else 'executemany'
+    report = {'inserted': 0, 'failed': 0, 'errors': []}
+    batch = []
+    numbers = []
+
+    def fail(number, error):
+        report['failed'] += 1
+        if len(report['errors']) < MAX_REPORTED_ERRORS:
+            report['errors'].append({'line': number, 'error': error})
+
+    def flush():
+        rows = batch
+        if duplicate_similarity is not None:
+            errors = duplicate_errors(
+                batch, duplicate_similarity,
+                lambda index: 'line {0}'.format(numbers[index])
+            )
+            rows = []
+            for number, row, error in zip(numbers, batch, errors):
+                if error is None:
+                    rows.append(row)
+                else:
+                    fail(number, error)
+        if rows:
+            insert_rows(rows, method)
+            report['inserted'] += len(rows)
+        del batch[:]
+        del numbers[:]
+
+    try:
+        for number, row in READERS[file_format](lines):
+            error = row if isinstance(row, str) else None
+            if error is None:
+                row, error = validate(row, categories)
+            if error is not None:
+                fail(number, error)
+                continue
+            batch.append(row)
+            numbers.append(number)
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return report
+
+
+def export_questions(file_format, batch_size=1000):
+    """ Yields every question as JSON Lines or CSV (with a header), in id
+        order, reading batch_size rows at a time through a server-side
+        cursor.
+    """
+    columns = [getattr(Question, field) for field in EXPORT_FIELDS]
+    rows = db.session.query(*columns).order_by(Question.id).yield_per(
+        batch_size
+    )
+    if file_format == 'jsonl':
+        for row in rows:
+            yield json.dumps(dict(zip(EXPORT_FIELDS, row))) + '\n'
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for number, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if number % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
@@ -0,0 +1,98 @@
+import hashlib
+import json
+import threading
+import time
+
+from sqlalchemy import event
+
+from models import primary_reads, Category
+
+# Bumped by every Category insert, update or delete made through the ORM,
+# in any app of this process. Caches compare it with the value they saw.
+_writes = {'count': 0}
+
+
+def _category_written(mapper, connection, target):
+    _writes['count'] += 1
+
+
+for _event_name in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Category, _event_name, _category_written)
+
+
+class CategoryCache(object):
+    """ Category cache.
+    description: Keeps the {id: type} category map in memory together with
+        the pre-serialized /categories response body and its ETag. The
+        cache is rebuilt when a category is written through the ORM, when
+        invalidate() is called, or after max_age seconds so that writes
+        from other processes are picked up.
+        version is increased on every rebuild.
+    """
+
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entry = None
+
+    def invalidate(self):
+        with self._lock:
+            self._entry = None
+
+    def _load(self):
+        with primary_reads():
+            categories = Category.query.order_by(Category.id.asc()).all()
+        format_categories = {
+            category.id: category.type for category in categories
+        }
+        body = json.dumps({
+            'success': True,
+            'categories': format_categories,
+            'count': len(format_categories)
+        }, separators=(',', ':')).encode('utf-8')
+        return {
+            'categories': format_categories,
+            'body': body,
+            'etag': hashlib.sha1(body).hexdigest(),
+            'writes': _writes['count'],
+            'loaded_at': time.monotonic(),
+        }
+
+    @property
+    def stale(self):
+        """ True when the next use will load the categories from db. """
+        entry = self._entry
+        return entry is None \
+            or entry['writes'] != _writes['count'] \
+            or time.monotonic() - entry['loaded_at'] > self.max_age
+
+    def _get(self):
+        entry = self._entry
+        if not self.stale:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        entry = self._load()
+        with self._lock:
+            self.version += 1
+            self._entry = entry
+        return entry
+
+    def categories(self):
+        """ Returns the {id: type} map. Callers must not modify it. """
+        return self._get()['categories']
+
+    def response(self):
+        """ Returns (body bytes, etag) for the /categories response. """
+        entry = self._get()
+        return entry['body'], entry['etag']
+
+    def stats(self):
+        return {
+            'version': self.version,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
@@ -0,0 +1,87 @@
+import os
+
+from .rate_limit import DEFAULT_LIMITS
+from .search import BACKENDS
+
+# name: (type, default, minimum or choices)
+SETTINGS = {
+    'QUESTIONS_PER_PAGE': (int, 10, 1),
+    'SEARCH_BACKEND': (str, None, tuple(BACKENDS)),
+    'QUIZ_SESSION_TTL': (int, 1800, 1),
+    'QUIZ_DECKS': (int, 0, 0),
+    'QUIZ_DECK_ROTATE': (float, 300.0, 1),
+    'SUGGEST_MAX_TERMS': (int, 100000, 1),
+    'DUPLICATE_SIMILARITY': (float, 0.8, 0),
+    'SLOW_QUERY_MS': (float, 200.0, 0),
+    'RESPONSE_CACHE': (str, 'memory', ('memory', 'shared', 'off')),
+    'RESPONSE_CACHE_URL': (str, None, None),
+    'RESPONSE_CACHE_TTL': (float, 60.0, 0),
+    'RESPONSE_CACHE_MAX_MB': (float, 64.0, 0),
+    'SCORE_FLUSH_SIZE': (int, 500, 1),
+    'SCORE_FLUSH_INTERVAL': (float, 1.0, 0),
+    'LEADERBOARD_SIZE': (int, 10, 1),
+    'LEADERBOARD_MAX_AGE': (float, 60.0, 0),
+    'WARMUP': (str, 'off', ('off', 'background')),
+    'RATE_LIMIT': (str, 'off', ('off', 'memory', 'shared')),
+    'RATE_LIMITS': (str, DEFAULT_LIMITS, None),
+    'RATE_LIMIT_FILE': (str, None, None),
+    'RATE_LIMIT_PROXIES': (int, 0, 0),
+    'DB_REPLICA_URLS': (str, None, None),
+    'DB_REPLICA_CHECK_INTERVAL': (float, 5.0, 0),
+    'DB_READ_YOUR_WRITES': (float, 5.0, 0),
+}
+
+# Settings that are disabled (None) when set to an empty string, instead
+# of taking their default
+EMPTY_DISABLES = ('SLOW_QUERY_MS',)
+
+
+def _raw(config, name):
+    value = config.get(name)
+    if value is None:
+        value = os.getenv(name)
+    return value
+
+
+def _convert(name, value):
+    kind, default, rule = SETTINGS[name]
+    try:
+        value = kind(value)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid {0}: {1!r}, expected {2}'.format(
+            name, value, 'a number' if kind is not str else 'a string'
+        ))
+    if kind is str and rule is not None:
+        value = value.lower()
+        if value not in rule:
+            raise ValueError('Invalid {0}: {1!r}, expected one of {2}'.format(
+                name, value, ', '.join(rule)
+            ))
+    elif kind is not str and value < rule:
+        raise ValueError('Invalid {0}: {1!r}, expected at least {2}'.format(
+            name, value, rule
+        ))
+    return value
+
+
+def load_settings(config):
+    """ Settings.
+    description: Reads the settings of create_app() once, from config (ie:
+        the test_config) or else the environment, like get_setting(), and
+        checks them. Unset settings, and empty strings, get the default of
+        SETTINGS; an empty SLOW_QUERY_MS disables the slow query log.
+        Raises ValueError naming the first invalid setting, so a bad
+        deploy fails when the app is built, not on the first request.
+        return:
+            dict: setting name: value
+    """
+    settings = {}
+    for name in SETTINGS:
+        value = _raw(config, name)
+        if value == '' and name in EMPTY_DISABLES:
+            settings[name] = None
+        elif value is None or value == '':
+            settings[name] = SETTINGS[name][1]
+        else:
+            settings[name] = _convert(name, value)
+    return settings
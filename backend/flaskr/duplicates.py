@@ -0,0 +1,489 @@
+import hashlib
+import struct
+from collections import namedtuple
+from itertools import groupby, islice, zip_longest
+from operator import itemgetter
+from zlib import crc32
+
+from sqlalchemy import event, text
+
+from models import db, Question, QuestionSignature
+from .answers import NUMBER, normalize_answer
+
+# Characters per shingle: near duplicates share most of their 4 character
+# substrings, so typos and small rewordings stay similar
+SHINGLE_SIZE = 4
+# MinHash values per question, hashed by bands of BAND_ROWS values into
+# BANDS buckets. Questions with similarity s share a bucket with
+# probability 1 - (1 - s ** 4) ** 6: 0.96 at s = 0.8, 0.32 at s = 0.5.
+BANDS = 6
+BAND_ROWS = 4
+SIGNATURE_SIZE = BANDS * BAND_ROWS
+# Questions this similar (Jaccard index of their shingles) or more are
+# near duplicates
+SIMILARITY = 0.8
+# Buckets shared by more questions than this come from common words, not
+# from duplicates, which nearly always share another bucket: they are
+# skipped, so no lookup compares more than BANDS * MAX_BUCKET questions
+MAX_BUCKET = 100
+
+# PostgreSQL statements writing many rows from arrays: a single statement
+# that is cheap to build, whatever the number of rows
+INSERT_SIGNATURES = text(
+    'INSERT INTO question_signatures (bucket, question_id) '
+    'SELECT * FROM unnest(CAST(:buckets AS bigint[]), '
+    'CAST(:ids AS integer[]))'
+)
+UPDATE_HASHES = text(
+    'UPDATE questions SET question_hash = signed.hash '
+    'FROM unnest(CAST(:ids AS integer[]), CAST(:hashes AS bigint[])) '
+    'AS signed (id, hash) WHERE questions.id = signed.id'
+)
+
+Fingerprint = namedtuple(
+    'Fingerprint', 'normalized question_hash shingles buckets numbers'
+)
+
+
+def _int64(data):
+    """ Signed 64 bit hash of data, to fit a PostgreSQL bigint. """
+    digest = hashlib.blake2b(data, digest_size=8).digest()
+    return struct.unpack('<q', digest)[0]
+
+
+def shingles(normalized):
+    """ Distinct SHINGLE_SIZE character substrings of a normalized text
+        (the whole text if it is shorter).
+    """
+    if len(normalized) <= SHINGLE_SIZE:
+        return frozenset([normalized]) if normalized else frozenset()
+    return frozenset(
+        normalized[start:start + SHINGLE_SIZE]
+        for start in range(len(normalized) - SHINGLE_SIZE + 1)
+    )
+
+
+def signature(shingle_set):
+    """ MinHash signature of a shingle set.
+    description: One permutation hashing: each shingle is hashed once
+        (crc32) and goes to one of SIGNATURE_SIZE bins, which keep their
+        smallest value. Empty bins borrow the value of the next non-empty
+        one, tagged with the distance, so two sets agree on a bin with a
+        probability close to their Jaccard index. That is one hash per
+        shingle instead of one per shingle and value.
+    """
+    bins = [None] * SIGNATURE_SIZE
+    for value in map(crc32, (shingle.encode() for shingle in shingle_set)):
+        position = value % SIGNATURE_SIZE
+        value //= SIGNATURE_SIZE
+        current = bins[position]
+        if current is None or value < current:
+            bins[position] = value
+    if all(value is None for value in bins):
+        return (0,) * SIGNATURE_SIZE
+    filled = list(bins)
+    for position, value in enumerate(bins):
+        distance = 0
+        while value is None:
+            distance += 1
+            value = bins[(position + distance) % SIGNATURE_SIZE]
+        filled[position] = value + (distance << 32)
+    return tuple(filled)
+
+
+def bands(values):
+    """ LSH buckets of a signature: one bigint per band, that includes
+        the band number.
+    """
+    return [
+        _int64(struct.pack(
+            '<B{0}Q'.format(BAND_ROWS), band,
+            *values[band * BAND_ROWS:(band + 1) * BAND_ROWS]
+        ))
+        for band in range(BANDS)
+    ]
+
+
+def fingerprint(question, signed=True):
+    """ Everything needed to compare a question text with others. Without
+        signed, buckets is None: enough for similarity(), for half the
+        work.
+    """
+    normalized = normalize_answer(question)
+    shingle_set = shingles(normalized)
+    return Fingerprint(
+        normalized,
+        _int64(normalized.encode()),
+        shingle_set,
+        bands(signature(shingle_set)) if signed else None,
+        NUMBER.findall(normalized),
+    )
+
+
+def question_hash(question):
+    """ Hash of the normalized question text, stored in
+        questions.question_hash to find exact duplicates.
+    """
+    return _int64(normalize_answer(question).encode())
+
+
+def similarity(first, second):
+    """ Similarity of two fingerprints: 1.0 for the same normalized text,
+        else the Jaccard index of their shingles, or 0.0 when they don't
+        have the same numbers (so 'Who won in 1990?' is not a duplicate of
+        'Who won in 1994?').
+    """
+    if first.question_hash == second.question_hash \
+            and first.normalized == second.normalized:
+        return 1.0
+    if first.numbers != second.numbers:
+        return 0.0
+    shared = len(first.shingles & second.shingles)
+    union = len(first.shingles) + len(second.shingles) - shared
+    if not union:
+        return 0.0
+    return shared / union
+
+
+def add_signatures(connection, rows, replace=True):
+    """ Writes the LSH buckets of questions, given as (id, question text
+        or its Fingerprint) pairs, in question_signatures. Their old
+        buckets are deleted first unless replace is False (new questions).
+    """
+    table = QuestionSignature.__table__
+    rows = list(rows)
+    if not rows:
+        return
+    if replace:
+        connection.execute(table.delete().where(
+            table.c.question_id.in_([question_id for question_id, _ in rows])
+        ))
+    values = [
+        {'question_id': question_id, 'bucket': bucket}
+        for question_id, question in rows
+        for bucket in set((
+            question if isinstance(question, Fingerprint)
+            else fingerprint(question)
+        ).buckets)
+    ]
+    if connection.dialect.name == 'postgresql':
+        # One INSERT of two arrays instead of one round trip per bucket
+        connection.execute(INSERT_SIGNATURES, {
+            'buckets': [value['bucket'] for value in values],
+            'ids': [value['question_id'] for value in values],
+        })
+    else:
+        connection.execute(table.insert(), values)
+
+
+def _hash_target(mapper, connection, target):
+    target.question_hash = question_hash(target.question)
+
+
+def _sign_new_target(mapper, connection, target):
+    add_signatures(connection, [(target.id, target.question)], replace=False)
+
+
+def _sign_target(mapper, connection, target):
+    add_signatures(connection, [(target.id, target.question)])
+
+
+# Questions written through the model; set-based inserts (flaskr.bulk)
+# sign their rows themselves. Deletes cascade to the buckets.
+event.listen(Question, 'before_insert', _hash_target)
+event.listen(Question, 'before_update', _hash_target)
+event.listen(Question, 'after_insert', _sign_new_target)
+event.listen(Question, 'after_update', _sign_target)
+
+
+def find_duplicates(fingerprints, threshold=SIMILARITY, exclude=(),
+                    max_bucket=MAX_BUCKET):
+    """ Duplicate lookup.
+    description: Finds the stored questions that are duplicates of each
+        fingerprint: same question_hash, or a shared LSH bucket and a
+        similarity of threshold or more. One indexed query for up to 1000
+        fingerprints, whatever the size of the table; only the candidates
+        are compared, skipping the buckets of more than max_bucket
+        questions. Questions without a question_hash (written before
+        migrations/004_question_signatures.sql and not signed yet by
+        `flask migrate`) are not found.
+        parameters:
+            - exclude: ids never returned
+        return:
+            array: for each fingerprint, its duplicates as (id, question,
+                similarity), most similar first
+    """
+    if not fingerprints:
+        return []
+    exclude = set(exclude)
+    table = Question.__table__
+    signatures = QuestionSignature.__table__
+    hashes = sorted(set(new.question_hash for new in fingerprints))
+    buckets = sorted(set(
+        bucket for new in fingerprints for bucket in new.buckets
+    ))
+    # bucket or question_hash: ids of the candidates in it
+    by_bucket = {}
+    candidates = {}
+    # One query per 1000 hashes and 1000 buckets: a single one for a
+    # single question
+    for hash_chunk, bucket_chunk in zip_longest(
+        _chunks(hashes), _chunks(buckets), fillvalue=()
+    ):
+        queries = []
+        if hash_chunk:
+            queries.append(
+                db.select([table.c.question_hash, table.c.id,
+                           table.c.question])
+                .where(table.c.question_hash.in_(hash_chunk))
+            )
+        if bucket_chunk:
+            crowded = db.select([signatures.c.bucket]) \
+                .where(signatures.c.bucket.in_(bucket_chunk)) \
+                .group_by(signatures.c.bucket) \
+                .having(db.func.count() > max_bucket)
+            queries.append(
+                db.select([signatures.c.bucket, table.c.id,
+                           table.c.question])
+                .select_from(signatures.join(
+                    table, table.c.id == signatures.c.question_id
+                ))
+                .where(signatures.c.bucket.in_(bucket_chunk))
+                .where(signatures.c.bucket.notin_(crowded))
+            )
+        for bucket, question_id, question in db.session.execute(
+            db.union(*queries) if len(queries) > 1 else queries[0]
+        ):
+            if question_id in exclude:
+                continue
+            by_bucket.setdefault(bucket, []).append(question_id)
+            candidates[question_id] = question
+    stored = {
+        question_id: fingerprint(question, signed=False)
+        for question_id, question in candidates.items()
+    }
+    results = []
+    for new in fingerprints:
+        found = []
+        seen = set()
+        for bucket in new.buckets + [new.question_hash]:
+            for question_id in by_bucket.get(bucket, ()):
+                if question_id in seen:
+                    continue
+                seen.add(question_id)
+                score = similarity(new, stored[question_id])
+                if score >= threshold:
+                    found.append((
+                        question_id, candidates[question_id], round(score, 3)
+                    ))
+        found.sort(key=lambda item: (-item[2], item[0]))
+        results.append(found)
+    return results
+
+
+def _chunks(values, size=1000):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+class BatchDuplicates(object):
+    """ Duplicates within a batch of new questions, found with the same
+        buckets as the stored ones, in memory.
+    """
+
+    def __init__(self, threshold=SIMILARITY):
+        self.threshold = threshold
+        self._buckets = {}
+        self._fingerprints = {}
+
+    def add(self, key, new):
+        """ Returns the key of an earlier question of the batch that the
+            fingerprint new duplicates, or None after adding it to the
+            batch.
+        """
+        # question_hash is one more bucket, for exact duplicates
+        buckets = new.buckets + [new.question_hash]
+        candidates = set()
+        for bucket in buckets:
+            candidates.update(self._buckets.get(bucket, ()))
+        for other in sorted(candidates):
+            if similarity(new, self._fingerprints[other]) >= self.threshold:
+                return other
+        self._fingerprints[key] = new
+        for bucket in buckets:
+            self._buckets.setdefault(bucket, []).append(key)
+        return None
+
+
+def check_duplicates(rows, threshold=SIMILARITY):
+    """ Checks new question rows (dicts with a question text) against the
+        stored questions and against each other.
+        return:
+            array: for each row, None, ('question', id of the stored
+                question it duplicates) or ('row', index of the earlier
+                row it duplicates)
+    """
+    fingerprints = [fingerprint(row['question']) for row in rows]
+    stored = find_duplicates(fingerprints, threshold)
+    batch = BatchDuplicates(threshold)
+    results = []
+    for index, (new, found) in enumerate(zip(fingerprints, stored)):
+        if found:
+            results.append(('question', found[0][0]))
+            continue
+        earlier = batch.add(index, new)
+        results.append(None if earlier is None else ('row', earlier))
+    return results
+
+
+def sign_missing_questions(batch_size=1000):
+    """ Fills question_hash and the buckets of the questions that have no
+        question_hash (rows written before the signatures existed),
+        batch_size rows per transaction: one UPDATE and one INSERT on
+        PostgreSQL. Returns how many were signed.
+    """
+    table = Question.__table__
+    signed = 0
+    while True:
+        rows = db.session.execute(
+            db.select([table.c.id, table.c.question]).where(
+                table.c.question_hash.is_(None)
+            ).order_by(table.c.id).limit(batch_size)
+        ).fetchall()
+        if not rows:
+            break
+        fingerprints = [
+            (question_id, fingerprint(question))
+            for question_id, question in rows
+        ]
+        hashes = {
+            question_id: new.question_hash
+            for question_id, new in fingerprints
+        }
+        if db.engine.dialect.name == 'postgresql':
+            db.session.execute(UPDATE_HASHES, {
+                'ids': list(hashes), 'hashes': list(hashes.values())
+            })
+        else:
+            db.session.execute(
+                table.update().where(
+                    table.c.id == db.bindparam('row_id')
+                ).values(question_hash=db.bindparam('hash')),
+                [{'row_id': question_id, 'hash': value}
+                 for question_id, value in hashes.items()]
+            )
+        add_signatures(db.session.connection(), fingerprints)
+        db.session.commit()
+        signed += len(rows)
+    return signed
+
+
+def _stream(statement):
+    """ Rows of statement, read through a server-side cursor on
+        PostgreSQL, so the result is never held in memory.
+    """
+    return db.session.connection().execution_options(
+        stream_results=True
+    ).execute(statement)
+
+
+def duplicate_clusters(threshold=SIMILARITY, max_bucket=MAX_BUCKET,
+                       batch_size=10000, stats=None):
+    """ Duplicate report.
+    description: Finds the clusters of duplicate questions of the whole
+        table from the stored hashes and buckets, without comparing every
+        pair: questions with the same question_hash are joined, then the
+        questions sharing an LSH bucket are compared, batch_size pairs at
+        a time, and joined when their similarity is threshold or more.
+        Clusters are joined transitively: A ~ B and B ~ C put A, B and C
+        in one cluster.
+
+        Both passes read the tables in bucket order through server-side
+        cursors, so memory is bounded by batch_size and by the number of
+        duplicates found, not by the size of the table. Buckets holding
+        more than max_bucket questions (templates shared by many
+        questions) are skipped and counted in stats.
+        parameters:
+            - stats: dict, filled with pair and bucket counts
+        return:
+            generator: clusters, as sorted arrays of ids, by first id
+    """
+    if stats is None:
+        stats = {}
+    stats.update(compared=0, skipped_buckets=0)
+    parent = {}
+
+    def find(question_id):
+        root = question_id
+        while parent.get(root, root) != root:
+            root = parent[root]
+        while question_id != root:
+            parent[question_id], question_id = root, parent[question_id]
+        return root
+
+    def join(first, second):
+        first, second = find(first), find(second)
+        if first != second:
+            parent[max(first, second)] = min(first, second)
+            parent.setdefault(min(first, second), min(first, second))
+
+    table = Question.__table__
+    signatures = QuestionSignature.__table__
+    for _, group in groupby(_stream(
+        db.select([table.c.question_hash, table.c.id])
+        .where(table.c.question_hash.isnot(None))
+        .order_by(table.c.question_hash, table.c.id)
+    ), key=itemgetter(0)):
+        first = next(group)[1]
+        for _, question_id in group:
+            join(first, question_id)
+
+    def compare(pairs):
+        ids = sorted(set(
+            question_id for pair in pairs for question_id in pair
+        ))
+        fingerprints = {}
+        for chunk in _chunks(ids):
+            for question_id, question in db.session.execute(
+                db.select([table.c.id, table.c.question])
+                .where(table.c.id.in_(chunk))
+            ):
+                fingerprints[question_id] = fingerprint(
+                    question, signed=False
+                )
+        for first, second in pairs:
+            if first not in fingerprints or second not in fingerprints \
+                    or find(first) == find(second):
+                continue
+            stats['compared'] += 1
+            if similarity(fingerprints[first], fingerprints[second]) \
+                    >= threshold:
+                join(first, second)
+
+    pairs = set()
+    for _, group in groupby(_stream(
+        db.select([signatures.c.bucket, signatures.c.question_id])
+        .order_by(signatures.c.bucket, signatures.c.question_id)
+    ), key=itemgetter(0)):
+        ids = [
+            question_id for _, question_id in islice(group, max_bucket + 1)
+        ]
+        if len(ids) > max_bucket:
+            stats['skipped_buckets'] += 1
+            continue
+        for index, first in enumerate(ids):
+            for second in ids[index + 1:]:
+                if find(first) != find(second):
+                    pairs.add((first, second))
+        if len(pairs) >= batch_size:
+            compare(pairs)
+            pairs = set()
+    compare(pairs)
+
+    clusters = {}
+    for question_id in parent:
+        clusters.setdefault(find(question_id), []).append(question_id)
+    stats['clusters'] = len(clusters)
+    stats['duplicates'] = sum(len(ids) - 1 for ids in clusters.values())
+    for root in sorted(clusters):
+        yield sorted(clusters[root])
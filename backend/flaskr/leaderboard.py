@@ -0,0 +1,288 @@
+import atexit
+import logging
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import datetime
+
+from models import db, Category, Score
+
+logger = logging.getLogger(__name__)
+
+
+class Board(object):
+    """ Best scores of one leaderboard, one entry per player. Entries are
+        sorted keys (-score, recorded at, player, total), so ties go to
+        whoever got there first.
+    """
+    __slots__ = ('entries', 'best')
+
+    def __init__(self):
+        self.entries = []
+        # player: their entry
+        self.best = {}
+
+    def offer(self, size, player, score, total, at):
+        """ Adds a score if it is the player's best and makes the top size.
+            Returns its 1-based rank, or None.
+        """
+        key = (-score, at, player, total)
+        current = self.best.get(player)
+        if current is not None:
+            if current <= key:
+                return None
+            del self.entries[bisect_left(self.entries, current)]
+            del self.best[player]
+        if len(self.entries) >= size and key >= self.entries[-1]:
+            return None
+        insort(self.entries, key)
+        self.best[player] = key
+        if len(self.entries) > size:
+            del self.best[self.entries.pop()[2]]
+        return bisect_left(self.entries, key) + 1
+
+
+class Leaderboard(object):
+    """ Leaderboards.
+    description: Keeps the size best players of every quiz category (0 for
+        quizzes over all categories) and of every quiz (GLOBAL) in memory,
+        so reads never touch the scores table.
+
+        The boards load on first use, reading the best scores of each
+        category (ix_scores_category_score, and ix_scores_score for the
+        global board) until size players are found, or size * 100 rows
+        were read. Scores recorded in this process are added as they come
+        (offer()); since other processes record scores too, boards are
+        rebuilt when they are older than max_age seconds. pending, if
+        given, returns the scores not flushed yet, which are added back
+        after a rebuild.
+    """
+    GLOBAL = None
+
+    def __init__(self, size=10, max_age=60, pending=None):
+        self.size = size
+        self.max_age = max_age
+        self.pending = pending
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._boards = None
+        self._loaded_at = 0
+
+    def _load_board(self, category, batch_size=100):
+        board = Board()
+        table = Score.__table__
+        query = db.select([
+            table.c.player, table.c.score, table.c.total,
+            table.c.created_at
+        ])
+        if category is not self.GLOBAL:
+            query = query.where(table.c.category == category)
+        result = db.session.execute(query.order_by(
+            table.c.score.desc(), table.c.created_at.asc()
+        ).limit(self.size * batch_size))
+        for player, score, total, created_at in result:
+            board.offer(self.size, player, score, total,
+                        created_at.timestamp())
+            if len(board.entries) >= self.size:
+                break
+        result.close()
+        return board
+
+    def load(self):
+        """ Rebuilds the boards of every category, of the all categories
+            quiz and the global one, then adds the pending scores.
+        """
+        categories = [row[0] for row in db.session.query(Category.id)]
+        boards = {self.GLOBAL: self._load_board(self.GLOBAL)}
+        for category in [0] + categories:
+            boards[category] = self._load_board(category)
+        with self._lock:
+            self._boards = boards
+            self._loaded_at = time.monotonic()
+            for event in (self.pending() if self.pending else ()):
+                self._offer(*event)
+
+    def invalidate(self):
+        with self._lock:
+            self._boards = None
+
+    @property
+    def stale(self):
+        return self._boards is None \
+            or time.monotonic() - self._loaded_at > self.max_age
+
+    def refresh(self):
+        """ Loads the boards if they are missing or expired. """
+        if self.stale:
+            # One thread loads, the others wait for its result
+            with self._load_lock:
+                if self.stale:
+                    self.load()
+
+    def _offer(self, player, category, score, total, at):
+        for key in (self.GLOBAL, category):
+            board = self._boards.get(key)
+            if board is None:
+                board = self._boards[key] = Board()
+            rank = board.offer(self.size, player, score, total, at)
+        return rank
+
+    def offer(self, player, category, score, total, at):
+        """ Adds a recorded score to the global board and to the board of
+            its category. Returns its rank in the category, or None when
+            it is not in the top size. No-op (None) until the boards load.
+        """
+        with self._lock:
+            if self._boards is None:
+                return None
+            return self._offer(player, category, score, total, at)
+
+    def top(self, category=GLOBAL, limit=None):
+        """ Returns the best players of a board, best first, as dicts with
+            rank, player, score and total.
+        """
+        self.refresh()
+        with self._lock:
+            board = self._boards.get(category)
+            entries = list(board.entries) if board is not None else []
+        return [
+            {'rank': rank, 'player': player, 'score': -score, 'total': total}
+            for rank, (score, at, player, total) in enumerate(
+                entries[:limit], 1
+            )
+        ]
+
+
+class ScoreRecorder(object):
+    """ Score writer.
+    description: Buffers recorded scores and inserts them in batches: when
+        flush_size scores are waiting, by the request that fills the
+        buffer, and every flush_interval seconds from a background thread
+        (started on the first score; flush_interval 0 disables it). Each
+        score goes to the leaderboard right away, so it is visible before
+        it is written.
+
+        A failed flush puts its scores back in the buffer; past max_pending
+        waiting scores the oldest are dropped (and counted). Scores still
+        in the buffer when the process dies are lost: at most flush_size
+        scores, or flush_interval seconds of them. The buffer is flushed
+        when the interpreter exits normally.
+    """
+
+    def __init__(self, leaderboard=None, flush_size=500, flush_interval=1.0,
+                 max_pending=100000):
+        self.leaderboard = leaderboard
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.app = None
+        self.recorded = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = []
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def init_app(self, app):
+        self.app = app
+
+    def pending(self):
+        """ Scores waiting to be written, as (player, category, score,
+            total, recorded at) tuples.
+        """
+        with self._lock:
+            return list(self._pending)
+
+    def record(self, player, category, score, total):
+        """ Buffers a score and returns its rank in its category
+            leaderboard, or None.
+        """
+        event = (player, category, score, total, time.time())
+        with self._lock:
+            self._pending.append(event)
+            self.recorded += 1
+            full = len(self._pending) >= self.flush_size
+        rank = None
+        if self.leaderboard is not None:
+            rank = self.leaderboard.offer(*event)
+        if full:
+            self.flush()
+        elif self.flush_interval and self._thread is None:
+            self._start()
+        return rank
+
+    def flush(self):
+        """ Writes the buffered scores with one INSERT, in its own
+            transaction. Returns how many were written.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            try:
+                with db.engine.begin() as connection:
+                    connection.execute(Score.__table__.insert(), [{
+                        'player': player,
+                        'category': category,
+                        'score': score,
+                        'total': total,
+                        'created_at': datetime.fromtimestamp(at),
+                    } for player, category, score, total, at in batch])
+            except Exception:
+                logger.exception('Could not write %d scores', len(batch))
+                with self._lock:
+                    self._pending[:0] = batch
+                    excess = len(self._pending) - self.max_pending
+                    if excess > 0:
+                        del self._pending[:excess]
+                        self.dropped += excess
+                return 0
+            with self._lock:
+                self.flushed += len(batch)
+                self.flushes += 1
+            return len(batch)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name='score-recorder'
+            )
+            self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            self._flush_in_app()
+
+    def _flush_in_app(self):
+        if self.app is None:
+            return self.flush()
+        with self.app.app_context():
+            try:
+                return self.flush()
+            finally:
+                db.session.remove()
+
+    def close(self):
+        """ Stops the background thread and flushes the buffer. """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._flush_in_app()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'recorded': self.recorded,
+                'flushed': self.flushed,
+                'flushes': self.flushes,
+                'dropped': self.dropped,
+                'pending': len(self._pending),
+            }
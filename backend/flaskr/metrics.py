@@ -0,0 +1,449 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the request latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+# Upper bounds, in seconds, of the pool checkout wait histogram buckets
+POOL_WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5,
+                     1.0, 5.0)
+# Statements longer than this are cut in the slow query log
+MAX_LOGGED_STATEMENT = 1000
+
+# Request being measured on this thread: the Metrics of its app, its start
+# time, statement count and DB time. Engine events of every app land here.
+_current = threading.local()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    elapsed = time.perf_counter() - conn.info['metrics_started'].pop()
+    metrics = getattr(_current, 'metrics', None)
+    if metrics is not None:
+        metrics.statement_executed(statement, elapsed)
+    counter = getattr(_current, 'counter', None)
+    if counter is not None:
+        counter[0] += 1
+        counter[1] += elapsed
+
+
+def _handle_error(exception_context):
+    # Failed statements don't get an after_cursor_execute
+    started = exception_context.connection.info.get('metrics_started')
+    if started:
+        started.pop()
+
+
+def count_statements(fn):
+    """ Calls fn, returns its result, the number of SQL statements it ran
+        on this thread and the seconds spent in them. For the reads of
+        requests served outside of Flask (the ASGI thread pool), which
+        Metrics.record() is given.
+    """
+    previous = getattr(_current, 'counter', None)
+    counter = _current.counter = [0, 0.0]
+    try:
+        result = fn()
+    finally:
+        _current.counter = previous
+    return result, counter[0], counter[1]
+
+
+event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+event.listen(Engine, 'handle_error', _handle_error)
+
+
+class TimedQueuePool(QueuePool):
+    """ QueuePool that reports how long every checkout took, waiting for
+        a free connection or opening a new one, to the Metrics of the
+        request being served.
+    """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super(TimedQueuePool, self)._do_get()
+        finally:
+            metrics = getattr(_current, 'metrics', None)
+            if metrics is not None:
+                metrics.pool_checkout(time.perf_counter() - start)
+
+
+def _histogram(lines, name, label, bounds, buckets, total_seconds):
+    """ Appends the Prometheus lines of one histogram series. """
+    prefix = label + ',' if label else ''
+    total = 0
+    for bound, count in zip(bounds + ('+Inf',), buckets):
+        total += count
+        lines.append('{0}_bucket{{{1}le="{2}"}} {3}'.format(
+            name, prefix, bound, total))
+    suffix = '{{{0}}}'.format(label) if label else ''
+    lines.append('{0}_sum{1} {2!r}'.format(name, suffix, total_seconds))
+    lines.append('{0}_count{1} {2}'.format(name, suffix, total))
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n'
+    )
+
+
+def _cache_lines(lines, stats):
+    """ Appends the Prometheus lines of the response cache stats. """
+    series = (
+        ('trivia_response_cache_hits_total', 'counter',
+         'Responses served from the response cache.', 'hits'),
+        ('trivia_response_cache_misses_total', 'counter',
+         'Cacheable responses not found in the response cache.', 'misses'),
+        ('trivia_response_cache_invalidations_total', 'counter',
+         'Response cache entries dropped by question writes.',
+         'invalidations'),
+        ('trivia_response_cache_hit_ratio', 'gauge',
+         'Hits over lookups of the response cache.', 'hit_ratio'),
+        ('trivia_response_cache_entries', 'gauge',
+         'Entries in the response cache.', 'entries'),
+        ('trivia_response_cache_bytes', 'gauge',
+         'Memory used by the response cache.', 'bytes'),
+    )
+    for name, kind, help_text, field in series:
+        if stats.get(field) is None:
+            continue
+        lines.extend([
+            '# HELP {0} {1}'.format(name, help_text),
+            '# TYPE {0} {1}'.format(name, kind),
+            '{0}{{backend="{1}"}} {2!r}'.format(
+                name, stats['backend'], stats[field]),
+        ])
+
+
+def _score_lines(lines, stats):
+    """ Appends the Prometheus lines of the score recorder stats. """
+    series = (
+        ('trivia_scores_recorded_total', 'counter',
+         'Quiz scores received.', 'recorded'),
+        ('trivia_scores_flushed_total', 'counter',
+         'Quiz scores written to the database.', 'flushed'),
+        ('trivia_score_flushes_total', 'counter',
+         'Batches of quiz scores written.', 'flushes'),
+        ('trivia_scores_dropped_total', 'counter',
+         'Quiz scores dropped after failed writes.', 'dropped'),
+        ('trivia_scores_pending', 'gauge',
+         'Quiz scores waiting to be written.', 'pending'),
+    )
+    for name, kind, help_text, field in series:
+        lines.extend([
+            '# HELP {0} {1}'.format(name, help_text),
+            '# TYPE {0} {1}'.format(name, kind),
+            '{0} {1}'.format(name, stats[field]),
+        ])
+
+
+def _rate_limit_lines(lines, stats):
+    """ Appends the Prometheus lines of the rate limiter stats. """
+    lines.extend([
+        '# HELP trivia_rate_limited_total Requests refused by the rate '
+        'limiter by limit.',
+        '# TYPE trivia_rate_limited_total counter',
+    ])
+    for name, count in sorted(stats['limited'].items()):
+        lines.append('trivia_rate_limited_total{{limit="{0}"}} {1}'.format(
+            _label(name), count))
+    if stats.get('keys') is not None:
+        lines.extend([
+            '# HELP trivia_rate_limit_keys Token buckets in memory.',
+            '# TYPE trivia_rate_limit_keys gauge',
+            'trivia_rate_limit_keys {0}'.format(stats['keys']),
+        ])
+
+
+def _deck_lines(lines, stats):
+    """ Appends the Prometheus lines of the quiz decks stats. """
+    series = (
+        ('trivia_quiz_decks_dealt_total', 'counter',
+         'Quiz sessions started on a precomputed deck.', 'dealt'),
+        ('trivia_quiz_decks_missed_total', 'counter',
+         'Quiz sessions started while the decks were behind the questions.',
+         'missed'),
+        ('trivia_quiz_deck_builds_total', 'counter',
+         'Times the quiz decks were shuffled.', 'builds'),
+        ('trivia_quiz_deck_build_seconds_total', 'counter',
+         'Time spent shuffling the quiz decks.', 'build_seconds'),
+        ('trivia_quiz_decks_bytes', 'gauge',
+         'Memory used by the quiz decks.', 'bytes'),
+    )
+    for name, kind, help_text, field in series:
+        lines.extend([
+            '# HELP {0} {1}'.format(name, help_text),
+            '# TYPE {0} {1}'.format(name, kind),
+            '{0} {1!r}'.format(name, stats[field]),
+        ])
+
+
+def _replica_lines(lines, stats):
+    """ Appends the Prometheus lines of the read replica router stats. """
+    lines.extend([
+        '# HELP trivia_db_replica_up Whether the read replica passed its '
+        'last check.',
+        '# TYPE trivia_db_replica_up gauge',
+    ])
+    for name, healthy, _ in stats['replicas']:
+        lines.append('trivia_db_replica_up{{replica="{0}"}} {1}'.format(
+            _label(name), int(healthy)))
+    lines.extend([
+        '# HELP trivia_db_replica_reads_total Requests routed to the read '
+        'replica.',
+        '# TYPE trivia_db_replica_reads_total counter',
+    ])
+    for name, _, reads in stats['replicas']:
+        lines.append('trivia_db_replica_reads_total{{replica="{0}"}} '
+                     '{1}'.format(_label(name), reads))
+    series = (
+        ('trivia_db_replica_fallbacks_total',
+         'Reads sent to the primary because every replica was down.',
+         'fallbacks'),
+        ('trivia_db_replica_pinned_reads_total',
+         'Reads sent to the primary after a write of their client.',
+         'pinned_reads'),
+    )
+    for name, help_text, field in series:
+        lines.extend([
+            '# HELP {0} {1}'.format(name, help_text),
+            '# TYPE {0} counter'.format(name),
+            '{0} {1}'.format(name, stats[field]),
+        ])
+
+
+class RouteStats(object):
+    """ Counters of one route: latency histogram, statements and DB time.
+    """
+    __slots__ = ('buckets', 'count', 'seconds', 'statements', 'db_seconds',
+                 'pool_seconds')
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.pool_seconds = 0.0
+
+    def copy(self):
+        copy = RouteStats()
+        copy.buckets = list(self.buckets)
+        copy.count = self.count
+        copy.seconds = self.seconds
+        copy.statements = self.statements
+        copy.db_seconds = self.db_seconds
+        copy.pool_seconds = self.pool_seconds
+        return copy
+
+
+class Metrics(object):
+    """ Request metrics.
+    description: Records, for every route (the Flask endpoint name), a
+        request latency histogram, the number of SQL statements issued and
+        the time spent in them, plus the number of responses by status.
+        Requests are timed with Flask request hooks and statements with
+        SQLAlchemy engine events; a request only touches thread-local
+        counters until it ends, when they are added up under a lock.
+
+        Statements slower than slow_query_ms are logged as warnings on the
+        flaskr.metrics logger, without their parameters. None disables
+        the log.
+
+        With TimedQueuePool as the engine pool class, the time spent
+        waiting for a pool connection is recorded too, by route and in a
+        histogram.
+    """
+
+    def __init__(self, slow_query_ms=200, clock=time.perf_counter):
+        self.slow_query_ms = slow_query_ms
+        self.clock = clock
+        self.slow_queries = 0
+        self._slow_query_seconds = None if slow_query_ms is None \
+            else slow_query_ms / 1000.0
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._responses = {}
+        self._pool_buckets = [0] * (len(POOL_WAIT_BUCKETS) + 1)
+        self._pool_seconds = 0.0
+
+    def init_app(self, app):
+        app.before_request(self.request_started)
+        app.after_request(self.response_ready)
+        app.teardown_request(self.request_finished)
+
+    def request_started(self):
+        _current.metrics = self
+        _current.started = self.clock()
+        _current.statements = 0
+        _current.db_seconds = 0.0
+        _current.pool_seconds = 0.0
+        _current.status = 500
+
+    def response_ready(self, response):
+        _current.status = response.status_code
+        return response
+
+    def statement_executed(self, statement, elapsed):
+        _current.statements += 1
+        _current.db_seconds += elapsed
+        if self._slow_query_seconds is not None \
+                and elapsed >= self._slow_query_seconds:
+            with self._lock:
+                self.slow_queries += 1
+            logger.warning(
+                'Slow query (%.1f ms) in %s: %s', elapsed * 1000,
+                request.endpoint, statement[:MAX_LOGGED_STATEMENT]
+            )
+
+    def pool_checkout(self, elapsed):
+        _current.pool_seconds += elapsed
+        with self._lock:
+            self._pool_buckets[bisect_left(POOL_WAIT_BUCKETS, elapsed)] += 1
+            self._pool_seconds += elapsed
+
+    def request_finished(self, error=None):
+        if getattr(_current, 'metrics', None) is not self:
+            return
+        _current.metrics = None
+        # Requests that didn't match a route (404, 405) share one label
+        self.record(
+            request.endpoint or 'unmatched',
+            500 if error is not None else _current.status,
+            self.clock() - _current.started,
+            _current.statements, _current.db_seconds, _current.pool_seconds
+        )
+
+    def record(self, endpoint, status, elapsed, statements=0,
+               db_seconds=0.0, pool_seconds=0.0):
+        """ Adds one finished request. Used directly by requests served
+            outside of Flask (the ASGI entry point).
+        """
+        with self._lock:
+            stats = self._routes.get(endpoint)
+            if stats is None:
+                stats = self._routes[endpoint] = RouteStats()
+            stats.buckets[bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+            stats.count += 1
+            stats.seconds += elapsed
+            stats.statements += statements
+            stats.db_seconds += db_seconds
+            stats.pool_seconds += pool_seconds
+            key = (endpoint, status)
+            self._responses[key] = self._responses.get(key, 0) + 1
+
+    def route(self, endpoint):
+        """ Returns a copy of the RouteStats of endpoint, or None. """
+        with self._lock:
+            stats = self._routes.get(endpoint)
+            return None if stats is None else stats.copy()
+
+    def render(self, pool=None, response_cache=None, score_recorder=None,
+               rate_limiter=None, quiz_decks=None, replica_router=None):
+        """ Returns every metric in the Prometheus text format. With the
+            engine pool, its size and checked out connections are added,
+            with the response cache, its hits, misses and memory, with
+            the score recorder, the scores received and written, with
+            the rate limiter, the requests it refused, with the quiz
+            decks, the decks dealt and built, and with the replica router,
+            the health and reads of each replica.
+        """
+        with self._lock:
+            routes = sorted(
+                (endpoint, stats.copy())
+                for endpoint, stats in self._routes.items()
+            )
+            responses = sorted(self._responses.items())
+            slow_queries = self.slow_queries
+            pool_buckets = list(self._pool_buckets)
+            pool_seconds = self._pool_seconds
+
+        lines = [
+            '# HELP trivia_request_duration_seconds Request latency by '
+            'route.',
+            '# TYPE trivia_request_duration_seconds histogram',
+        ]
+        for endpoint, stats in routes:
+            _histogram(lines, 'trivia_request_duration_seconds',
+                       'endpoint="{0}"'.format(_label(endpoint)),
+                       LATENCY_BUCKETS, stats.buckets, stats.seconds)
+
+        lines.extend([
+            '# HELP trivia_requests_total Responses by route and status.',
+            '# TYPE trivia_requests_total counter',
+        ])
+        for (endpoint, status), count in responses:
+            lines.append(
+                'trivia_requests_total{{endpoint="{0}",status="{1}"}} '
+                '{2}'.format(_label(endpoint), status, count)
+            )
+
+        counters = (
+            ('trivia_db_statements_total',
+             'SQL statements issued by route.', 'statements'),
+            ('trivia_db_duration_seconds_total',
+             'Time spent in SQL statements by route.', 'db_seconds'),
+            ('trivia_db_pool_wait_seconds_total',
+             'Time spent waiting for a pool connection by route.',
+             'pool_seconds'),
+        )
+        for name, help_text, field in counters:
+            lines.extend([
+                '# HELP {0} {1}'.format(name, help_text),
+                '# TYPE {0} counter'.format(name),
+            ])
+            for endpoint, stats in routes:
+                lines.append('{0}{{endpoint="{1}"}} {2!r}'.format(
+                    name, _label(endpoint), getattr(stats, field)))
+
+        lines.extend([
+            '# HELP trivia_db_pool_wait_seconds Pool connection checkout '
+            'time.',
+            '# TYPE trivia_db_pool_wait_seconds histogram',
+        ])
+        _histogram(lines, 'trivia_db_pool_wait_seconds', '',
+                   POOL_WAIT_BUCKETS, pool_buckets, pool_seconds)
+        if isinstance(pool, QueuePool):
+            lines.extend([
+                '# HELP trivia_db_pool_size Connections the pool keeps.',
+                '# TYPE trivia_db_pool_size gauge',
+                'trivia_db_pool_size {0}'.format(pool.size()),
+                '# HELP trivia_db_pool_checked_out Connections in use.',
+                '# TYPE trivia_db_pool_checked_out gauge',
+                'trivia_db_pool_checked_out {0}'.format(pool.checkedout()),
+            ])
+
+        if response_cache is not None:
+            _cache_lines(lines, response_cache.stats())
+        if score_recorder is not None:
+            _score_lines(lines, score_recorder.stats())
+        if rate_limiter is not None:
+            _rate_limit_lines(lines, rate_limiter.stats())
+        if quiz_decks is not None:
+            _deck_lines(lines, quiz_decks.stats())
+        if replica_router is not None:
+            _replica_lines(lines, replica_router.stats())
+
+        lines.extend([
+            '# HELP trivia_slow_queries_total SQL statements slower than '
+            'the slow query threshold.',
+            '# TYPE trivia_slow_queries_total counter',
+            'trivia_slow_queries_total {0}'.format(slow_queries),
+        ])
+        return '\n'.join(lines) + '\n'
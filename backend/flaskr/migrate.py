@@ -0,0 +1,60 @@
+import os
+
+from models import db
+
+MIGRATIONS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'migrations'
+)
+
+
+def migration_files():
+    return sorted(
+        name for name in os.listdir(MIGRATIONS_DIR) if name.endswith('.sql')
+    )
+
+
+def upgrade():
+    """ Migrate.
+    description: Creates the missing tables, then applies the SQL files of
+        the migrations directory that haven't been applied yet, in name
+        order, each one in its own transaction. Applied files are recorded
+        in the schema_migrations table. The SQL files are written for
+        PostgreSQL; other databases only get create_all(), which already
+        builds the current schema.
+        The current session is closed first, since locks held by its open
+        transaction would block the migrations.
+        return:
+            array: names of the files applied
+    """
+    db.session.remove()
+    db.create_all()
+    engine = db.engine
+    if engine.dialect.name != 'postgresql':
+        return []
+
+    with engine.begin() as connection:
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "name text PRIMARY KEY, "
+            "applied_at timestamptz NOT NULL DEFAULT now())"
+        )
+        done = set(
+            row[0] for row in
+            connection.execute("SELECT name FROM schema_migrations")
+        )
+
+    applied = []
+    for name in migration_files():
+        if name in done:
+            continue
+        with open(os.path.join(MIGRATIONS_DIR, name)) as sql_file:
+            sql = sql_file.read()
+        with engine.begin() as connection:
+            connection.execute(sql)
+            connection.execute(
+                db.text("INSERT INTO schema_migrations (name) VALUES (:name)"),
+                name=name
+            )
+        applied.append(name)
+    return applied
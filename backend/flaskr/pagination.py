@@ -0,0 +1,79 @@
+import base64
+
+
+def encode_cursor(question_id):
+    """ Opaque cursor pointing after question_id. """
+    return base64.urlsafe_b64encode(
+        str(question_id).encode('ascii')
+    ).decode('ascii').rstrip('=')
+
+
+def decode_cursor(value):
+    """ Returns the question id of a cursor. A plain id is accepted too.
+        Raises ValueError if value is neither.
+    """
+    if value.isdigit():
+        return int(value)
+    padded = value + '=' * (-len(value) % 4)
+    try:
+        return int(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError("Invalid cursor: {0}".format(value))
+
+
+def get_limit(args, default, maximum=100):
+    """ Reads the limit GET arg, between 1 and maximum. Raises ValueError
+        if it is not a number.
+    """
+    limit = int(args.get('limit', default))
+    return min(max(limit, 1), maximum)
+
+
+def page_args(args, per_page):
+    """ Page GET args.
+    description: Reads after and limit, or page when after is missing.
+        Raises ValueError if they are not valid.
+        return:
+            tuple: (page, after, limit), page is None with after and after
+                is None without it
+    """
+    after = args.get('after', None)
+    if after is not None:
+        return None, decode_cursor(after), get_limit(args, per_page)
+    return int(args.get('page', 1)), None, per_page
+
+
+def offset_page(query, column, page, per_page):
+    """ Page page (1-based) of query ordered by column. Deep pages get
+        slower: the database still reads every skipped row.
+    """
+    return query.order_by(column.asc()).offset(
+        max(page - 1, 0) * per_page
+    ).limit(per_page).all()
+
+
+def seek_page(query, column, first, per_page):
+    """ Page of query ordered by column that starts at the row whose column
+        is first, found with an index seek. Used for numbered pages when the
+        first id of the page is known (see QuestionPool.id_at()).
+    """
+    return query.filter(column >= first).order_by(column.asc()).limit(
+        per_page
+    ).all()
+
+
+def keyset_page(query, column, after, limit):
+    """ Keyset page.
+    description: Returns up to limit rows of query whose column is greater
+        than after, ordered by column, seeking on its index instead of
+        skipping rows. next_cursor is None on the last page.
+        return:
+            tuple: (rows, next_cursor)
+    """
+    if after is not None:
+        query = query.filter(column > after)
+    rows = query.order_by(column.asc()).limit(limit + 1).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(getattr(rows[-1], column.key))
+    return rows, None
@@ -0,0 +1,419 @@
+import random
+import sys
+import threading
+import time
+import weakref
+from array import array
+from bisect import bisect_left, insort
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from models import db, primary_reads, Question
+
+# Session.info key of the question writes of the current transaction, as
+# ('add', id, category, difficulty) or ('discard', id, category, None)
+CHANGES_KEY = 'question_pool_changes'
+
+# Every live pool gets the question writes committed in this process. A
+# WeakSet, so pools go away with their app.
+_pools = weakref.WeakSet()
+
+
+def _changes(session):
+    return session.info.setdefault(CHANGES_KEY, [])
+
+
+def questions_written(session, rows):
+    """ Records inserted or updated question rows (dicts or objects with
+        id, category and difficulty) in session. Pools apply them when it
+        commits. The Question mapper events call it; set-based writes must
+        call it themselves.
+    """
+    changes = _changes(session)
+    for row in rows:
+        if isinstance(row, dict):
+            values = row['id'], row['category'], row.get('difficulty')
+        else:
+            values = row.id, row.category, row.difficulty
+        changes.append(('add',) + values)
+
+
+def questions_deleted(session, rows):
+    """ Records deleted questions, as (id, category) pairs, in session. """
+    changes = _changes(session)
+    for question_id, category in rows:
+        changes.append(('discard', question_id, category, None))
+
+
+def _question_inserted(mapper, connection, target):
+    questions_written(object_session(target), [target])
+
+
+def _question_updated(mapper, connection, target):
+    # The old category and difficulty are unknown: drop the id everywhere
+    questions_deleted(object_session(target), [(target.id, None)])
+    questions_written(object_session(target), [target])
+
+
+def _question_deleted(mapper, connection, target):
+    questions_deleted(object_session(target), [(target.id, target.category)])
+
+
+def _after_commit(session):
+    changes = session.info.pop(CHANGES_KEY, None)
+    if changes is None:
+        return
+    for pool in list(_pools):
+        pool.apply(changes)
+
+
+def _after_rollback(session):
+    session.info.pop(CHANGES_KEY, None)
+
+
+event.listen(Question, 'after_insert', _question_inserted)
+event.listen(Question, 'after_update', _question_updated)
+event.listen(Question, 'after_delete', _question_deleted)
+event.listen(Session, 'after_commit', _after_commit)
+event.listen(Session, 'after_rollback', _after_rollback)
+
+
+def read_version(session):
+    """ Returns the version of the question bank, advanced once by every
+        transaction that writes to the questions table, or None if the
+        question_version sequence (migrations/006_question_version.sql,
+        only for PostgreSQL) is missing.
+    """
+    connection = session.connection()
+    if connection.dialect.name != 'postgresql' or connection.execute(
+        "SELECT to_regclass('question_version')"
+    ).scalar() is None:
+        return None
+    return connection.execute(
+        'SELECT last_value FROM question_version'
+    ).scalar()
+
+
+class QuestionPool(object):
+    """ Question id index.
+    description: Keeps the ids of every question in memory, grouped by
+        category and by category and difficulty, so quizzes can pick a
+        random question, and listings count questions and find the first
+        id of a page, without asking the database. Ids are stored as
+        sorted int arrays (4 bytes each); category 0 holds every id ("All"
+        in the quiz view). Every question is in four arrays: all, its
+        category, and the difficulty buckets of both, which makes about
+        16 MB for 1M questions (see memory_usage()).
+
+        The index loads itself on first use. Questions written through the
+        Question model (insert(), delete(), or an update) and the ones
+        recorded with questions_written() / questions_deleted() are added
+        or removed when their transaction commits, in every pool of the
+        process.
+
+        Writes from other processes are found with the question_version
+        sequence (migrations/006_question_version.sql): at most every
+        check_interval seconds the version is read, and if it moved by
+        more than the commits seen in this process the index is rebuilt
+        on that request. Without the sequence, the index is rebuilt when it
+        expires (max_age seconds). generation counts the loads and changes
+        of the index, loads only the loads: a load can bring in writes of
+        other processes.
+    """
+    ALL = 0
+
+    def __init__(self, max_age=300, attempts=8, check_interval=1.0):
+        self.max_age = max_age
+        self.attempts = attempts
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._ids = None
+        self._levels = None
+        self._loaded_at = 0
+        self._checked_at = 0
+        # Set by invalidate(): the next use reloads the index
+        self._invalid = False
+        # question_version value of the last load or check, and the
+        # commits applied since then
+        self._version = None
+        self._commits = 0
+        self.generation = 0
+        self.loads = 0
+        _pools.add(self)
+
+    def load(self, batch_size=10000):
+        """ Reads every question id, category and difficulty from db and
+            rebuilds the index. The rows are read batch_size at a time.
+        """
+        table = Question.__table__
+        # Shared by every request, so read from the primary
+        with primary_reads():
+            version = read_version(db.session)
+            result = db.session.connection().execution_options(
+                stream_results=True
+            ).execute(db.select([
+                table.c.id, table.c.category, table.c.difficulty
+            ]).order_by(table.c.id.asc()))
+        everything = array('i')
+        ids = {self.ALL: everything}
+        levels = {self.ALL: {}}
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            for question_id, category, difficulty in rows:
+                everything.append(question_id)
+                if difficulty is not None:
+                    level = levels[self.ALL].get(difficulty)
+                    if level is None:
+                        level = levels[self.ALL][difficulty] = array('i')
+                    level.append(question_id)
+                if category is None:
+                    continue
+                category_ids = ids.get(category)
+                if category_ids is None:
+                    category_ids = ids[category] = array('i')
+                    levels[category] = {}
+                category_ids.append(question_id)
+                if difficulty is not None:
+                    level = levels[category].get(difficulty)
+                    if level is None:
+                        level = levels[category][difficulty] = array('i')
+                    level.append(question_id)
+        now = time.monotonic()
+        with self._lock:
+            self._ids = ids
+            self._levels = levels
+            self._version = version
+            self._commits = 0
+            self._loaded_at = self._checked_at = now
+            self._invalid = False
+            self.generation += 1
+            self.loads += 1
+
+    def invalidate(self):
+        """ Makes the next use reload the index. The current arrays stay
+            in place until then: readers may be using them.
+        """
+        with self._lock:
+            self._invalid = True
+            self.generation += 1
+
+    @property
+    def stale(self):
+        """ True when the next use will load the index, or check the
+            question_version sequence.
+        """
+        now = time.monotonic()
+        if self._ids is None or self._invalid \
+                or now - self._loaded_at > self.max_age:
+            return True
+        return self._version is not None \
+            and now - self._checked_at > self.check_interval
+
+    def refresh(self):
+        """ Loads the index if it is missing or expired. Otherwise reads
+            the question_version sequence and rebuilds the index only if
+            another process wrote questions.
+        """
+        # One thread loads, the others wait for its result
+        with self._load_lock:
+            if not self.stale:
+                return
+            if self._ids is None or self._invalid \
+                    or time.monotonic() - self._loaded_at > self.max_age:
+                return self.load()
+            with primary_reads():
+                version = read_version(db.session)
+            with self._lock:
+                if version == self._version + self._commits:
+                    self._version = version
+                    self._commits = 0
+                    self._checked_at = time.monotonic()
+                    return
+            self.load()
+
+    def _ensure_loaded(self):
+        if self.stale:
+            self.refresh()
+
+    def _arrays(self, category, difficulty=None):
+        """ The arrays a question of category and difficulty is in. """
+        keys = [self.ALL]
+        if category is not None:
+            keys.append(int(category))
+        arrays = []
+        for key in keys:
+            if key not in self._ids:
+                self._ids[key] = array('i')
+            arrays.append(self._ids[key])
+            if difficulty is not None:
+                arrays.append(self._levels.setdefault(key, {}).setdefault(
+                    int(difficulty), array('i')
+                ))
+        return arrays
+
+    def _add(self, question_id, category, difficulty):
+        for ids in self._arrays(category, difficulty):
+            position = bisect_left(ids, question_id)
+            if position == len(ids) or ids[position] != question_id:
+                insort(ids, question_id)
+
+    def _discard(self, question_id, category):
+        if category is None:
+            keys = list(self._ids)
+        else:
+            keys = [self.ALL, int(category)]
+        for key in keys:
+            arrays = [self._ids.get(key)]
+            arrays.extend(self._levels.get(key, {}).values())
+            for ids in arrays:
+                if not ids:
+                    continue
+                position = bisect_left(ids, question_id)
+                if position < len(ids) and ids[position] == question_id:
+                    del ids[position]
+
+    def add(self, question_id, category, difficulty=None):
+        """ Adds a freshly inserted question. No-op until the pool loads. """
+        with self._lock:
+            if self._ids is not None:
+                self._add(question_id, category, difficulty)
+                self.generation += 1
+
+    def discard(self, question_id, category=None):
+        """ Removes a deleted question. If the category is unknown, every
+            category is checked.
+        """
+        with self._lock:
+            if self._ids is not None:
+                self._discard(question_id, category)
+                self.generation += 1
+
+    def apply(self, changes):
+        """ Applies the changes of one committed transaction. """
+        with self._lock:
+            if self._ids is None:
+                return
+            for action, question_id, category, difficulty in changes:
+                if action == 'add':
+                    self._add(question_id, category, difficulty)
+                else:
+                    self._discard(question_id, category)
+            self._commits += 1
+            self.generation += 1
+
+    def _get(self, category, difficulty):
+        if difficulty is None:
+            return self._ids.get(int(category))
+        return self._levels.get(int(category), {}).get(int(difficulty))
+
+    def ids(self, category=ALL, difficulty=None):
+        """ Returns a copy of the sorted id array of a category, or of one
+            of its difficulty buckets.
+        """
+        self._ensure_loaded()
+        with self._lock:
+            return array('i', self._get(category, difficulty) or ())
+
+    def snapshot(self):
+        """ Returns the generation and a copy of the sorted id array of
+            every category, as of that generation.
+        """
+        self._ensure_loaded()
+        with self._lock:
+            return self.generation, {
+                category: array('i', ids)
+                for category, ids in self._ids.items()
+            }
+
+    def count(self, category=ALL, difficulty=None):
+        self._ensure_loaded()
+        with self._lock:
+            return len(self._get(category, difficulty) or ())
+
+    def id_at(self, category, position):
+        """ Returns the id at position (0-based) in id order of a category,
+            or None past its end. Offset pages seek to it instead of
+            making the database skip position rows.
+        """
+        self._ensure_loaded()
+        with self._lock:
+            ids = self._get(category, None)
+            if not ids or position >= len(ids):
+                return None
+            return ids[max(position, 0)]
+
+    def difficulties(self, category=ALL):
+        """ Returns {difficulty: question count} of a category. """
+        self._ensure_loaded()
+        with self._lock:
+            return {
+                difficulty: len(ids) for difficulty, ids in sorted(
+                    self._levels.get(int(category), {}).items()
+                )
+            }
+
+    def memory_usage(self):
+        """ Bytes held by the id arrays. """
+        with self._lock:
+            if self._ids is None:
+                return 0
+            arrays = list(self._ids.values())
+            for levels in self._levels.values():
+                arrays.extend(levels.values())
+            return sum(sys.getsizeof(ids) for ids in arrays)
+
+    def pick(self, category=ALL, exclude=(), difficulty=None):
+        """ Random question id.
+        description: Returns a random id of the given category, and
+            difficulty if not None, that is not in exclude, or None when
+            every id has been used.
+            While most of the category is still available it samples at
+            random and retries on collisions, which takes constant time.
+            Late in a quiz, when most ids are excluded, it falls back to
+            choosing among the ids that are left.
+        """
+        self._ensure_loaded()
+        excluded = exclude if isinstance(exclude, (set, frozenset)) \
+            else set(exclude)
+        with self._lock:
+            ids = self._get(category, difficulty)
+            if not ids:
+                return None
+            size = len(ids)
+            if len(excluded) * 2 < size:
+                for _ in range(self.attempts):
+                    candidate = ids[random.randrange(size)]
+                    if candidate not in excluded:
+                        return candidate
+            remaining = [i for i in ids if i not in excluded]
+        if not remaining:
+            return None
+        return random.choice(remaining)
+
+    def pick_nearest(self, category=ALL, exclude=(), difficulty=3,
+                     direction=0):
+        """ Random question id of the nearest difficulty.
+        description: Like pick(), from the difficulty bucket of category.
+            When every id of that bucket is excluded (or it is empty) the
+            other buckets are tried, nearest first; on ties, the bucket in
+            direction (1: harder, -1: easier) goes first. Questions without
+            a difficulty come last. Returns None when every id has been
+            used.
+        """
+        self._ensure_loaded()
+        excluded = exclude if isinstance(exclude, (set, frozenset)) \
+            else set(exclude)
+        with self._lock:
+            levels = list(self._levels.get(int(category), ()))
+        levels.sort(key=lambda level: (
+            abs(level - difficulty), (difficulty - level) * direction
+        ))
+        for level in levels:
+            question_id = self.pick(category, excluded, level)
+            if question_id is not None:
+                return question_id
+        return self.pick(category, excluded)
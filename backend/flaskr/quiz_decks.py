@@ -0,0 +1,187 @@
+import atexit
+import logging
+import random
+import sys
+import threading
+import time
+from array import array
+
+from models import db
+
+logger = logging.getLogger(__name__)
+
+
+class QuizDecks(object):
+    """ Shuffled quiz decks.
+    description: Keeps decks shuffled copies of the question ids of every
+        category of the question pool, and of all of them (category 0), as
+        int arrays (4 bytes per question and deck), so a new quiz session
+        is handed a copy of a deck instead of shuffling as it goes. Decks
+        of a category are dealt in turn.
+
+        A background thread (started by the first deal) builds them from
+        the pool, and builds them again when the pool changes (questions
+        written in this process, or by others once the pool sees them) and
+        every rotate_interval seconds, so quizzes don't get the same
+        orders for long. It looks every check_interval seconds, so a build
+        takes at most one core for its duration (about 1 second per
+        million ids and deck) every check_interval seconds; 0 disables the
+        thread, refresh() then has to be called. Until the
+        decks match the pool, deal() returns None and the session shuffles
+        the pool ids itself, so a quiz never gets a deleted question or
+        misses a new one.
+    """
+
+    def __init__(self, pool, decks=2, rotate_interval=300.0,
+                 check_interval=1.0, clock=time.monotonic):
+        self.pool = pool
+        self.decks = decks
+        self.rotate_interval = rotate_interval
+        self.check_interval = check_interval
+        self.clock = clock
+        self.app = None
+        self.dealt = 0
+        self.missed = 0
+        self.builds = 0
+        self.build_seconds = 0.0
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        # category: list of decks, built from the pool at _generation
+        self._decks = None
+        self._turns = {}
+        self._generation = None
+        self._built_at = 0
+        self._thread = None
+        self._stopped = threading.Event()
+        self._wake = threading.Event()
+
+    def init_app(self, app):
+        self.app = app
+
+    @property
+    def stale(self):
+        """ True when the decks don't match the pool or are due for
+            rotation.
+        """
+        return self._decks is None \
+            or self._generation != self.pool.generation \
+            or self.clock() - self._built_at > self.rotate_interval
+
+    def build(self):
+        """ Shuffles new decks from the pool ids. Needs an app context
+            when the pool has to load.
+        """
+        with self._build_lock:
+            start = time.perf_counter()
+            generation, categories = self.pool.snapshot()
+            decks = {}
+            for category, ids in categories.items():
+                decks[category] = []
+                for _ in range(self.decks):
+                    deck = array('i', ids)
+                    random.shuffle(deck)
+                    decks[category].append(deck)
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._decks = decks
+                self._turns = {}
+                self._generation = generation
+                self._built_at = self.clock()
+                self.builds += 1
+                self.build_seconds += elapsed
+
+    def refresh(self):
+        """ Builds the decks if they are stale. Returns True if it did. """
+        if self.pool.stale:
+            self.pool.refresh()
+        if not self.stale:
+            return False
+        self.build()
+        return True
+
+    def deal(self, category):
+        """ Returns a copy of the next deck of category, which the caller
+            owns, or None when the decks are not built or behind the pool.
+            Unknown categories get an empty deck.
+        """
+        category = int(category)
+        if self.pool.stale:
+            self.pool.refresh()
+        if self._thread is None and self.check_interval:
+            self._start()
+        with self._lock:
+            first = self._decks is None
+            if first or self._generation != self.pool.generation:
+                self.missed += 1
+            else:
+                decks = self._decks.get(category)
+                self.dealt += 1
+                if not decks:
+                    return array('i')
+                turn = self._turns.get(category, 0)
+                self._turns[category] = (turn + 1) % len(decks)
+                return array('i', decks[turn])
+        if first:
+            self._wake.set()
+        return None
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name='quiz-decks'
+            )
+            self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.clear()
+            self._refresh_in_app()
+            self._wake.wait(self.check_interval)
+
+    def _refresh_in_app(self):
+        if self.app is None:
+            return self._refresh_logged()
+        with self.app.app_context():
+            try:
+                return self._refresh_logged()
+            finally:
+                db.session.remove()
+
+    def _refresh_logged(self):
+        try:
+            return self.refresh()
+        except Exception:
+            logger.exception('Could not build the quiz decks')
+            return False
+
+    def close(self):
+        """ Stops the background thread. """
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def memory_usage(self):
+        """ Bytes held by the decks. """
+        with self._lock:
+            if self._decks is None:
+                return 0
+            return sum(
+                sys.getsizeof(deck) for decks in self._decks.values()
+                for deck in decks
+            )
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                'dealt': self.dealt,
+                'missed': self.missed,
+                'builds': self.builds,
+                'build_seconds': self.build_seconds,
+            }
+        stats['bytes'] = self.memory_usage()
+        return stats
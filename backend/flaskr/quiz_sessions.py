@@ -0,0 +1,122 @@
+import random
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+
+class QuizSession(object):
+    """ Quiz session.
+    description: Remaining questions of one quiz. ids is a private copy of
+        the category ids (4 bytes per question) that gets shuffled lazily:
+        each call to next() swaps a random remaining id into the cursor
+        position, so starting a session costs a copy, not a full shuffle.
+        A shuffled copy (a deck of flaskr.quiz_decks) is played in order.
+    """
+    __slots__ = ('token', 'category', 'ids', 'cursor', 'expires_at',
+                 'shuffled')
+
+    def __init__(self, token, category, ids, expires_at, shuffled=False):
+        self.token = token
+        self.category = category
+        self.ids = ids
+        self.cursor = 0
+        self.expires_at = expires_at
+        self.shuffled = shuffled
+
+    @property
+    def remaining(self):
+        return len(self.ids) - self.cursor
+
+    def next(self):
+        """ Returns the next question id, or None when the quiz is over. """
+        ids = self.ids
+        cursor = self.cursor
+        if cursor >= len(ids):
+            return None
+        if not self.shuffled:
+            swap = random.randrange(cursor, len(ids))
+            ids[cursor], ids[swap] = ids[swap], ids[cursor]
+        self.cursor = cursor + 1
+        return ids[cursor]
+
+
+class QuizSessionStore(object):
+    """ Quiz sessions.
+    description: In-memory quiz sessions keyed by an opaque token. A session
+        expires ttl seconds after it was last used; expired sessions are
+        evicted on every access. When max_sessions is reached, the least
+        recently used session is dropped.
+
+        Sessions live in the memory of the process that started them, so
+        the session routes need every request of a quiz to reach that
+        process: one server process, or sticky sessions. Tokens start with
+        the instance id of their store, so owns() tells a token of another
+        process from an expired one. Starting a session copies the ids of
+        its category (4 bytes per question).
+    """
+
+    def __init__(self, ttl=1800, max_sessions=10000, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.clock = clock
+        self.instance = secrets.token_hex(4)
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _evict(self, now):
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if session.expires_at > now:
+                break
+            self._sessions.popitem(last=False)
+
+    def start(self, category, ids, shuffled=False):
+        """ Starts a session over ids (an array the session takes over),
+            already in a random order if shuffled.
+        """
+        now = self.clock()
+        token = '{0}.{1}'.format(self.instance, secrets.token_urlsafe(16))
+        session = QuizSession(token, category, ids, now + self.ttl, shuffled)
+        with self._lock:
+            self._evict(now)
+            while len(self._sessions) >= self.max_sessions:
+                self._sessions.popitem(last=False)
+            self._sessions[session.token] = session
+        return session
+
+    def owns(self, token):
+        """ True when token was started by this store, live or not. """
+        return token.partition('.')[0] == self.instance
+
+    def get(self, token):
+        """ Returns a live session and refreshes its ttl, or None. """
+        now = self.clock()
+        with self._lock:
+            self._evict(now)
+            session = self._sessions.get(token)
+            if session is not None:
+                session.expires_at = now + self.ttl
+                self._sessions.move_to_end(token)
+            return session
+
+    def next(self, token):
+        """ Returns (session, next question id) for a live session, or
+            (None, None) when the token is unknown or expired. A session
+            that ran out of questions (id None) is ended.
+        """
+        session = self.get(token)
+        if session is None:
+            return None, None
+        with self._lock:
+            question_id = session.next()
+            if question_id is None:
+                self._sessions.pop(token, None)
+            return session, question_id
+
+    def end(self, token):
+        with self._lock:
+            return self._sessions.pop(token, None) is not None
@@ -0,0 +1,296 @@
+import hashlib
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # the shared backend needs POSIX file locks
+    fcntl = None
+
+# Limits by name: a route group below or any Flask endpoint name, as
+# count requests per seconds. Searches are GET /questions with a question
+# arg; quizzes every route picking a quiz question or starting a quiz
+# session, which copies the ids of its category.
+DEFAULT_LIMITS = 'quizzes=20/10,search=10/10'
+ROUTE_GROUPS = {
+    'play_quiz': 'quizzes',
+    'start_quiz_session': 'quizzes',
+    'play_quiz_session': 'quizzes',
+}
+
+# Shared backend slots: key hash, tokens, last update
+SLOT = struct.Struct('<qdd')
+# Slots looked at for a key before the oldest of them is reused
+PROBES = 8
+
+
+def parse_limits(text):
+    """ Parses RATE_LIMITS.
+    description: Comma separated name=count/seconds rules: clients get
+        count requests of the named routes per seconds, in bursts of up to
+        count. name@client=count/seconds is the quota of one client (its
+        address), ie: 'quizzes=20/10,quizzes@10.0.0.5=200/10'.
+        Raises ValueError on an invalid rule.
+        return:
+            dict: (name, client or None): (count, seconds)
+    """
+    limits = {}
+    for rule in (text or '').split(','):
+        rule = rule.strip()
+        if not rule:
+            continue
+        try:
+            target, quota = rule.split('=')
+            count, seconds = quota.split('/')
+            count, seconds = int(count), float(seconds)
+            name, _, client = target.strip().partition('@')
+            if not name:
+                raise ValueError(rule)
+        except ValueError:
+            raise ValueError('Invalid RATE_LIMITS: {0!r}, expected '
+                             'name=count/seconds'.format(rule))
+        if count < 1 or seconds <= 0:
+            raise ValueError('Invalid RATE_LIMITS: {0!r}, expected a count '
+                             'and seconds above 0'.format(rule))
+        limits[(name, client or None)] = (count, seconds)
+    return limits
+
+
+def limit_name(endpoint, args):
+    """ Name of the limit of a request to endpoint with GET args. """
+    if endpoint == 'get_questions' and args.get('question'):
+        return 'search'
+    return ROUTE_GROUPS.get(endpoint, endpoint)
+
+
+def client_address(remote_addr, forwarded_for=None, proxies=0):
+    """ Address of the client. With proxies (reverse proxies, load
+        balancers) in front of the app, it is the address the first of
+        them saw, from the X-Forwarded-For header: the proxies append to
+        it, so entries further left can be forged by the client.
+    """
+    if proxies and forwarded_for:
+        addresses = [address.strip() for address in forwarded_for.split(',')]
+        if len(addresses) >= proxies:
+            return addresses[-proxies]
+    return remote_addr or ''
+
+
+class MemoryRateLimitBackend(object):
+    """ In-process token buckets.
+    description: One (tokens, last update) pair per key in an LRU ordered
+        dict. When max_keys is reached the least recently used key is
+        dropped, which gives its client a full bucket again: only clients
+        idle for longer than the busiest max_keys are affected.
+    """
+    name = 'memory'
+
+    def __init__(self, max_keys=100000, clock=time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        self._lock = threading.Lock()
+        # key: (tokens, updated_at)
+        self._buckets = OrderedDict()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, key, count, seconds):
+        """ Takes a token from the bucket of key, which holds count tokens
+            refilled over seconds. Returns 0 if it was taken, else the
+            seconds until the next token.
+        """
+        rate = count / seconds
+        with self._lock:
+            now = self.clock()
+            tokens, updated_at = self._buckets.pop(key, (count, now))
+            tokens = min(count, tokens + (now - updated_at) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def stats(self):
+        return {'keys': len(self._buckets)}
+
+
+class SharedRateLimitBackend(object):
+    """ Token buckets shared by the processes of a host.
+    description: The buckets live in a file mapped in memory by every
+        server process (ie: gunicorn workers), as a hash table of slots
+        (key hash, tokens, last update), under an exclusive flock, so a
+        client gets the same quota whatever the worker that serves it.
+        A key takes the first free slot of the PROBES after its hash;
+        when they are all used, the one updated longest ago is reused,
+        which gives its client a full bucket again. The file holds
+        slots * 24 bytes; it is created when missing and can be deleted
+        to reset every bucket (after restarting the servers).
+    """
+    name = 'shared'
+
+    def __init__(self, path=None, slots=65536, clock=time.time):
+        if fcntl is None:
+            raise RuntimeError('RATE_LIMIT = shared needs POSIX file locks')
+        self.path = path or os.path.join(
+            tempfile.gettempdir(), 'trivia_rate_limit'
+        )
+        self.slots = slots
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._file = open(self.path, 'a+b')
+        size = slots * SLOT.size
+        if os.fstat(self._file.fileno()).st_size < size:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                if os.fstat(self._file.fileno()).st_size < size:
+                    self._file.truncate(size)
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._file.fileno(), size)
+
+    @staticmethod
+    def _hash(key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+        # 0 marks a free slot
+        return struct.unpack('<q', digest)[0] or 1
+
+    def _find(self, key_hash):
+        """ Offset of the slot of key_hash, and whether it is new. """
+        oldest = None
+        for probe in range(PROBES):
+            offset = (key_hash + probe) % self.slots * SLOT.size
+            stored, _, updated_at = SLOT.unpack_from(self._map, offset)
+            if stored == key_hash:
+                return offset, False
+            if stored == 0:
+                return offset, True
+            if oldest is None or updated_at < oldest[1]:
+                oldest = offset, updated_at
+        return oldest[0], True
+
+    def take(self, key, count, seconds):
+        """ Same as MemoryRateLimitBackend.take(). """
+        key_hash = self._hash(key)
+        rate = count / seconds
+        # flock only excludes other processes: threads share the file
+        with self._lock:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                now = self.clock()
+                offset, new = self._find(key_hash)
+                if new:
+                    tokens = count
+                else:
+                    _, tokens, updated_at = SLOT.unpack_from(
+                        self._map, offset
+                    )
+                    # max(): the clock of another process may be behind
+                    tokens = min(
+                        count, tokens + max(now - updated_at, 0) * rate
+                    )
+                wait = 0.0
+                if tokens >= 1:
+                    tokens -= 1
+                else:
+                    wait = (1 - tokens) / rate
+                SLOT.pack_into(self._map, offset, key_hash, tokens, now)
+                return wait
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+
+    def clear(self):
+        with self._lock:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                self._map[:] = bytes(len(self._map))
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def stats(self):
+        return {}
+
+
+class RateLimiter(object):
+    """ Rate limiter.
+    description: Token buckets per limit and client: a client can make
+        count requests of a limit at once, then one every seconds / count
+        seconds. Limits are named after the routes they cover
+        (limit_name()); routes without a limit are not counted. A client
+        with its own quota for a limit (name@client) gets it instead.
+    """
+
+    def __init__(self, backend, limits, proxies=0):
+        self.backend = backend
+        # (name, client or None): (count, seconds), see parse_limits()
+        self.limits = limits
+        self.proxies = proxies
+        self.names = set(name for name, _ in self.limits)
+        self._lock = threading.Lock()
+        # limit name: requests refused
+        self.limited = {}
+
+    def check(self, endpoint, args, remote_addr, forwarded_for=None):
+        """ Takes a token for a request. Returns None when it can be
+            served, else the seconds the client has to wait.
+        """
+        name = limit_name(endpoint, args)
+        if name not in self.names:
+            return None
+        client = client_address(remote_addr, forwarded_for, self.proxies)
+        limit = self.limits.get((name, client)) or self.limits.get(
+            (name, None)
+        )
+        if limit is None:
+            return None
+        wait = self.backend.take('{0}@{1}'.format(name, client), *limit)
+        if not wait:
+            return None
+        with self._lock:
+            self.limited[name] = self.limited.get(name, 0) + 1
+        return wait
+
+    @staticmethod
+    def retry_after(wait):
+        """ Retry-After header value of a wait: whole seconds, at least 1.
+        """
+        return str(max(1, int(math.ceil(wait))))
+
+    def stats(self):
+        with self._lock:
+            stats = {'backend': self.backend.name,
+                     'limited': dict(self.limited)}
+        stats.update(self.backend.stats())
+        return stats
+
+
+def create_rate_limiter(name=None, limits=None, path=None, proxies=0):
+    """ Rate limiter of the RATE_LIMIT setting: 'off' (default, None),
+        'memory' or 'shared' (RATE_LIMIT_FILE), with the RATE_LIMITS rules.
+        The rules are checked even when it is off.
+    """
+    limits = parse_limits(DEFAULT_LIMITS if limits is None else limits)
+    name = (name or 'off').lower()
+    if name == 'off':
+        return None
+    if name == 'memory':
+        backend = MemoryRateLimitBackend()
+    elif name == 'shared':
+        backend = SharedRateLimitBackend(path)
+    else:
+        raise ValueError('Unknown rate limiter: {0}'.format(name))
+    return RateLimiter(backend, limits, proxies)
@@ -0,0 +1,272 @@
+import atexit
+import logging
+import threading
+import time
+
+from flask import request
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine.url import make_url
+
+from models import REPLICA_KEY, WROTE_KEY, db, engine_options
+
+logger = logging.getLogger(__name__)
+
+# Endpoints whose reads go to a replica: listings, searches and quiz
+# question selection. Every other route reads and writes the primary.
+READ_ENDPOINTS = (
+    'get_categories',
+    'get_questions',
+    'get_category_questions',
+    'play_quiz',
+    'start_quiz_session',
+    'play_quiz_session',
+)
+# Endpoints after which the client reads the primary for a while
+WRITE_ENDPOINTS = (
+    'create_question',
+    'create_questions_batch',
+    'delete_question',
+    'delete_questions_batch',
+    'import_questions_route',
+)
+# Cookie of the clients that wrote: the time until which their reads go to
+# the primary
+PIN_COOKIE = 'trivia_primary_until'
+
+
+def parse_replica_urls(text):
+    """ Parses DB_REPLICA_URLS, comma separated database urls.
+        Raises ValueError on an invalid url.
+        return:
+            list: urls
+    """
+    urls = []
+    for url in (text or '').split(','):
+        url = url.strip()
+        if not url:
+            continue
+        try:
+            make_url(url)
+        except Exception:
+            raise ValueError('Invalid DB_REPLICA_URLS: {0!r}, expected '
+                             'comma separated database urls'.format(url))
+        urls.append(url)
+    return urls
+
+
+class Replica(object):
+    """ A read replica: its engine, whether it answers, and the requests
+        it served. Its name is its url without the password.
+    """
+    __slots__ = ('name', 'engine', 'healthy', 'reads')
+
+    def __init__(self, engine):
+        self.name = repr(engine.url)
+        self.engine = engine
+        self.healthy = True
+        self.reads = 0
+
+
+class ReplicaRouter(object):
+    """ Read replica router.
+    description: Sends the reads of READ_ENDPOINTS to the replicas in
+        turn, by setting the replica engine in the db.session info (see
+        models.RoutingSession); writes, and everything a session does after
+        its first write, go to the primary.
+
+        A replica that fails a health check (SELECT 1), or loses its
+        connection during a request, is skipped until a check finds it up
+        again; with every replica down, reads go to the primary. A
+        background thread (started by the first routed request) checks
+        them every check_interval seconds; 0 disables it, check() then has
+        to be called.
+
+        Replicas lag behind the primary. So that curators see what they
+        just wrote, a successful request to WRITE_ENDPOINTS sets a cookie
+        sending the reads of its client to the primary for
+        read_your_writes seconds (0 disables it), and responses read from
+        a replica that soon after a write of this process are not cached.
+        Requests that change nothing on the primary can still read a row
+        the replica doesn't have yet: quiz questions missing on the replica
+        are looked up on the primary before being skipped.
+    """
+
+    def __init__(self, engines, check_interval=5.0, read_your_writes=5.0,
+                 clock=time.time):
+        self.replicas = [Replica(engine) for engine in engines]
+        self.check_interval = check_interval
+        self.read_your_writes = read_your_writes
+        # Wall clock: pin cookies are checked by every server process
+        self.clock = clock
+        self.fallbacks = 0
+        self.pinned_reads = 0
+        self._lock = threading.Lock()
+        self._turn = 0
+        self._written_until = 0
+        self._thread = None
+        self._stopped = threading.Event()
+        for replica in self.replicas:
+            event.listen(replica.engine, 'handle_error',
+                         self._connection_error(replica))
+
+    def _connection_error(self, replica):
+        def handle_error(exception_context):
+            if exception_context.is_disconnect:
+                self.mark_down(replica, exception_context.original_exception)
+        return handle_error
+
+    def init_app(self, app):
+        app.before_request(self.route_request)
+        app.after_request(self.pin_writer)
+        app.teardown_request(self.request_finished)
+
+    def choose(self):
+        """ Returns the next healthy replica, or None when they are all
+            down.
+        """
+        if self._thread is None and self.check_interval:
+            self._start()
+        with self._lock:
+            for _ in range(len(self.replicas)):
+                replica = self.replicas[self._turn]
+                self._turn = (self._turn + 1) % len(self.replicas)
+                if replica.healthy:
+                    replica.reads += 1
+                    return replica
+            self.fallbacks += 1
+            return None
+
+    def mark_down(self, replica, error=None):
+        if replica.healthy:
+            logger.warning('Read replica %s is down: %s', replica.name, error)
+        replica.healthy = False
+
+    def check(self):
+        """ Runs SELECT 1 on every replica and updates their health.
+            Returns the number of healthy replicas.
+        """
+        for replica in self.replicas:
+            try:
+                with replica.engine.connect() as connection:
+                    connection.execute(text('SELECT 1'))
+            except Exception as error:
+                self.mark_down(replica, error)
+                continue
+            if not replica.healthy:
+                logger.warning('Read replica %s is up', replica.name)
+            replica.healthy = True
+        return sum(1 for replica in self.replicas if replica.healthy)
+
+    def pinned(self, cookie):
+        """ True when the pin cookie value sends the reads to the primary.
+        """
+        try:
+            return float(cookie) > self.clock()
+        except (TypeError, ValueError):
+            return False
+
+    def wrote(self):
+        """ Records a write of this process. Returns the time until which
+            its client reads the primary.
+        """
+        until = self.clock() + self.read_your_writes
+        self._written_until = until
+        return until
+
+    def stale(self, engine):
+        """ True when data read from engine (None: the primary) may miss a
+            write of this process, so it shouldn't be cached.
+        """
+        return engine is not None and self.clock() < self._written_until
+
+    def replica_for(self, endpoint, pin=None):
+        """ Engine of the replica a request to endpoint reads from, with
+            the value of its pin cookie, or None for the primary.
+        """
+        if endpoint not in READ_ENDPOINTS:
+            return None
+        if self.pinned(pin):
+            with self._lock:
+                self.pinned_reads += 1
+            return None
+        replica = self.choose()
+        return None if replica is None else replica.engine
+
+    def route_request(self):
+        engine = self.replica_for(
+            request.endpoint, request.cookies.get(PIN_COOKIE)
+        )
+        if engine is not None:
+            db.session.info[REPLICA_KEY] = engine
+        return None
+
+    def pin_writer(self, response):
+        if request.endpoint in WRITE_ENDPOINTS \
+                and response.status_code < 400 and self.read_your_writes:
+            response.set_cookie(
+                PIN_COOKIE, repr(self.wrote()),
+                max_age=int(self.read_your_writes) + 1, httponly=True
+            )
+        return response
+
+    def request_finished(self, error=None):
+        # The session outlives the request when an app context was pushed
+        # around it
+        info = db.session.info
+        info.pop(REPLICA_KEY, None)
+        info.pop(WROTE_KEY, None)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name='replica-checks'
+            )
+            self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while not self._stopped.wait(self.check_interval):
+            try:
+                self.check()
+            except Exception:
+                logger.exception('Could not check the read replicas')
+
+    def close(self):
+        """ Stops the background thread and closes the replica
+            connections.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        for replica in self.replicas:
+            replica.engine.dispose()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'replicas': [
+                    (replica.name, replica.healthy, replica.reads)
+                    for replica in self.replicas
+                ],
+                'fallbacks': self.fallbacks,
+                'pinned_reads': self.pinned_reads,
+            }
+
+
+def create_replica_router(urls, config, poolclass=None, check_interval=5.0,
+                          read_your_writes=5.0):
+    """ Router of the DB_REPLICA_URLS setting, or None without replicas.
+        Replica engines get the DB_* pool options of the primary.
+    """
+    urls = parse_replica_urls(urls)
+    if not urls:
+        return None
+    engines = [
+        create_engine(url, **engine_options(
+            dict(config, SQLALCHEMY_DATABASE_URI=url), poolclass
+        )) for url in urls
+    ]
+    return ReplicaRouter(engines, check_interval, read_your_writes)
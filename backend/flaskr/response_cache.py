@@ -0,0 +1,409 @@
+import threading
+import time
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+
+from werkzeug.urls import url_encode
+
+from .search import tokenize
+
+try:
+    import redis
+except ImportError:  # the shared backend is optional
+    redis = None
+
+# Bookkeeping bytes counted for every entry on top of its key and body
+ENTRY_OVERHEAD = 200
+# Search entries are invalidated by questions containing the first letters
+# of one of the search words. Matching whole words would miss stemmed and
+# substring matches of the search backends.
+SEARCH_MATCH_LENGTH = 3
+
+
+class MemoryCacheBackend(object):
+    """ In-process cache backend.
+    description: Keeps bodies in an LRU ordered dict. Entries expire after
+        their ttl; when the bodies, keys and ENTRY_OVERHEAD take more than
+        max_bytes, the least recently used entries are dropped. Each entry
+        can carry tags; invalidate() drops every entry of a tag.
+        generation() counts the invalidations and clears: a body computed
+        before one of them is not stored (see set()).
+    """
+    name = 'memory'
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.bytes = 0
+        self._lock = threading.Lock()
+        # key: (body, expires_at, tags)
+        self._entries = OrderedDict()
+        # tag: set of keys
+        self._tags = {}
+        self._generation = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        body, expires_at, tags = self._entries.pop(key)
+        self.bytes -= len(key) + len(body) + ENTRY_OVERHEAD
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= self.clock():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def generation(self):
+        return self._generation
+
+    def set(self, key, body, ttl, tags=(), generation=None):
+        """ Stores body, unless generation (from generation(), read
+            before computing it) is outdated.
+        """
+        size = len(key) + len(body) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (body, self.clock() + ttl, tuple(tags))
+            self.bytes += size
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, tags):
+        """ Drops the entries of tags, returns how many. """
+        with self._lock:
+            self._generation += 1
+            keys = set()
+            for tag in tags:
+                keys.update(self._tags.get(tag, ()))
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def tags(self, pattern):
+        """ Tags with entries matching a glob pattern, ie: 'search:*'. """
+        with self._lock:
+            return [tag for tag in self._tags if fnmatchcase(tag, pattern)]
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._tags.clear()
+            self.bytes = 0
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+        }
+
+
+class LocalStore(object):
+    """ In-process stand-in for the few Redis commands SharedCacheBackend
+        uses, for development and tests without a Redis server
+        (RESPONSE_CACHE_URL = local://).
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._lock = threading.Lock()
+        # key: (bytes or set of bytes, expires_at or None)
+        self._values = {}
+
+    def _get(self, key):
+        item = self._values.get(key)
+        if item is not None and item[1] is not None \
+                and item[1] <= self.clock():
+            del self._values[key]
+            return None
+        return None if item is None else item[0]
+
+    def get(self, key):
+        with self._lock:
+            value = self._get(key)
+            return value if isinstance(value, bytes) else None
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            self._values[key] = (
+                value, None if ex is None else self.clock() + ex
+            )
+
+    def incr(self, key):
+        with self._lock:
+            value = int(self._get(key) or 0) + 1
+            self._values[key] = (str(value).encode('utf-8'), None)
+            return value
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(
+                1 for key in keys if self._values.pop(key, None) is not None
+            )
+
+    def sadd(self, key, *members):
+        with self._lock:
+            members = set(
+                member.encode('utf-8') if isinstance(member, str) else member
+                for member in members
+            )
+            value = self._get(key)
+            if value is None:
+                self._values[key] = (members, None)
+            else:
+                value.update(members)
+
+    def smembers(self, key):
+        with self._lock:
+            return set(self._get(key) or ())
+
+    def expire(self, key, seconds):
+        with self._lock:
+            value = self._get(key)
+            if value is None:
+                return False
+            self._values[key] = (value, self.clock() + seconds)
+            return True
+
+    def scan_iter(self, match):
+        with self._lock:
+            keys = [key for key in list(self._values)
+                    if self._get(key) is not None]
+        return [
+            key.encode('utf-8') for key in keys if fnmatchcase(key, match)
+        ]
+
+    def info(self, section=None):
+        with self._lock:
+            return {'used_memory': sum(
+                len(value) for value, expires_at in self._values.values()
+                if isinstance(value, bytes)
+            )}
+
+
+class SharedCacheBackend(object):
+    """ Shared cache backend.
+    description: Stores bodies in Redis, or anything with the same get,
+        set, incr, delete, sadd, smembers, expire, scan_iter and info
+        commands, so every server process shares the entries and the
+        invalidations. The generation is a counter key, incremented by
+        every invalidation of any process.
+        Keys are prefixed with prefix; a tag is a Redis set of keys that
+        expires with its newest entry. Entries expire with SET ... EX
+        ttl; the memory cap and LRU eviction are the Redis maxmemory and
+        maxmemory-policy (allkeys-lru) settings.
+    """
+    name = 'shared'
+
+    def __init__(self, client, prefix='trivia:cache:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def generation(self):
+        return int(self.client.get(self.prefix + 'generation') or 0)
+
+    def set(self, key, body, ttl, tags=(), generation=None):
+        # Not atomic: an invalidation between the check and the SET keeps
+        # the body, for ttl at most
+        if generation is not None and generation != self.generation():
+            return
+        self.client.set(self.prefix + key, body, ex=int(ttl))
+        for tag in tags:
+            tag_key = self.prefix + 'tag:' + tag
+            self.client.sadd(tag_key, key)
+            self.client.expire(tag_key, int(ttl))
+
+    def invalidate(self, tags):
+        self.client.incr(self.prefix + 'generation')
+        keys = set()
+        for tag in tags:
+            tag_key = self.prefix + 'tag:' + tag
+            keys.update(
+                member.decode('utf-8')
+                for member in self.client.smembers(tag_key)
+            )
+            self.client.delete(tag_key)
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+        return len(keys)
+
+    def tags(self, pattern):
+        start = len(self.prefix + 'tag:')
+        return [
+            key.decode('utf-8')[start:] for key in
+            self.client.scan_iter(match=self.prefix + 'tag:' + pattern)
+        ]
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+        self.client.incr(self.prefix + 'generation')
+
+    def stats(self):
+        return {'bytes': self.client.info('memory').get('used_memory')}
+
+
+class ResponseCache(object):
+    """ Response cache.
+    description: Caches the JSON bodies of read routes, keyed on the path
+        and its sorted GET args (plus a variant, ie: the categories ETag, as
+        the bodies embed the categories), for ttl seconds.
+
+        Entries are tagged with what they depend on, so a question write
+        only drops the affected ones: 'questions' for the /questions
+        pages, 'category:<id>' for the pages of a category, and
+        'search:<words>' for a search, dropped when the question contains
+        the start of one of its words.
+
+        With the memory backend each process has its own entries and only
+        drops the affected ones for the writes it serves. The writes of
+        other processes (gunicorn workers, flask import-questions) are
+        found by the question pool, which reloads when it sees them (the
+        question_version sequence, at most every second): sync() is called
+        with its load count before each lookup and drops every entry when
+        it moved. Without the sequence (sqlite, before
+        migrations/006_question_version.sql) they show after ttl.
+
+        A body computed while a write dropped entries could miss that
+        write: callers read generation() before computing the body and
+        pass it to set(), which then doesn't store it.
+    """
+
+    def __init__(self, backend, ttl=60):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        # Question pool load count the entries were computed with
+        self._loads = None
+
+    @staticmethod
+    def key(path, args, variant=''):
+        return '{0}?{1}#{2}'.format(path, url_encode(args, sort=True), variant)
+
+    @staticmethod
+    def search_tag(term):
+        return 'search:' + ' '.join(tokenize(term))
+
+    def sync(self, loads):
+        """ Drops every entry of the memory backend when loads, the load
+            count of the question pool, moved since the last call. The
+            shared backend gets every invalidation already.
+        """
+        if self.backend.name != 'memory':
+            return
+        with self._lock:
+            if loads == self._loads:
+                return
+            first = self._loads is None
+            self._loads = loads
+        if not first:
+            self.clear()
+
+    def get(self, key):
+        body = self.backend.get(key)
+        with self._lock:
+            if body is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return body
+
+    def generation(self):
+        return self.backend.generation()
+
+    def set(self, key, body, tags=(), generation=None):
+        self.backend.set(key, body, self.ttl, tags, generation)
+
+    def _affected(self, rows):
+        tags = set(['questions'])
+        texts = []
+        for row in rows:
+            if row['category'] is not None:
+                tags.add('category:{0}'.format(row['category']))
+            texts.append('{0} {1}'.format(
+                row.get('question') or '', row.get('answer') or ''
+            ).lower())
+        for tag in self.backend.tags('search:*'):
+            words = tag[len('search:'):].split()
+            if not words or any(
+                word[:SEARCH_MATCH_LENGTH] in text
+                for word in words for text in texts
+            ):
+                tags.add(tag)
+        return tags
+
+    def questions_changed(self, rows):
+        """ Drops the entries affected by inserted or deleted question rows,
+            dicts with category, question and answer.
+        """
+        count = self.backend.invalidate(self._affected(rows))
+        with self._lock:
+            self.invalidations += count
+        return count
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                'backend': self.backend.name,
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+            }
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+        stats.update(self.backend.stats())
+        return stats
+
+
+def create_response_cache(name=None, url=None, ttl=60, max_mb=64):
+    """ Response cache of the RESPONSE_CACHE setting: 'memory' (default),
+        'shared' with RESPONSE_CACHE_URL (redis://... or local://) or
+        'off' (None).
+    """
+    name = (name or 'memory').lower()
+    if name == 'off':
+        return None
+    if name == 'memory':
+        backend = MemoryCacheBackend(int(max_mb * 1024 * 1024))
+    elif name == 'shared':
+        if url is None or url.startswith('local:'):
+            backend = SharedCacheBackend(LocalStore())
+        elif redis is None:
+            raise RuntimeError('RESPONSE_CACHE = shared needs redis: '
+                               'pip install redis')
+        else:
+            backend = SharedCacheBackend(redis.Redis.from_url(url))
+    else:
+        raise ValueError('Unknown response cache: {0}'.format(name))
+    return ResponseCache(backend, ttl)
@@ -0,0 +1,36 @@
+from werkzeug.exceptions import HTTPException
+
+# Added to every response, by the Flask app and the ASGI entry point
+CORS_HEADERS = [
+    ('Access-Control-Allow-Headers', 'Content-Type,Authorization,true'),
+    ('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS'),
+    ('Access-Control-Allow-Origin', '*'),
+]
+
+ERROR_MESSAGES = {
+    400: 'Malformed request',
+    404: 'Resource not found',
+    405: 'Method not allowed',
+    409: 'Duplicate question',
+    421: 'Quiz session of another server process',
+    422: 'Unprocessable Entity',
+    429: 'Too many requests',
+    500: 'Internal server error',
+}
+
+
+class MisdirectedRequest(HTTPException):
+    """ 421: the quiz session lives in another server process. Werkzeug
+        has no exception for this code, so abort() can't raise it.
+    """
+    code = 421
+    description = ERROR_MESSAGES[421]
+
+
+def error_body(code):
+    """ Body of the JSON error responses. """
+    return {
+        'success': False,
+        'error': code,
+        'message': ERROR_MESSAGES[code]
+    }
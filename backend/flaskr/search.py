@@ -0,0 +1,341 @@
+import heapq
+import re
+import threading
+import time
+import weakref
+from bisect import bisect_left, insort
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session, object_session
+
+from models import db, primary_reads, Question
+
+# Weight of a word found in the question text and in the answer. They match
+# the PostgreSQL defaults for the 'A' and 'B' tsvector weights.
+QUESTION_WEIGHT = 1.0
+ANSWER_WEIGHT = 0.4
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(value):
+    return WORD_RE.findall((value or '').lower())
+
+
+# Session.info key of the question writes of the current transaction, as
+# ('write', row dict) or ('delete', id)
+CHANGES_KEY = 'search_changes'
+
+# Every live search backend gets the question writes committed in this
+# process. A WeakSet, so backends go away with their app.
+_backends = weakref.WeakSet()
+
+
+def questions_written(session, rows):
+    """ Records inserted or updated question rows (dicts with id, question
+        and answer) in session. Search backends apply them when it
+        commits. The Question mapper events call it; set-based writes must
+        call it themselves.
+    """
+    changes = session.info.setdefault(CHANGES_KEY, [])
+    changes.extend(('write', row) for row in rows)
+
+
+def questions_deleted(session, ids):
+    """ Records the ids of deleted questions in session. """
+    changes = session.info.setdefault(CHANGES_KEY, [])
+    changes.extend(('delete', question_id) for question_id in ids)
+
+
+def _question_written(mapper, connection, target):
+    questions_written(object_session(target), [{
+        'id': target.id,
+        'question': target.question,
+        'answer': target.answer,
+    }])
+
+
+def _question_deleted(mapper, connection, target):
+    questions_deleted(object_session(target), [target.id])
+
+
+def _after_commit(session):
+    changes = session.info.pop(CHANGES_KEY, None)
+    if changes is None:
+        return
+    for backend in list(_backends):
+        backend.apply(changes)
+
+
+def _after_rollback(session):
+    session.info.pop(CHANGES_KEY, None)
+
+
+event.listen(Question, 'after_insert', _question_written)
+event.listen(Question, 'after_update', _question_written)
+event.listen(Question, 'after_delete', _question_deleted)
+event.listen(Session, 'after_commit', _after_commit)
+event.listen(Session, 'after_rollback', _after_rollback)
+
+
+class SearchBackend(object):
+    """ Search backend.
+    description: Base class of the question search backends. search()
+        returns a page of (Question, score) pairs, best match first, and
+        the total number of matches. score is None when the backend does
+        not rank results.
+    """
+    name = None
+
+    def __init__(self):
+        _backends.add(self)
+
+    def search(self, term, offset, limit):
+        raise NotImplementedError
+
+    def refresh(self):
+        """ Catches up with questions written without the ORM, ie: bulk
+            imports.
+        """
+        pass
+
+    def warm_up(self):
+        """ Does the work of the first search ahead of time. """
+        pass
+
+    def apply(self, changes):
+        """ Called with the question writes of one committed transaction,
+            see questions_written() and questions_deleted().
+        """
+        pass
+
+
+class IlikeSearch(SearchBackend):
+    """ Case insensitive substring match on the question text. Scans the
+        whole table; kept as a fallback and as the benchmark baseline.
+    """
+    name = 'ilike'
+
+    def search(self, term, offset, limit):
+        query = Question.query.filter(
+            Question.question.ilike("%{0}%".format(term))
+        )
+        total = query.count()
+        rows = query.order_by(Question.id).offset(offset).limit(limit).all()
+        return [(row, None) for row in rows], total
+
+
+class PostgresSearch(SearchBackend):
+    """ PostgreSQL full-text search.
+    description: Matches every word of the term as a prefix against a
+        weighted tsvector of the question (A) and answer (B), stored in
+        questions.search_vector with a GIN index, and ranks with ts_rank.
+        The 'simple' configuration is used so that short words and stop
+        words such as 'to' still match, like the old substring search did.
+
+        The column, its index and the trigger that writes it on every
+        insert and update are created by migrations/005_search_vector.sql
+        (`flask migrate`), so searching never changes the schema.
+    """
+    name = 'postgres'
+    config = 'simple'
+
+    def to_tsquery(self, term):
+        words = tokenize(term)
+        if not words:
+            return None
+        return ' & '.join(word + ':*' for word in words)
+
+    def search(self, term, offset, limit):
+        tsquery = self.to_tsquery(term)
+        if tsquery is None:
+            return [], 0
+        query = func.to_tsquery(self.config, tsquery)
+        vector = Question.search_vector
+        rank = func.ts_rank(vector, query)
+        rows = db.session.query(
+            Question, rank.label('rank'), func.count().over().label('total')
+        ).filter(
+            vector.op('@@')(query)
+        ).order_by(
+            rank.desc(), Question.id
+        ).offset(offset).limit(limit).all()
+        total = rows[0].total if rows else 0
+        return [(row.Question, row.rank) for row in rows], total
+
+
+class InvertedIndexSearch(SearchBackend):
+    """ In-process full-text search.
+    description: Inverted index used when the database is not PostgreSQL
+        (sqlite, tests). Every word maps to {question id: weight}, and a
+        sorted list of the words is searched with bisect to expand each
+        term word as a prefix, mirroring PostgresSearch. The score of a
+        question is the sum of the weights of the words it matched.
+
+        The index is built on first use, kept up to date by Question
+        inserts, updates and deletes when they commit, and rebuilt after
+        max_age seconds to pick up writes from other processes. refresh()
+        only marks it stale: searches keep using the current index until
+        load() swaps in the new one.
+    """
+    name = 'memory'
+
+    def __init__(self, max_age=300):
+        super(InvertedIndexSearch, self).__init__()
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._postings = None
+        self._words = []
+        self._docs = {}
+        self._loaded_at = 0
+        self._stale = False
+
+    def load(self):
+        with primary_reads():
+            rows = db.session.query(
+                Question.id, Question.question, Question.answer
+            ).all()
+        with self._lock:
+            self._postings = {}
+            self._words = []
+            self._docs = {}
+            for question_id, question, answer in rows:
+                self._add(question_id, question, answer)
+            self._words.sort()
+            self._loaded_at = time.monotonic()
+            self._stale = False
+
+    def _ensure_loaded(self):
+        expired = time.monotonic() - self._loaded_at > self.max_age
+        if self._postings is None or self._stale or expired:
+            self.load()
+
+    def refresh(self):
+        with self._lock:
+            self._stale = True
+
+    def warm_up(self):
+        self._ensure_loaded()
+
+    def _add(self, question_id, question, answer, keep_sorted=False):
+        weights = {}
+        for word in tokenize(question):
+            weights[word] = weights.get(word, 0) + QUESTION_WEIGHT
+        for word in tokenize(answer):
+            weights[word] = weights.get(word, 0) + ANSWER_WEIGHT
+        for word, weight in weights.items():
+            posting = self._postings.get(word)
+            if posting is None:
+                posting = self._postings[word] = {}
+                if keep_sorted:
+                    insort(self._words, word)
+                else:
+                    self._words.append(word)
+            posting[question_id] = weight
+        self._docs[question_id] = list(weights)
+
+    def _remove(self, question_id):
+        for word in self._docs.pop(question_id, ()):
+            posting = self._postings[word]
+            posting.pop(question_id, None)
+            if not posting:
+                del self._postings[word]
+                del self._words[bisect_left(self._words, word)]
+
+    def _prefix_matches(self, prefix):
+        """ Returns {question id: weight} of every word starting with
+            prefix.
+        """
+        matches = {}
+        position = bisect_left(self._words, prefix)
+        while position < len(self._words) \
+                and self._words[position].startswith(prefix):
+            for question_id, weight in \
+                    self._postings[self._words[position]].items():
+                matches[question_id] = matches.get(question_id, 0) + weight
+            position += 1
+        return matches
+
+    def rank(self, term, top=None):
+        """ Returns ([(question id, score)], total matches) for term, best
+            match first. With top, only the best top matches are returned.
+        """
+        self._ensure_loaded()
+        scores = None
+        with self._lock:
+            for word in tokenize(term):
+                matches = self._prefix_matches(word)
+                if scores is None:
+                    scores = matches
+                else:
+                    scores = {
+                        question_id: score + matches[question_id]
+                        for question_id, score in scores.items()
+                        if question_id in matches
+                    }
+                if not scores:
+                    break
+        if not scores:
+            return [], 0
+
+        def order(item):
+            return (-item[1], item[0])
+
+        if top is None:
+            return sorted(scores.items(), key=order), len(scores)
+        return heapq.nsmallest(top, scores.items(), key=order), len(scores)
+
+    def search(self, term, offset, limit):
+        ranked, total = self.rank(term, top=offset + limit)
+        page = ranked[offset:offset + limit]
+        if not page:
+            return [], total
+        rows = Question.query.filter(
+            Question.id.in_([question_id for question_id, _ in page])
+        ).all()
+        by_id = {row.id: row for row in rows}
+        return [
+            (by_id[question_id], score) for question_id, score in page
+            if question_id in by_id
+        ], total
+
+    def apply(self, changes):
+        with self._lock:
+            if self._postings is None:
+                return
+            for action, value in changes:
+                if action == 'write':
+                    self._remove(value['id'])
+                    self._add(
+                        value['id'], value['question'], value['answer'],
+                        keep_sorted=True
+                    )
+                else:
+                    self._remove(value)
+
+
+BACKENDS = {
+    IlikeSearch.name: IlikeSearch,
+    PostgresSearch.name: PostgresSearch,
+    InvertedIndexSearch.name: InvertedIndexSearch,
+}
+
+
+def create_search_backend(name=None, dialect=None):
+    """ Search backend factory.
+    description: Returns the backend called name ('postgres', 'memory' or
+        'ilike'). Without a name, PostgreSQL databases get PostgresSearch
+        and every other database the in-process InvertedIndexSearch.
+        dialect is the database dialect name, read from db.engine (which
+        creates the engine) when not given.
+    """
+    if not name:
+        if dialect is None:
+            dialect = db.engine.dialect.name
+        if dialect == 'postgresql':
+            name = PostgresSearch.name
+        else:
+            name = InvertedIndexSearch.name
+    if name not in BACKENDS:
+        raise ValueError("Unknown search backend: {0}".format(name))
+    return BACKENDS[name]()
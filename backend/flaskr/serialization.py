@@ -0,0 +1,42 @@
+import json
+
+from flask import current_app
+
+from models import Question
+
+try:
+    import orjson
+except ImportError:  # the stdlib encoder is used instead
+    orjson = None
+
+# Question fields of the API, in the order of Question.format()
+QUESTION_FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+QUESTION_COLUMNS = tuple(getattr(Question, field) for field in QUESTION_FIELDS)
+
+ENCODER = 'orjson' if orjson is not None else 'json'
+
+
+def dumps(data):
+    """ Compact JSON bytes of data, with orjson when it is installed.
+        Dict keys that are not strings (ie: category ids) become strings,
+        like the stdlib does. Non-ASCII text is written as UTF-8.
+    """
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(
+        data, separators=(',', ':'), ensure_ascii=False
+    ).encode('utf-8')
+
+
+def json_response(data):
+    """ Response with the JSON of data. Unlike jsonify(), it is never
+        indented, whatever the debug mode, and keys keep their order.
+    """
+    return current_app.response_class(dumps(data), mimetype='application/json')
+
+
+def format_rows(rows):
+    """ Question dicts of rows selected with QUESTION_COLUMNS, without
+        loading ORM objects.
+    """
+    return [dict(zip(QUESTION_FIELDS, row)) for row in rows]
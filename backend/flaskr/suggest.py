@@ -0,0 +1,306 @@
+import heapq
+import logging
+import sys
+import threading
+import time
+from bisect import bisect_left, insort
+from itertools import groupby
+
+from models import db, Question
+from .search import tokenize
+
+logger = logging.getLogger(__name__)
+
+# Sorts after every character, so prefix + LAST is past every word
+# starting with prefix
+LAST = chr(sys.maxunicode)
+
+
+class SuggestIndex(object):
+    """ Autocomplete index.
+    description: Completes the last word typed in the search box with the
+        words of the question texts, most common first (the number of
+        questions using a word). The words are kept in a sorted list,
+        searched with bisect, with their counts in a dict.
+
+        Prefixes matching more than scan_limit words (the short ones) keep
+        their depth best words, computed when the index loads and updated
+        as counts change, so no lookup ranks more than scan_limit words.
+        Only words of min_length to max_length characters are kept, and at
+        most max_terms of them: the most common ones when the index loads,
+        then new words are skipped once it is full.
+
+        The index loads on first use. Questions saved and deleted by the
+        routes are added and removed (questions_written() and
+        questions_deleted()) when they commit; to pick up the writes of
+        other processes it is rebuilt in a background thread after max_age
+        seconds, serving the old one meanwhile.
+    """
+
+    def __init__(self, max_terms=100000, max_age=300, scan_limit=256,
+                 depth=20, min_length=3, max_length=32):
+        self.max_terms = max_terms
+        self.max_age = max_age
+        self.scan_limit = scan_limit
+        self.depth = depth
+        self.min_length = min_length
+        self.max_length = max_length
+        self.app = None
+        self.skipped = 0
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._terms = None
+        self._counts = {}
+        # prefix: best words, as sorted (-count, word)
+        self._top = {}
+        self._loaded_at = 0
+        self._reloading = False
+
+    def init_app(self, app):
+        self.app = app
+
+    def words(self, text):
+        """ Distinct words of text the index keeps. """
+        return set(
+            word for word in tokenize(text)
+            if self.min_length <= len(word) <= self.max_length
+        )
+
+    def _count(self, batch_size=10000):
+        """ Counts the questions using each word, reading the question
+            texts batch_size rows at a time. Past 2 * max_terms words only
+            the max_terms most common are kept, so counting takes bounded
+            memory; the counts of rare words dropped and seen again later
+            start over, which only matters for words about as rare as the
+            least common ones kept.
+        """
+        counts = {}
+        table = Question.__table__
+        last_id = 0
+        while True:
+            rows = db.session.execute(
+                db.select([table.c.id, table.c.question])
+                .where(table.c.id > last_id)
+                .order_by(table.c.id).limit(batch_size)
+            ).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            for _, question in rows:
+                for word in self.words(question):
+                    counts[word] = counts.get(word, 0) + 1
+            if len(counts) > 2 * self.max_terms:
+                counts = self._most_common(counts)
+        return self._most_common(counts)
+
+    def _most_common(self, counts):
+        if len(counts) <= self.max_terms:
+            return counts
+        return dict(heapq.nsmallest(
+            self.max_terms, counts.items(),
+            key=lambda item: (-item[1], item[0])
+        ))
+
+    def _best(self, terms, counts, lo, hi):
+        return heapq.nsmallest(
+            self.depth, ((-counts[word], word) for word in terms[lo:hi])
+        )
+
+    def _wide_prefixes(self, terms, counts):
+        """ Returns {prefix: best words} of every prefix matching more than
+            scan_limit words.
+        """
+        top = {}
+        # Ranges of terms sharing a prefix of length - 1 characters
+        ranges = [(0, len(terms))]
+        length = 1
+        while ranges:
+            wider = []
+            for lo, hi in ranges:
+                position = lo
+                for prefix, group in groupby(
+                    terms[lo:hi], key=lambda word: word[:length]
+                ):
+                    size = sum(1 for _ in group)
+                    if size > self.scan_limit and len(prefix) == length:
+                        top[prefix] = self._best(
+                            terms, counts, position, position + size
+                        )
+                        wider.append((position, position + size))
+                    position += size
+            ranges = wider
+            length += 1
+        return top
+
+    def load(self):
+        """ Rebuilds the index from the questions table. """
+        counts = self._count()
+        terms = sorted(counts)
+        top = self._wide_prefixes(terms, counts)
+        with self._lock:
+            self._counts = counts
+            self._terms = terms
+            self._top = top
+            self._loaded_at = time.monotonic()
+
+    def _ensure_loaded(self):
+        if self._terms is None:
+            # One thread loads, the others wait for it
+            with self._load_lock:
+                if self._terms is None:
+                    self.load()
+        elif time.monotonic() - self._loaded_at > self.max_age:
+            self._reload_in_background()
+
+    def _reload_in_background(self):
+        with self._lock:
+            if self._reloading or self.app is None:
+                return
+            self._reloading = True
+        thread = threading.Thread(target=self._reload, name='suggest-load')
+        thread.daemon = True
+        thread.start()
+
+    def _reload(self):
+        try:
+            with self.app.app_context():
+                try:
+                    self.load()
+                finally:
+                    db.session.remove()
+        except Exception:
+            logger.exception('Could not reload the suggestions')
+        finally:
+            with self._lock:
+                self._reloading = False
+                # Retry in max_age / 2 seconds, not on every request
+                self._loaded_at = max(
+                    self._loaded_at, time.monotonic() - self.max_age / 2
+                )
+
+    def refresh(self):
+        """ Drops the index, ie: after a bulk import. The next use loads
+            it again.
+        """
+        with self._lock:
+            self._terms = None
+            self._counts = {}
+            self._top = {}
+
+    def warm_up(self):
+        self._ensure_loaded()
+
+    def _set_count(self, word, count):
+        """ Changes the count of a word, adding or removing it, and fixes
+            the best words of the wide prefixes it is under.
+        """
+        old = self._counts.get(word, 0)
+        if old == count:
+            return
+        if old == 0:
+            if len(self._counts) >= self.max_terms:
+                self.skipped += 1
+                return
+            insort(self._terms, word)
+        if count > 0:
+            self._counts[word] = count
+        else:
+            del self._counts[word]
+            del self._terms[bisect_left(self._terms, word)]
+        for length in range(1, len(word) + 1):
+            best = self._top.get(word[:length])
+            if best is None:
+                continue
+            if old:
+                try:
+                    best.remove((-old, word))
+                except ValueError:
+                    pass
+                else:
+                    if count < old and len(best) == self.depth - 1:
+                        # A word that was not kept may now come before it
+                        prefix = word[:length]
+                        self._top[prefix] = self._best(
+                            self._terms, self._counts,
+                            bisect_left(self._terms, prefix),
+                            bisect_left(self._terms, prefix + LAST)
+                        )
+                        continue
+            if count > 0:
+                insort(best, (-count, word))
+                del best[self.depth:]
+
+    def _apply(self, texts, step):
+        if self._terms is None:
+            return
+        changes = {}
+        for text in texts:
+            for word in self.words(text):
+                changes[word] = changes.get(word, 0) + step
+        with self._lock:
+            for word, change in changes.items():
+                self._set_count(
+                    word, max(self._counts.get(word, 0) + change, 0)
+                )
+
+    def questions_written(self, rows):
+        """ Adds the words of committed new questions (dicts with a
+            question text).
+        """
+        self._apply([row['question'] for row in rows], 1)
+
+    def questions_deleted(self, rows):
+        """ Removes the words of committed deleted questions (rows with a
+            question text).
+        """
+        self._apply([row.question for row in rows], -1)
+
+    def suggest(self, prefix, limit=10):
+        """ Returns up to limit (at most depth) words starting with prefix,
+            most common first.
+        """
+        self._ensure_loaded()
+        prefix = prefix.lower()
+        limit = min(limit, self.depth)
+        with self._lock:
+            best = self._top.get(prefix)
+            if best is None:
+                terms = self._terms or []
+                lo = bisect_left(terms, prefix)
+                hi = bisect_left(terms, prefix + LAST, lo)
+                best = self._best(terms, self._counts, lo, hi)
+                if hi - lo > self.scan_limit:
+                    # Grew past scan_limit since the index loaded
+                    self._top[prefix] = best
+            return [word for _, word in best[:limit]]
+
+    def complete(self, text, limit=10):
+        """ Completes the last word of text. Returns the completed texts,
+            or nothing when text ends with a space or the last word is
+            shorter than 2 characters.
+        """
+        words = tokenize(text)
+        if not words or not text[-1:].isalnum() or len(words[-1]) < 2:
+            return []
+        head = text[:len(text) - len(words[-1])]
+        return [head + word for word in self.suggest(words[-1], limit)]
+
+    def memory_usage(self):
+        """ Approximate bytes held by the index. """
+        with self._lock:
+            terms = self._terms or []
+            size = sys.getsizeof(terms) + sys.getsizeof(self._counts)
+            size += sum(sys.getsizeof(word) for word in terms)
+            size += sys.getsizeof(self._top)
+            for prefix, best in self._top.items():
+                size += sys.getsizeof(prefix) + sys.getsizeof(best)
+                size += sum(sys.getsizeof(entry) for entry in best)
+            return size
+
+    def stats(self):
+        with self._lock:
+            return {
+                'terms': len(self._counts),
+                'wide_prefixes': len(self._top),
+                'skipped': self.skipped,
+            }
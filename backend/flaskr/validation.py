@@ -0,0 +1,138 @@
+from .question_pool import QuestionPool
+
+# Difficulty levels of the question form, and where adaptive quizzes start
+MIN_DIFFICULTY = 1
+MAX_DIFFICULTY = 5
+START_DIFFICULTY = 3
+# Longest player name and quiz of a recorded score
+MAX_PLAYER_LENGTH = 64
+MAX_QUIZ_QUESTIONS = 1000
+
+
+def quiz_category(body):
+    """ Quiz category.
+    description: Reads the quiz_category object of a quiz request. Raises
+        ValueError if it is missing or its id is not a number.
+        return:
+            int: category id, 0 (all categories) for ids below 1
+    """
+    if not isinstance(body, dict):
+        raise ValueError('Missing request body')
+    category = body.get('quiz_category', None)
+    if not isinstance(category, dict) or category.get('id') is None:
+        raise ValueError('Missing quiz_category')
+    try:
+        return max(int(category.get('id')), QuestionPool.ALL)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid quiz_category')
+
+
+def previous_questions(body):
+    """ Returns the previous_questions of a quiz request as a set of ids.
+        Raises ValueError if it is missing or not a list of numbers.
+    """
+    previous = body.get('previous_questions', None)
+    if previous is None:
+        raise ValueError('Missing previous_questions')
+    try:
+        return set(int(question_id) for question_id in previous)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid previous_questions')
+
+
+def adaptive_difficulty(body):
+    """ Adaptive quiz difficulty.
+    description: Reads the adaptive fields of a quiz request: adaptive
+        (true to enable it), difficulty (the level returned by the last
+        call, START_DIFFICULTY if missing) and last_answer_correct. A
+        correct answer moves one level up, a wrong one one level down,
+        within MIN_DIFFICULTY and MAX_DIFFICULTY. Raises ValueError if a
+        field has the wrong type.
+        return:
+            (target difficulty, direction of the move: 1, -1 or 0), or
+            (None, 0) if the quiz is not adaptive
+    """
+    adaptive = body.get('adaptive', False)
+    if not isinstance(adaptive, bool):
+        raise ValueError('Invalid adaptive')
+    if not adaptive:
+        return None, 0
+    difficulty = body.get('difficulty')
+    if difficulty is None:
+        difficulty = START_DIFFICULTY
+    elif isinstance(difficulty, bool) or not isinstance(difficulty, int):
+        raise ValueError('Invalid difficulty')
+    correct = body.get('last_answer_correct')
+    if correct is None:
+        direction = 0
+    elif isinstance(correct, bool):
+        direction = 1 if correct else -1
+    else:
+        raise ValueError('Invalid last_answer_correct')
+    target = min(max(difficulty + direction, MIN_DIFFICULTY), MAX_DIFFICULTY)
+    return target, direction
+
+
+def hide_answer(body):
+    """ Returns the hide_answer flag of a quiz request, False if missing.
+        Raises ValueError if it is not a boolean.
+    """
+    hide = body.get('hide_answer', False)
+    if not isinstance(hide, bool):
+        raise ValueError('Invalid hide_answer')
+    return hide
+
+
+def allow_duplicates(body):
+    """ Returns the allow_duplicates flag of a question request, False if
+        missing. Raises ValueError if it is not a boolean.
+    """
+    allow = body.get('allow_duplicates', False)
+    if not isinstance(allow, bool):
+        raise ValueError('Invalid allow_duplicates')
+    return allow
+
+
+def quiz_answer(body):
+    """ Quiz answer.
+    description: Reads a POST /quizzes/answer request. Raises ValueError
+        if question_id is not a number or answer is not a string.
+        return:
+            (int question id, str answer)
+    """
+    if not isinstance(body, dict):
+        raise ValueError('Missing request body')
+    question_id = body.get('question_id')
+    if isinstance(question_id, bool) or not isinstance(question_id, int):
+        raise ValueError('Invalid question_id')
+    answer = body.get('answer')
+    if not isinstance(answer, str):
+        raise ValueError('Invalid answer')
+    return question_id, answer
+
+
+def quiz_score(body):
+    """ Quiz score.
+    description: Reads a POST /scores request: player, a non-empty name of
+        up to MAX_PLAYER_LENGTH characters, quiz_category, and score and
+        total, the right answers and questions of the quiz, with
+        0 <= score <= total <= MAX_QUIZ_QUESTIONS. Raises ValueError if
+        one is missing or invalid.
+        return:
+            (player, category id, score, total)
+    """
+    category = quiz_category(body)
+    player = body.get('player')
+    if not isinstance(player, str) or not player.strip() \
+            or len(player.strip()) > MAX_PLAYER_LENGTH:
+        raise ValueError('Invalid player')
+    values = []
+    for field in ('score', 'total'):
+        value = body.get(field)
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise ValueError('Invalid {0}'.format(field))
+        values.append(value)
+    score, total = values
+    if not 0 <= score <= total <= MAX_QUIZ_QUESTIONS:
+        raise ValueError('Invalid score')
+    return player.strip(), category, score, total
@@ -0,0 +1,61 @@
+import logging
+import threading
+import time
+
+from models import db
+
+logger = logging.getLogger(__name__)
+
+
+def warm_up(app, dispose=False):
+    """ Warm-up.
+    description: Loads what the first requests would otherwise load: the
+        categories, the question index, the search backend, the
+        suggestions, the leaderboards and the quiz decks (with
+        QUIZ_DECKS), in an app context. A failure is
+        logged and skipped, since requests load whatever is missing on
+        their own. dispose closes the pooled connections afterwards, for a
+        process about to fork workers (connections can't be shared across
+        a fork).
+        return:
+            dict: seconds taken by each step, None for the failed ones
+    """
+    trivia = app.extensions['trivia']
+    steps = (
+        ('categories', trivia['category_cache'].categories),
+        ('question_pool', trivia['question_pool'].refresh),
+        ('search', trivia['search_backend'].warm_up),
+        ('suggest', trivia['suggest_index'].warm_up),
+        ('leaderboard', trivia['leaderboard'].refresh),
+    )
+    if trivia['quiz_decks'] is not None:
+        steps += (('quiz_decks', trivia['quiz_decks'].refresh),)
+    timings = {}
+    with app.app_context():
+        for name, load in steps:
+            start = time.perf_counter()
+            try:
+                load()
+                timings[name] = time.perf_counter() - start
+            except Exception:
+                logger.exception('Warm-up of %s failed', name)
+                db.session.rollback()
+                timings[name] = None
+        db.session.remove()
+        if dispose:
+            db.engine.dispose()
+    logger.info('Warm-up done: %s', timings)
+    return timings
+
+
+def start_warmup(app):
+    """ Runs warm_up(app) in a daemon thread and returns the thread.
+        Threads don't survive a fork: pre-fork servers call it in each
+        worker (ie: the gunicorn post_worker_init hook), or call
+        warm_up(app, dispose=True) before forking so the workers share the
+        loaded caches.
+    """
+    thread = threading.Thread(target=warm_up, args=(app,), name='warmup')
+    thread.daemon = True
+    thread.start()
+    return thread
@@ -0,0 +1,42 @@
+-- questions.category as an indexed integer foreign key to categories.id
+--
+-- Databases restored from trivia.psql already have an integer column with
+-- a foreign key but no index; databases created by db.create_all() before
+-- this migration have a varchar column and no constraint. Both end up
+-- with the same schema. Run it with `flask migrate`, or by hand with:
+--
+--     psql -1 trivia < migrations/001_question_category_fk.sql
+
+-- Backfill: numeric strings become integers, anything else NULL
+ALTER TABLE questions ALTER COLUMN category TYPE integer USING (
+    CASE WHEN trim(category::text) ~ '^[0-9]+$'
+        THEN trim(category::text)::integer
+    END
+);
+
+-- Questions pointing to categories that don't exist lose their category,
+-- as ON DELETE SET NULL would have done
+UPDATE questions SET category = NULL
+WHERE category IS NOT NULL
+    AND NOT EXISTS (
+        SELECT 1 FROM categories WHERE categories.id = questions.category
+    );
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint
+        WHERE conrelid = 'questions'::regclass AND contype = 'f'
+    ) THEN
+        ALTER TABLE questions ADD CONSTRAINT category
+            FOREIGN KEY (category) REFERENCES categories (id)
+            ON UPDATE CASCADE ON DELETE SET NULL;
+    END IF;
+END $$;
+
+-- Category listings (WHERE category = ? ORDER BY id, keyset pages with
+-- id > ?) and category quiz queries read this index in id order
+CREATE INDEX IF NOT EXISTS ix_questions_category_id
+    ON questions (category, id);
+
+ANALYZE questions;
@@ -0,0 +1,33 @@
+-- question_stats.version: bumped once by every transaction that writes to
+-- the questions table, so app processes can tell when the in-memory
+-- question index (flaskr/question_pool.py) missed writes made by another
+-- process and has to be rebuilt.
+--
+--     psql -1 trivia < migrations/002_question_stats.sql
+
+CREATE TABLE IF NOT EXISTS question_stats (
+    id integer PRIMARY KEY CHECK (id = 1),
+    version bigint NOT NULL DEFAULT 0,
+    -- transaction that last bumped version
+    txid bigint
+);
+
+INSERT INTO question_stats (id) VALUES (1) ON CONFLICT DO NOTHING;
+
+-- Statement level, so bulk writes cost one UPDATE. The row stays locked
+-- until the writing transaction ends, which serializes question writes.
+CREATE OR REPLACE FUNCTION bump_question_stats() RETURNS trigger AS $$
+BEGIN
+    UPDATE question_stats SET
+        version = version
+            + CASE WHEN txid = txid_current() THEN 0 ELSE 1 END,
+        txid = txid_current()
+    WHERE id = 1;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS questions_version ON questions;
+CREATE TRIGGER questions_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON questions
+    FOR EACH STATEMENT EXECUTE PROCEDURE bump_question_stats();
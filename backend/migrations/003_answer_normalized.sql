@@ -0,0 +1,11 @@
+-- questions.answer_normalized: the answer as compared by
+-- POST /quizzes/answer (case-folded, without accents, punctuation or
+-- articles), computed by the app when a question is written.
+--
+-- Rows written before this migration are filled in by `flask migrate`
+-- right after it is applied (flaskr.answers.normalize_missing_answers);
+-- until then their answer is normalized when it is checked.
+--
+--     psql -1 trivia < migrations/003_answer_normalized.sql
+
+ALTER TABLE questions ADD COLUMN IF NOT EXISTS answer_normalized text;
@@ -0,0 +1,23 @@
+-- questions.question_hash and question_signatures: the hash of the
+-- normalized question text and the LSH buckets of its MinHash signature,
+-- so new questions are checked for duplicates with index lookups
+-- (flaskr/duplicates.py), computed by the app when a question is written.
+--
+-- Rows written before this migration are signed by `flask migrate` right
+-- after it is applied (flaskr.duplicates.sign_missing_questions); until
+-- then they are not found by the duplicate checks.
+--
+--     psql -1 trivia < migrations/004_question_signatures.sql
+
+ALTER TABLE questions ADD COLUMN IF NOT EXISTS question_hash bigint;
+CREATE INDEX IF NOT EXISTS ix_questions_question_hash
+    ON questions (question_hash);
+
+CREATE TABLE IF NOT EXISTS question_signatures (
+    bucket bigint NOT NULL,
+    question_id integer NOT NULL
+        REFERENCES questions (id) ON DELETE CASCADE,
+    PRIMARY KEY (bucket, question_id)
+);
+CREATE INDEX IF NOT EXISTS ix_question_signatures_question_id
+    ON question_signatures (question_id);
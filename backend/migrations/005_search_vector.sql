@@ -0,0 +1,34 @@
+-- questions.search_vector: weighted tsvector of the question (A) and the
+-- answer (B) searched by flaskr.search.PostgresSearch, with a GIN index.
+-- A trigger keeps it up to date on every insert and update of the question
+-- or the answer, whatever writes them (the app, COPY imports, psql). The
+-- 'simple' configuration must match PostgresSearch.config.
+--
+-- The backfill rewrites every row: on a large table, apply it when writes
+-- are low.
+--
+--     psql -1 trivia < migrations/005_search_vector.sql
+
+ALTER TABLE questions ADD COLUMN IF NOT EXISTS search_vector tsvector;
+
+CREATE OR REPLACE FUNCTION questions_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('simple', coalesce(NEW.question, '')), 'A')
+        || setweight(to_tsvector('simple', coalesce(NEW.answer, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS questions_search_vector ON questions;
+CREATE TRIGGER questions_search_vector
+    BEFORE INSERT OR UPDATE OF question, answer ON questions
+    FOR EACH ROW EXECUTE PROCEDURE questions_search_vector();
+
+UPDATE questions SET search_vector =
+    setweight(to_tsvector('simple', coalesce(question, '')), 'A')
+    || setweight(to_tsvector('simple', coalesce(answer, '')), 'B')
+WHERE search_vector IS NULL;
+
+CREATE INDEX IF NOT EXISTS ix_questions_search_vector
+    ON questions USING GIN (search_vector);
@@ -0,0 +1,47 @@
+-- question_version: a sequence advanced once by every transaction that
+-- writes to the questions table, so app processes can tell when the
+-- in-memory question index (flaskr/question_pool.py) missed writes made by
+-- another process and has to be rebuilt. Replaces question_stats
+-- (002_question_stats.sql), whose single row stayed locked by each writing
+-- transaction until it ended, which serialized every question write.
+--
+-- nextval() takes no lock that lasts until commit. The row triggers are
+-- deferred, so the sequence moves when the writing transaction commits
+-- rather than when it starts writing. A transaction-local setting makes it
+-- move once per transaction. A transaction that rolls back still moves it,
+-- which only costs the other processes one rebuild of their index.
+--
+--     psql -1 trivia < migrations/006_question_version.sql
+
+DROP TRIGGER IF EXISTS questions_version ON questions;
+DROP FUNCTION IF EXISTS bump_question_stats();
+DROP TABLE IF EXISTS question_stats;
+
+CREATE SEQUENCE IF NOT EXISTS question_version MINVALUE 0 START 0;
+-- From now on last_value is the number of writing transactions
+SELECT nextval('question_version') WHERE NOT EXISTS (
+    SELECT 1 FROM question_version WHERE is_called
+);
+
+CREATE OR REPLACE FUNCTION bump_question_version() RETURNS trigger AS $$
+BEGIN
+    IF coalesce(current_setting('trivia.question_version_bumped', true), '')
+            = '' THEN
+        PERFORM nextval('question_version');
+        PERFORM set_config('trivia.question_version_bumped', 'on', true);
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS questions_version ON questions;
+CREATE CONSTRAINT TRIGGER questions_version
+    AFTER INSERT OR UPDATE OR DELETE ON questions
+    DEFERRABLE INITIALLY DEFERRED
+    FOR EACH ROW EXECUTE PROCEDURE bump_question_version();
+
+-- Constraint triggers can't fire on TRUNCATE
+DROP TRIGGER IF EXISTS questions_version_truncate ON questions;
+CREATE TRIGGER questions_version_truncate
+    AFTER TRUNCATE ON questions
+    FOR EACH STATEMENT EXECUTE PROCEDURE bump_question_version();
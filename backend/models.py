@@ -1,20 +1,160 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import (
+    BigInteger, Column, String, Integer, DateTime, ForeignKey, Index, Text,
+    create_engine, event, func, orm
+)
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import NullPool
+from sqlalchemy.sql.dml import UpdateBase
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
 import json
+from contextlib import contextmanager
+
+# Session.info keys of the read replica routing (flaskr/replicas.py): the
+# engine the session reads from, and whether it wrote
+REPLICA_KEY = 'read_replica'
+WROTE_KEY = 'wrote'
+
+
+'''
+RoutingSession
+    db.session class. When a read replica engine is set in its info under
+    REPLICA_KEY, statements run on it instead of the primary, until the
+    session flushes or executes a write: after that, every statement of
+    the session goes to the primary, so it reads its own writes.
+'''
+
+
+class RoutingSession(SignallingSession):
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = self.info.get(REPLICA_KEY)
+        if replica is not None and not self.info.get(WROTE_KEY):
+            if not isinstance(clause, UpdateBase):
+                return replica
+            self.info[WROTE_KEY] = True
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+def _session_flushing(session, flush_context, instances):
+    session.info[WROTE_KEY] = True
+
+
+event.listen(RoutingSession, 'before_flush', _session_flushing)
 
-db = SQLAlchemy()
 
 '''
-setup_db(app)
-    binds a flask application and a SQLAlchemy service
+primary_reads(session=None)
+    context manager: statements of session (db.session by default) run on
+    the primary inside it, ie: to load a cache shared by every request,
+    or to check that a row missing on the replica was really deleted.
 '''
 
 
-def setup_db(app):
+@contextmanager
+def primary_reads(session=None):
+    info = (db.session if session is None else session).info
+    replica = info.pop(REPLICA_KEY, None)
+    try:
+        yield
+    finally:
+        if replica is not None:
+            info[REPLICA_KEY] = replica
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy()
+
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+
+
+'''
+get_setting(config, name, default=None)
+    value of name in config (ie: the test_config of create_app), else in
+    the environment, else default. Empty strings count as unset.
+'''
+
+
+def get_setting(config, name, default=None):
+    value = config.get(name)
+    if value is None:
+        value = os.getenv(name)
+    if value is None or value == '':
+        return default
+    return value
+
+
+'''
+engine_options(config, poolclass=None)
+    SQLAlchemy engine options from the DB_* settings:
+        DB_POOL_SIZE, DB_MAX_OVERFLOW: connections kept open and opened
+            on top of them under load, per process
+        DB_POOL_TIMEOUT: seconds to wait for a connection before failing
+        DB_POOL_RECYCLE: seconds after which a connection is replaced
+        DB_POOL_PRE_PING: test connections on checkout, so connections
+            closed by the server or a restart are replaced transparently
+        DB_STATEMENT_TIMEOUT: PostgreSQL statement_timeout, in ms
+        DB_PGBOUNCER: the database url points to PgBouncer in transaction
+            mode. PgBouncer does the pooling, so connections are closed on
+            checkin (NullPool), and no startup options are sent, since
+            PgBouncer refuses them: set statement_timeout on the role.
+    poolclass, if given, replaces the default QueuePool.
+    sqlite databases keep the Flask-SQLAlchemy defaults.
+'''
+
+
+def engine_options(config, poolclass=None):
+    uri = get_setting(config, 'SQLALCHEMY_DATABASE_URI')
+    if uri is None or make_url(uri).drivername.startswith('sqlite'):
+        return {}
+    url = make_url(uri)
+    if str(get_setting(config, 'DB_PGBOUNCER', '')).lower() in TRUE_VALUES:
+        return {'poolclass': NullPool}
+
+    options = {}
+    if poolclass is not None:
+        options['poolclass'] = poolclass
+    for name, option in (('DB_POOL_SIZE', 'pool_size'),
+                         ('DB_MAX_OVERFLOW', 'max_overflow'),
+                         ('DB_POOL_TIMEOUT', 'pool_timeout'),
+                         ('DB_POOL_RECYCLE', 'pool_recycle')):
+        value = get_setting(config, name)
+        if value is not None:
+            options[option] = int(value)
+    pre_ping = get_setting(config, 'DB_POOL_PRE_PING')
+    if pre_ping is not None:
+        options['pool_pre_ping'] = str(pre_ping).lower() in TRUE_VALUES
+    statement_timeout = get_setting(config, 'DB_STATEMENT_TIMEOUT')
+    if statement_timeout is not None \
+            and url.drivername.startswith('postgresql'):
+        options['connect_args'] = {
+            'options': '-c statement_timeout={0}'.format(
+                int(statement_timeout)
+            )
+        }
+    return options
+
+
+'''
+setup_db(app, poolclass=None)
+    binds a flask application and a SQLAlchemy service, with the engine
+    options of the DB_* settings of app.config or the environment.
+    Tables are not created here: run `flask migrate`.
+'''
+
+
+def setup_db(app, poolclass=None):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(
+        app.config, poolclass
+    )
     db.app = app
     db.init_app(app)
-    db.create_all()
 
 
 '''
@@ -25,12 +165,33 @@ Question
 
 class Question(db.Model):
     __tablename__ = 'questions'
+    # (category, id) serves category listings in id order and keyset pages
+    __table_args__ = (
+        Index('ix_questions_category_id', 'category', 'id'),
+    )
 
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
+    category = Column(
+        Integer,
+        ForeignKey(
+            'categories.id',
+            name='category',
+            onupdate='CASCADE',
+            ondelete='SET NULL'
+        )
+    )
     difficulty = Column(Integer)
+    # answer as compared by POST /quizzes/answer, see flaskr/answers.py
+    answer_normalized = Column(String)
+    # hash of the normalized question, see flaskr/duplicates.py
+    question_hash = Column(BigInteger, index=True)
+    # full-text search vector, written by a trigger on PostgreSQL (see
+    # migrations/005_search_vector.sql); deferred, listings never need it
+    search_vector = orm.deferred(
+        Column(TSVECTOR().with_variant(Text(), 'sqlite'))
+    )
 
     def __init__(self, question, answer, category, difficulty):
         self.question = question
@@ -59,6 +220,29 @@ class Question(db.Model):
         }
 
 
+'''
+QuestionSignature
+    LSH bucket of a question: questions sharing a bucket are candidate
+    near duplicates. Written by flaskr.duplicates with the question.
+'''
+
+
+class QuestionSignature(db.Model):
+    __tablename__ = 'question_signatures'
+    # Deleting or replacing the buckets of a question
+    __table_args__ = (
+        Index('ix_question_signatures_question_id', 'question_id'),
+    )
+
+    bucket = Column(BigInteger, primary_key=True, autoincrement=False)
+    question_id = Column(
+        Integer,
+        ForeignKey('questions.id', ondelete='CASCADE'),
+        primary_key=True,
+        autoincrement=False
+    )
+
+
 '''
 Category
 
@@ -79,3 +263,43 @@ class Category(db.Model):
             'id': self.id,
             'type': self.type
         }
+
+
+'''
+Score
+    result of one finished quiz. category is the quiz category, 0 for
+    quizzes over every category. Scores are written in batches by
+    flaskr.leaderboard.ScoreRecorder, not one by one.
+'''
+
+
+class Score(db.Model):
+    __tablename__ = 'scores'
+    # Best scores of a category, and of every quiz, read when a
+    # leaderboard is rebuilt
+    __table_args__ = (
+        Index('ix_scores_category_score', 'category', 'score'),
+        Index('ix_scores_score', 'score'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    player = Column(String(64), nullable=False)
+    category = Column(Integer, nullable=False, default=0)
+    score = Column(Integer, nullable=False)
+    total = Column(Integer, nullable=False)
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+
+    def __init__(self, player, category, score, total):
+        self.player = player
+        self.category = category
+        self.score = score
+        self.total = total
+
+    def format(self):
+        return {
+            'id': self.id,
+            'player': self.player,
+            'category': self.category,
+            'score': self.score,
+            'total': self.total
+        }
@@ -1,10 +1,52 @@
+import asyncio
 import os
+import tempfile
+import threading
+import time
 import unittest
 import json
-from flask_sqlalchemy import SQLAlchemy
+import random
+from collections import namedtuple
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import NullPool, Pool
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from flaskr.answers import (
+    answer_matches, normalize_answer, normalize_missing_answers, within_edits
+)
+from flaskr.asgi import create_asgi_app
+from models import (
+    setup_db, db, engine_options, primary_reads, Question, QuestionSignature,
+    Category, Score, REPLICA_KEY
+)
+from flaskr.bulk import import_questions
+from flaskr.category_cache import CategoryCache
+from flaskr.config import SETTINGS, load_settings
+from flaskr.duplicates import (
+    duplicate_clusters, find_duplicates, fingerprint, similarity,
+    sign_missing_questions
+)
+from flaskr.leaderboard import Board, ScoreRecorder
+from flaskr.metrics import Metrics, TimedQueuePool
+from flaskr.migrate import upgrade
+from flaskr.pagination import decode_cursor, encode_cursor
+from flaskr.question_pool import QuestionPool, read_version
+from flaskr.quiz_decks import QuizDecks
+from flaskr.quiz_sessions import QuizSessionStore
+from flaskr.rate_limit import (
+    MemoryRateLimitBackend, RateLimiter, SharedRateLimitBackend,
+    client_address, parse_limits
+)
+from flaskr.replicas import PIN_COOKIE, ReplicaRouter, parse_replica_urls
+from flaskr.responses import error_body
+from flaskr.response_cache import (
+    LocalStore, MemoryCacheBackend, SharedCacheBackend
+)
+from flaskr.search import InvertedIndexSearch, PostgresSearch
+from flaskr.suggest import SuggestIndex
+from flaskr import serialization
+from flaskr.warmup import warm_up
 
 
 class TriviaTestCase(unittest.TestCase):
@@ -34,12 +76,6 @@ class TriviaTestCase(unittest.TestCase):
             'quiz_category': {'id': 2},
             'previous_questions': [],
         }
-        # binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
 
     def tearDown(self):
         """Executed after reach test"""
@@ -63,6 +99,51 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['error'], 405)
         self.assertEqual(data['message'], 'Method not allowed')
 
+    def test_get_categories_not_modified(self):
+        res = self.client().get('/categories')
+        etag = res.headers['ETag']
+
+        res = self.client().get(
+            '/categories', headers={'If-None-Match': etag}
+        )
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+
+    def test_warm_requests_do_not_query_categories(self):
+        self.client().get('/categories')
+        statements = []
+
+        def count_statement(conn, cursor, statement, *args):
+            if 'categories' in statement:
+                statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+        try:
+            self.client().get('/categories')
+            self.client().get('/questions?page=1')
+            self.client().get('/categories/2/questions')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_statement)
+        self.assertEqual(statements, [])
+
+    def test_category_write_invalidates_cache(self):
+        res = self.client().get('/categories')
+        etag = res.headers['ETag']
+
+        category = Category(type='Cooking')
+        db.session.add(category)
+        db.session.commit()
+        try:
+            res = self.client().get(
+                '/categories', headers={'If-None-Match': etag}
+            )
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(data['categories'][str(category.id)], 'Cooking')
+        finally:
+            db.session.delete(category)
+            db.session.commit()
+
     def test_get_questions(self):
         res = self.client().get('/questions?page=1')
         data = json.loads(res.data)
@@ -74,6 +155,49 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['total_questions'] > 0)
         self.assertEqual(len(data['categories']), 6)
 
+    def test_numbered_pages_cover_every_question(self):
+        ids = []
+        page = 1
+        while True:
+            res = self.client().get('/questions?page={0}'.format(page))
+            if res.status_code == 404:
+                break
+            ids.extend(qt['id'] for qt in json.loads(res.data)['questions'])
+            page += 1
+        expected = [qt.id for qt in Question.query.order_by(Question.id)]
+        self.assertEqual(ids, expected)
+
+    def test_get_questions_by_cursor(self):
+        ids = []
+        cursor = '0'
+        while cursor is not None:
+            res = self.client().get(
+                '/questions?limit=4&after={0}'.format(cursor)
+            )
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            self.assertTrue(len(data['questions']) <= 4)
+            self.assertNotIn('current_page', data)
+            ids.extend(question['id'] for question in data['questions'])
+            cursor = data['next_cursor']
+
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertEqual(len(ids), Question.query.count())
+        self.assertEqual(data['total_questions'], len(ids))
+
+    def test_get_questions_invalid_cursor(self):
+        res = self.client().get('/questions?after=not-a-cursor')
+        self.assertEqual(res.status_code, 400)
+        res = self.client().get('/questions?after=0&question=title')
+        self.assertEqual(res.status_code, 400)
+
+    def test_get_questions_exact_count(self):
+        res = self.client().get('/questions?page=1&count=exact')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], Question.query.count())
+
     def test_page_out_of_bounds(self):
         res = self.client().get('/questions?page=100')
         data = json.loads(res.data)
@@ -132,6 +256,15 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['error'], 404)
         self.assertEqual(data['message'], 'Resource not found')
 
+    def test_search_answers_with_score(self):
+        res = self.client().get('/questions?question=scarab')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], 1)
+        self.assertEqual(data['questions'][0]['answer'], 'Scarab')
+        self.assertTrue(data['questions'][0]['score'] > 0)
+
     def test_create_new_question(self):
         res = self.client().post('/questions', json=self.new_question)
         data = json.loads(res.data)
@@ -166,6 +299,85 @@ class TriviaTestCase(unittest.TestCase):
         else:
             self.assertFalse("No last question id")
 
+    def record_statements(self, fn):
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement.split()[0].upper())
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            fn()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        return statements
+
+    def test_create_and_delete_question_statements(self):
+        self.client().get('/categories')
+        created = []
+        statements = self.record_statements(lambda: created.append(
+            json.loads(self.client().post(
+                '/questions', json=self.new_question
+            ).data)
+        ))
+        # The duplicate lookup, the question and its LSH buckets
+        self.assertEqual(statements, ['SELECT', 'INSERT', 'INSERT'])
+        self.assertEqual(created[0]['question']['id'], created[0]['created'])
+
+        statements = self.record_statements(
+            lambda: self.client().delete(
+                '/questions/{0}'.format(created[0]['created'])
+            )
+        )
+        self.assertEqual(statements, ['DELETE'])
+
+    def test_batch_create_and_delete_questions(self):
+        questions = [
+            {'question': 'Batch one?', 'answer': 'zyxwvbatch',
+             'category': 2, 'difficulty': 1},
+            {'question': 'Batch two?', 'answer': 'zyxwvbatch',
+             'category': 2, 'difficulty': 2},
+            {'question': 'Batch three?', 'answer': ''},
+        ]
+        res = self.client().post(
+            '/questions/batch', json={'questions': questions}
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['created']), 2)
+        self.assertEqual(data['errors'], [
+            {'index': 2, 'error': 'Missing answer'}
+        ])
+        created = data['created']
+        res = self.client().get('/questions?question=zyxwvbatch')
+        self.assertEqual(
+            sorted(q['id'] for q in json.loads(res.data)['questions']),
+            created
+        )
+
+        res = self.client().delete('/questions?ids={0},{1},99999'.format(
+            *created
+        ))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['deleted'], created)
+        self.assertEqual(data['not_found'], [99999])
+        self.assertEqual(
+            Question.query.filter(Question.id.in_(created)).count(), 0
+        )
+        res = self.client().get('/questions?question=zyxwvbatch')
+        self.assertEqual(res.status_code, 404)
+
+    def test_batch_requests_malformed(self):
+        res = self.client().delete('/questions?ids=1,two')
+        self.assertEqual(res.status_code, 400)
+        res = self.client().delete('/questions')
+        self.assertEqual(res.status_code, 400)
+        res = self.client().post('/questions/batch', json={'questions': 1})
+        self.assertEqual(res.status_code, 400)
+
     def test_delete_unexisting_question(self):
         # to be allow to succesfully delete a book on each test we need
         # to take the last question we created and delete it
@@ -175,6 +387,81 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 422)
         self.assertFalse(data['success'])
 
+    def delete_bulk_questions(self):
+        Question.query.filter(
+            Question.question.like('Bulk %')
+        ).delete(synchronize_session=False)
+        db.session.commit()
+
+    def test_import_questions_jsonl(self):
+        rows = [
+            {'question': 'Bulk one?', 'answer': '1', 'category': 1,
+             'difficulty': 1},
+            {'question': 'Bulk two?', 'answer': '2', 'category': '2',
+             'difficulty': None},
+            {'question': 'Bulk three?', 'answer': '', 'category': 1},
+            {'question': 'Bulk four?', 'answer': '4', 'category': 99},
+        ]
+        body = '\n'.join(json.dumps(row) for row in rows) + '\n{oops\n'
+        try:
+            res = self.client().post('/questions/import', data=body)
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(data['inserted'], 2)
+            self.assertEqual(data['failed'], 3)
+            self.assertEqual(
+                [error['line'] for error in data['errors']], [3, 4, 5]
+            )
+            res = self.client().get('/questions?question=bulk')
+            self.assertEqual(json.loads(res.data)['total_questions'], 2)
+        finally:
+            self.delete_bulk_questions()
+
+    def test_import_questions_csv(self):
+        body = (
+            'question,answer,category,difficulty\n'
+            'Bulk csv?,"yes, it is",3,2\n'
+            'Bulk bad difficulty?,no,3,9\n'
+        )
+        try:
+            res = self.client().post(
+                '/questions/import', data=body, content_type='text/csv'
+            )
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(data['inserted'], 1)
+            self.assertEqual(data['errors'], [
+                {'line': 3, 'error': 'Invalid difficulty: 9'}
+            ])
+            question = Question.query.filter(
+                Question.question == 'Bulk csv?'
+            ).one()
+            self.assertEqual(question.answer, 'yes, it is')
+            self.assertEqual(question.category, 3)
+        finally:
+            self.delete_bulk_questions()
+
+    def test_export_questions(self):
+        res = self.client().get('/questions/export')
+        lines = res.data.decode('utf-8').splitlines()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertEqual(len(lines), Question.query.count())
+        self.assertEqual(
+            sorted(json.loads(lines[0])),
+            ['answer', 'category', 'difficulty', 'id', 'question']
+        )
+
+        res = self.client().get('/questions/export?format=csv')
+        lines = res.data.decode('utf-8').splitlines()
+        self.assertEqual(lines[0], 'id,question,answer,category,difficulty')
+
+        res = self.client().get('/questions/export?format=xml')
+        self.assertEqual(res.status_code, 400)
+
     def test_get_category_questions(self):
         res = self.client().get('/categories/2/questions')
         data = json.loads(res.data)
@@ -186,6 +473,34 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(len(data['categories']), 6)
         self.assertEqual(data['current_category'], 2)
 
+    def test_get_category_questions_by_cursor(self):
+        total = Question.query.filter(Question.category == 2).count()
+        res = self.client().get('/categories/2/questions?after=0&limit=2')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['questions']), min(total, 2))
+        self.assertEqual(data['total_questions'], total)
+        self.assertEqual(data['next_cursor'] is None, total <= 2)
+
+    def test_stream_category_questions(self):
+        ids = [question.id for question in Question.query.filter(
+            Question.category == 2
+        ).order_by(Question.id).all()]
+        res = self.client().get('/categories/2/questions?stream=true')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual([q['id'] for q in data['questions']], ids)
+        self.assertEqual(data['total_questions'], len(ids))
+        self.assertEqual(len(data['categories']), 6)
+        self.assertEqual(data['current_category'], 2)
+
+    def test_stream_unexisting_category_questions(self):
+        res = self.client().get('/categories/99/questions?stream=true')
+        self.assertEqual(res.status_code, 404)
+
     def test_start_quiz(self):
         res = self.client().post('/quizzes', json=self.quiz)
         data = json.loads(res.data)
@@ -237,6 +552,59 @@ class TriviaTestCase(unittest.TestCase):
                 self.assertFalse('Loop ran more than 20 times')
                 break
 
+    def test_play_quiz_session(self):
+        res = self.client().post('/quizzes/sessions', json=self.quiz)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertTrue(data['total_questions'] > 0)
+        token = data['session']
+
+        seen = set()
+        for _ in range(data['total_questions']):
+            res = self.client().post('/quizzes/sessions/' + token)
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(data['question']['category'], 2)
+            self.assertNotIn(data['question']['id'], seen)
+            seen.add(data['question']['id'])
+
+        self.assertEqual(data['remaining'], 0)
+        res = self.client().post('/quizzes/sessions/' + token)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data, {'success': True, 'question': None})
+        # The session ended with its last question
+        res = self.client().post('/quizzes/sessions/' + token)
+        self.assertEqual(res.status_code, 404)
+
+    def test_end_quiz_session(self):
+        res = self.client().post('/quizzes/sessions', json=self.quiz)
+        token = json.loads(res.data)['session']
+
+        res = self.client().delete('/quizzes/sessions/' + token)
+        self.assertEqual(res.status_code, 200)
+        res = self.client().post('/quizzes/sessions/' + token)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 404)
+        self.assertFalse(data['success'])
+
+    def test_quiz_session_of_another_process(self):
+        other = create_app().extensions['trivia']['quiz_sessions']
+        token = other.start(1, [1]).token
+        for method in ('POST', 'DELETE'):
+            res = self.client().open('/quizzes/sessions/' + token,
+                                     method=method)
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 421)
+            self.assertEqual(data['message'],
+                             'Quiz session of another server process')
+
+    def test_malformed_quiz_session_request(self):
+        res = self.client().post('/quizzes/sessions', json={})
+        self.assertEqual(res.status_code, 400)
+
     def test_get_unexisting_category_questions(self):
         res = self.client().get('/categories/99/questions')
         data = json.loads(res.data)
@@ -259,6 +627,184 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 400)
         self.assertFalse(data['success'])
 
+    def test_adaptive_quiz(self):
+        self.quiz.update({
+            'adaptive': True, 'difficulty': 3, 'last_answer_correct': True
+        })
+        res = self.client().post('/quizzes', json=self.quiz)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['difficulty'], 4)
+        self.assertEqual(data['question']['difficulty'], 4)
+        self.assertEqual(data['question']['category'], 2)
+
+        # category 2 has no difficulty 5: the nearest level is used
+        self.quiz.update({'difficulty': 5})
+        data = json.loads(self.client().post('/quizzes', json=self.quiz).data)
+        self.assertEqual(data['difficulty'], 5)
+        self.assertEqual(data['question']['difficulty'], 4)
+
+        self.quiz.update({'difficulty': 1, 'last_answer_correct': False})
+        data = json.loads(self.client().post('/quizzes', json=self.quiz).data)
+        self.assertEqual(data['difficulty'], 1)
+        self.assertEqual(data['question']['difficulty'], 1)
+
+    def test_play_adaptive_quiz(self):
+        self.quiz['adaptive'] = True
+        difficulties = []
+        while True:
+            res = self.client().post('/quizzes', json=self.quiz)
+            data = json.loads(res.data)
+            if data['question'] is None:
+                break
+            difficulties.append(data['question']['difficulty'])
+            # always right: the level only goes up
+            self.quiz['previous_questions'].append(data['question']['id'])
+            self.quiz['difficulty'] = data['difficulty']
+            self.quiz['last_answer_correct'] = True
+            self.assertLess(len(difficulties), 5)
+        self.assertEqual(difficulties, [3, 4, 2, 1])
+
+    def test_malformed_adaptive_quiz_request(self):
+        for fields in ({'adaptive': 'yes'},
+                       {'adaptive': True, 'difficulty': '3'},
+                       {'adaptive': True, 'last_answer_correct': 1}):
+            quiz = dict(self.quiz, **fields)
+            res = self.client().post('/quizzes', json=quiz)
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 400)
+            self.assertFalse(data['success'])
+
+    def test_quiz_hide_answer(self):
+        self.quiz['hide_answer'] = True
+        res = self.client().post('/quizzes', json=self.quiz)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('answer', data['question'])
+        self.assertEqual(data['question']['category'], 2)
+
+        self.quiz['hide_answer'] = 'yes'
+        res = self.client().post('/quizzes', json=self.quiz)
+        self.assertEqual(res.status_code, 400)
+
+    def test_suggest(self):
+        res = self.client().get('/questions/suggest?prefix=Which%20pa')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual(data['prefix'], 'Which pa')
+        self.assertTrue(data['suggestions'])
+        for suggestion in data['suggestions']:
+            self.assertTrue(suggestion.startswith('Which pa'))
+
+        res = self.client().get('/questions/suggest?prefix=pa&limit=1')
+        self.assertEqual(len(json.loads(res.data)['suggestions']), 1)
+        res = self.client().get('/questions/suggest?prefix=which%20')
+        self.assertEqual(json.loads(res.data)['suggestions'], [])
+
+    def test_malformed_suggest_request(self):
+        res = self.client().get('/questions/suggest')
+        self.assertEqual(res.status_code, 400)
+        res = self.client().get('/questions/suggest?prefix=pa&limit=few')
+        self.assertEqual(res.status_code, 400)
+
+    def test_suggest_created_and_deleted_questions(self):
+        def suggestions():
+            res = self.client().get('/questions/suggest?prefix=zanzib')
+            return json.loads(res.data)['suggestions']
+
+        self.assertEqual(suggestions(), [])
+        res = self.client().post('/questions', json=dict(
+            self.new_question, question='Where is Zanzibar?'
+        ))
+        created = json.loads(res.data)['created']
+        self.assertEqual(suggestions(), ['zanzibar'])
+        self.client().delete('/questions/{0}'.format(created))
+        self.assertEqual(suggestions(), [])
+
+    def test_check_quiz_answer(self):
+        question = Question(
+            'Which palace did Louis XIV build?', 'The Palace of Versailles',
+            4, 2
+        )
+        question.insert()
+        try:
+            self.assertEqual(
+                question.answer_normalized, 'palace of versailles'
+            )
+            for guess, correct in (('palace of versailles', True),
+                                   ('PALACE OF VERSAILLES!', True),
+                                   ('a palace of versaille', True),
+                                   ('the louvre', False),
+                                   ('', False)):
+                res = self.client().post('/quizzes/answer', json={
+                    'question_id': question.id, 'answer': guess
+                })
+                data = json.loads(res.data)
+
+                self.assertEqual(res.status_code, 200)
+                self.assertTrue(data['success'])
+                self.assertEqual(data['correct'], correct, guess)
+                self.assertEqual(data['answer'], 'The Palace of Versailles')
+                self.assertEqual(data['question_id'], question.id)
+        finally:
+            question.delete()
+
+    def test_check_answer_of_created_question(self):
+        res = self.client().post('/questions', json=dict(
+            self.new_question, answer='Green.'
+        ))
+        created = json.loads(res.data)['created']
+        try:
+            self.assertNotIn(
+                'answer_normalized', json.loads(res.data)['question']
+            )
+            self.assertEqual(
+                Question.query.get(created).answer_normalized, 'green'
+            )
+            res = self.client().post('/quizzes/answer', json={
+                'question_id': created, 'answer': 'green'
+            })
+            self.assertTrue(json.loads(res.data)['correct'])
+        finally:
+            self.client().delete('/questions/{0}'.format(created))
+
+    def test_check_answer_of_unnormalized_question(self):
+        question_id, answer = db.session.query(
+            Question.id, Question.answer
+        ).order_by(Question.id).first()
+        db.session.execute(Question.__table__.update().where(
+            Question.id == question_id
+        ).values(answer_normalized=None))
+        db.session.commit()
+        res = self.client().post('/quizzes/answer', json={
+            'question_id': question_id, 'answer': answer
+        })
+        self.assertTrue(json.loads(res.data)['correct'])
+        self.assertGreaterEqual(normalize_missing_answers(), 1)
+        self.assertEqual(db.session.query(Question.answer_normalized).filter(
+            Question.id == question_id
+        ).scalar(), normalize_answer(answer))
+
+    def test_malformed_quiz_answer_request(self):
+        for body in ({}, {'question_id': 'x', 'answer': 'green'},
+                     {'question_id': 1, 'answer': None}):
+            res = self.client().post('/quizzes/answer', json=body)
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 400)
+            self.assertFalse(data['success'])
+
+    def test_check_answer_of_unexisting_question(self):
+        res = self.client().post('/quizzes/answer', json={
+            'question_id': 999999, 'answer': 'green'
+        })
+        self.assertEqual(res.status_code, 404)
+
     def test_json_404_return(self):
         res = self.client().get('/non_existing_page')
         data = json.loads(res.data)
@@ -267,6 +813,2164 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
 
 
+class AnswerTestCase(unittest.TestCase):
+    """This class represents the answer check test case"""
+
+    def test_normalize_answer(self):
+        self.assertEqual(normalize_answer('  The Beatles! '), 'beatles')
+        self.assertEqual(normalize_answer('Peñarol'), 'penarol')
+        self.assertEqual(normalize_answer("An apple, a day"), 'apple day')
+        self.assertEqual(normalize_answer('STRASSE'), normalize_answer(
+            'straße'
+        ))
+        self.assertEqual(normalize_answer(None), '')
+
+    def test_within_edits(self):
+        self.assertTrue(within_edits('kitten', 'kitten', 0))
+        self.assertTrue(within_edits('kitten', 'sitten', 1))
+        self.assertFalse(within_edits('kitten', 'sitting', 2))
+        self.assertTrue(within_edits('kitten', 'sitting', 3))
+        self.assertFalse(within_edits('abc', 'abcdef', 2))
+        self.assertTrue(within_edits('', 'ab', 2))
+
+    def test_fuzzy_matches(self):
+        self.assertTrue(answer_matches('Mona Lisa', 'mona lisa'))
+        self.assertTrue(answer_matches('mona lsa', 'mona lisa'))
+        self.assertTrue(answer_matches('escher', 'escher'))
+        self.assertTrue(answer_matches('esher', 'escher'))
+        # short answers and numbers must be exact
+        self.assertFalse(answer_matches('ape', 'app'))
+        self.assertFalse(answer_matches('1991', '1990'))
+        self.assertFalse(answer_matches('the 1991 season', '1990 season'))
+        self.assertFalse(answer_matches('george', 'muhammad ali'))
+
+    def test_match_long_answer(self):
+        # The time a check takes is measured by benchmarks.answers
+        normalized = normalize_answer(
+            'The International Business Machines Corporation of New York'
+        )
+        self.assertTrue(answer_matches(
+            'international busines machine corporation of new york',
+            normalized
+        ))
+        self.assertFalse(answer_matches(
+            'international business machines corp. new york city',
+            normalized
+        ))
+        self.assertFalse(answer_matches(
+            'the united nations headquarters of new york', normalized
+        ))
+
+
+class QuestionPoolTestCase(unittest.TestCase):
+    """This class represents the quiz question pool test case"""
+
+    def setUp(self):
+        self.app = create_app()
+        self.pool = QuestionPool()
+        self.category_ids = [
+            question.id for question in Question.query.filter(
+                Question.category == 2
+            ).all()
+        ]
+
+    def test_pick_from_category(self):
+        self.assertIn(self.pool.pick(2), self.category_ids)
+        self.assertEqual(self.pool.count(2), len(self.category_ids))
+
+    def test_pick_skips_excluded_ids(self):
+        excluded = set(self.category_ids[:1])
+        for _ in range(50):
+            question_id = self.pool.pick(2, excluded)
+            self.assertIn(question_id, self.category_ids)
+            self.assertNotIn(question_id, excluded)
+
+    def test_pick_late_quiz(self):
+        excluded = set(self.category_ids[1:])
+        self.assertEqual(self.pool.pick(2, excluded), self.category_ids[0])
+
+    def test_pick_exhausted(self):
+        self.assertIsNone(self.pool.pick(2, self.category_ids))
+        self.assertIsNone(self.pool.pick(99))
+
+    def test_add_and_discard(self):
+        self.pool.load()
+        self.pool.add(999999, 2)
+        self.assertEqual(self.pool.count(2), len(self.category_ids) + 1)
+        self.assertEqual(
+            self.pool.pick(2, self.category_ids), 999999
+        )
+        self.pool.discard(999999)
+        self.assertIsNone(self.pool.pick(2, self.category_ids))
+
+    def test_difficulty_buckets(self):
+        questions = Question.query.filter(Question.category == 2).all()
+        for difficulty in set(qt.difficulty for qt in questions):
+            ids = sorted(
+                qt.id for qt in questions if qt.difficulty == difficulty
+            )
+            self.assertEqual(list(self.pool.ids(2, difficulty)), ids)
+            self.assertEqual(self.pool.count(2, difficulty), len(ids))
+            self.assertIn(self.pool.pick(2, (), difficulty), ids)
+        self.assertEqual(
+            sum(self.pool.difficulties().values()), Question.query.count()
+        )
+        self.assertEqual(self.pool.count(2, 99), 0)
+        self.assertIsNone(self.pool.pick(2, (), 99))
+
+    def test_invalidate_while_reading(self):
+        self.pool.load()
+        ensure_loaded = self.pool._ensure_loaded
+
+        def invalidated_after_loading():
+            # As if an import invalidated the pool right after this
+            # reader loaded it
+            ensure_loaded()
+            self.pool.invalidate()
+        self.pool._ensure_loaded = invalidated_after_loading
+        self.assertEqual(self.pool.count(2), len(self.category_ids))
+        self.assertIn(self.pool.pick(2), self.category_ids)
+        self.assertEqual(list(self.pool.ids(2)), self.category_ids)
+        self.assertEqual(self.pool.id_at(2, 0), self.category_ids[0])
+        self.assertTrue(self.pool.difficulties(2))
+        self.assertIn(2, self.pool.snapshot()[1])
+        del self.pool._ensure_loaded
+        loaded_at = self.pool._loaded_at
+        self.assertTrue(self.pool.stale)
+        self.pool.count()
+        self.assertGreater(self.pool._loaded_at, loaded_at)
+
+    def test_invalidate_from_another_thread(self):
+        self.pool.load()
+        errors = []
+
+        def invalidate():
+            for _ in range(200):
+                self.pool.invalidate()
+
+        def read():
+            with self.app.app_context():
+                try:
+                    for _ in range(200):
+                        self.assertEqual(self.pool.count(2),
+                                         len(self.category_ids))
+                        self.assertIn(self.pool.pick(2), self.category_ids)
+                except Exception as error:
+                    errors.append(error)
+        threads = [threading.Thread(target=invalidate),
+                   threading.Thread(target=read)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_id_at(self):
+        self.assertEqual(self.pool.id_at(2, 0), self.category_ids[0])
+        self.assertEqual(
+            self.pool.id_at(2, len(self.category_ids) - 1),
+            self.category_ids[-1]
+        )
+        self.assertIsNone(self.pool.id_at(2, len(self.category_ids)))
+        self.assertIsNone(self.pool.id_at(99, 0))
+
+    def test_model_writes_are_applied_on_commit(self):
+        self.pool.load()
+        loaded_at = self.pool._loaded_at
+        question = Question('Pool question?', 'yes', 2, 5)
+        question.insert()
+        try:
+            self.assertIn(question.id, self.pool.ids(2, 5))
+            self.assertEqual(self.pool.count(2), len(self.category_ids) + 1)
+            question.category = 3
+            question.update()
+            self.assertNotIn(question.id, self.pool.ids(2))
+            self.assertIn(question.id, self.pool.ids(3, 5))
+        finally:
+            question.delete()
+        self.assertNotIn(question.id, self.pool.ids())
+        self.assertNotIn(question.id, self.pool.ids(3, 5))
+        self.assertEqual(self.pool._loaded_at, loaded_at)
+
+    def test_rolled_back_writes_are_ignored(self):
+        self.pool.load()
+        db.session.add(Question('Rolled back?', 'yes', 2, 1))
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual(self.pool.count(2), len(self.category_ids))
+
+    def test_pick_nearest(self):
+        by_level = dict(
+            (qt.difficulty, qt.id) for qt in Question.query.filter(
+                Question.category == 2
+            ).all()
+        )
+        self.assertEqual(self.pool.pick_nearest(2, (), 4), by_level[4])
+        # 4 is used: 3 and 5 are as near, 5 is missing
+        self.assertEqual(
+            self.pool.pick_nearest(2, [by_level[4]], 4, 1), by_level[3]
+        )
+        # 2 is used: 1 and 3 are as near, direction breaks the tie
+        self.assertEqual(
+            self.pool.pick_nearest(2, [by_level[2]], 2, 1), by_level[3]
+        )
+        self.assertEqual(
+            self.pool.pick_nearest(2, [by_level[2]], 2, -1), by_level[1]
+        )
+        self.assertIsNone(self.pool.pick_nearest(2, self.category_ids, 2))
+        self.assertIsNone(self.pool.pick_nearest(99, (), 2))
+
+    def test_pick_nearest_without_difficulty(self):
+        self.pool.load()
+        self.pool.add(999999, 2)
+        self.assertEqual(
+            self.pool.pick_nearest(2, self.category_ids, 3), 999999
+        )
+
+    def add_synthetic_questions(self, per_level):
+        """ Adds per_level fake ids to category 2 for levels 1 to 5. """
+        self.pool.load()
+        question_id = 10000000
+        for level in range(1, 6):
+            for _ in range(per_level):
+                question_id += 1
+                self.pool.add(question_id, 2, level)
+
+    def test_pick_nearest_distribution(self):
+        self.add_synthetic_questions(200)
+        levels = dict(
+            (level, set(self.pool.ids(2, level))) for level in range(1, 6)
+        )
+        # while the target level has questions, every pick comes from it
+        seen = set()
+        for _ in range(len(levels[4])):
+            question_id = self.pool.pick_nearest(2, seen, 4, 1)
+            self.assertIn(question_id, levels[4])
+            seen.add(question_id)
+        # then the level in the direction of the last answer, then the
+        # other neighbour, then the next ones
+        order = []
+        for _ in range(sum(len(ids) for ids in levels.values()) - len(seen)):
+            question_id = self.pool.pick_nearest(2, seen, 4, 1)
+            seen.add(question_id)
+            level = next(
+                level for level, ids in levels.items() if question_id in ids
+            )
+            if not order or order[-1] != level:
+                order.append(level)
+        self.assertEqual(order, [5, 3, 2, 1])
+        # and picks are spread over the whole level
+        first_picks = set(
+            self.pool.pick_nearest(2, (), 1) for _ in range(500)
+        )
+        self.assertGreater(len(first_picks), len(levels[1]) // 2)
+
+    def test_pick_nearest_late_quiz(self):
+        # The time a pick takes is measured by benchmarks.quiz_selection
+        self.add_synthetic_questions(20000)
+        level = list(self.pool.ids(2, 3))
+        # all but the last 3 questions of the level already played
+        previous = set(level[:-3])
+        picks = set(
+            self.pool.pick_nearest(2, previous, 3, 1) for _ in range(200)
+        )
+        self.assertEqual(picks, set(level[-3:]))
+
+    def test_memory_usage(self):
+        self.assertEqual(self.pool.memory_usage(), 0)
+        self.pool.load()
+        # at least 4 arrays of 4 byte ids per question
+        self.assertGreater(
+            self.pool.memory_usage(), 16 * Question.query.count()
+        )
+
+
+class SuggestIndexTestCase(unittest.TestCase):
+    """This class represents the autocomplete index test case"""
+
+    def setUp(self):
+        self.app = create_app()
+        # Small limits, so short prefixes have their best words kept
+        self.index = SuggestIndex(scan_limit=3, depth=4)
+        self.counts = {}
+        for (question,) in db.session.query(Question.question):
+            self.count(question, 1)
+
+    def tearDown(self):
+        db.session.remove()
+
+    def count(self, text, step):
+        for word in self.index.words(text):
+            self.counts[word] = self.counts.get(word, 0) + step
+            if not self.counts[word]:
+                del self.counts[word]
+
+    def assert_matches_full_scan(self):
+        prefixes = set(
+            word[:length] for word in self.counts for length in (1, 2, 3)
+        )
+        for prefix in prefixes:
+            expected = sorted(
+                (word for word in self.counts if word.startswith(prefix)),
+                key=lambda word: (-self.counts[word], word)
+            )[:4]
+            self.assertEqual(self.index.suggest(prefix, 10), expected,
+                             prefix)
+
+    def test_suggest(self):
+        self.assertEqual(self.index.suggest('wh', 2), ['what', 'which'])
+        self.assertEqual(self.index.suggest('WH', 2), ['what', 'which'])
+        self.assertEqual(self.index.suggest('xyzzy'), [])
+        self.assertGreater(self.index.stats()['wide_prefixes'], 0)
+        self.assert_matches_full_scan()
+
+    def test_complete(self):
+        self.assertEqual(self.index.complete('Which wh', 2),
+                         ['Which what', 'Which which'])
+        self.assertEqual(self.index.complete('Which '), [])
+        self.assertEqual(self.index.complete('Which w'), [])
+        self.assertEqual(self.index.complete(''), [])
+
+    def test_writes(self):
+        Row = namedtuple('Row', 'id question')
+        self.index.warm_up()
+        written = [
+            {'question': 'Which walrus wanders where?'},
+            {'question': 'Which walrus whistles?'},
+            {'question': 'Whatever happened to the walrus?'},
+        ]
+        self.index.questions_written(written)
+        for row in written:
+            self.count(row['question'], 1)
+        self.assertEqual(self.index.suggest('wal', 1), ['walrus'])
+        self.assert_matches_full_scan()
+
+        deleted = [Row(1, row['question']) for row in written[:2]] + [
+            Row(question.id, question.question)
+            for question in Question.query.limit(5)
+        ]
+        self.index.questions_deleted(deleted)
+        for row in deleted:
+            self.count(row.question, -1)
+        self.assert_matches_full_scan()
+        self.index.questions_deleted(deleted[:2])
+        self.assertEqual(self.index.suggest('wand'), [])
+
+    def test_max_terms(self):
+        index = SuggestIndex(max_terms=5)
+        index.warm_up()
+        common = sorted(self.counts, key=lambda word: (-self.counts[word],
+                                                       word))
+        self.assertEqual(index.stats()['terms'], 5)
+        self.assertEqual(index.suggest('wh'), [
+            word for word in common[:5] if word.startswith('wh')
+        ])
+        index.questions_written([{'question': 'Zanzibar?'}])
+        self.assertEqual(index.suggest('zan'), [])
+        self.assertEqual(index.stats()['skipped'], 1)
+
+    def test_refresh(self):
+        self.index.warm_up()
+        self.index.refresh()
+        self.assertEqual(self.index.stats()['terms'], 0)
+        # Loads again on the next use
+        self.assertTrue(self.index.suggest('wh'))
+
+    def test_large_index(self):
+        # The time a lookup takes is measured by benchmarks.suggest
+        rng = random.Random(0)
+        words = set()
+        while len(words) < 50000:
+            words.add(''.join(
+                rng.choice('abcdefghijklmnopqrstuvwxyz')
+                for _ in range(rng.randint(4, 10))
+            ))
+        counts = {word: rng.randint(1, 1000) for word in words}
+        index = SuggestIndex()
+        index._count = lambda: counts
+        index.load()
+        prefixes = [a + b for a in 'abcdefghijklmnopqrstuvwxyz'
+                    for b in 'aeiou'] + ['a', 'e', 'q', 'xy']
+        for prefix in prefixes:
+            # Short prefixes come from the precomputed best words, the
+            # others from ranking the words found; both are the most common
+            expected = sorted(
+                (-count, word) for word, count in counts.items()
+                if word.startswith(prefix)
+            )[:10]
+            self.assertEqual(
+                index.suggest(prefix), [word for _, word in expected]
+            )
+
+
+class DuplicatesTestCase(unittest.TestCase):
+    """This class represents the duplicate questions test case"""
+
+    # Seeded question 11, and the same with a typo
+    WORLD_CUP = 'Which country won the first ever soccer World Cup in 1930?'
+    TYPO = 'Which country won the frist ever soccer World Cup in 1930?'
+
+    def setUp(self):
+        self.app = create_app()
+        self.client = self.app.test_client
+        self.created = []
+
+    def tearDown(self):
+        if self.created:
+            Question.query.filter(Question.id.in_(self.created)).delete(
+                synchronize_session=False
+            )
+            db.session.commit()
+        db.session.remove()
+
+    def create(self, question, **body):
+        res = self.client().post('/questions', json=dict(
+            body, question=question, answer='yes', category=6, difficulty=2
+        ))
+        data = json.loads(res.data)
+        if res.status_code == 200:
+            self.created.append(data['created'])
+        return res, data
+
+    def test_similarity(self):
+        world_cup = fingerprint(self.WORLD_CUP)
+        self.assertEqual(similarity(world_cup, fingerprint(
+            'which country won the first-ever soccer world cup in 1930'
+        )), 1.0)
+        self.assertGreaterEqual(
+            similarity(world_cup, fingerprint(self.TYPO)), 0.8
+        )
+        # Different numbers are different questions
+        self.assertEqual(similarity(world_cup, fingerprint(
+            'Which country won the first ever soccer World Cup in 1934?'
+        )), 0.0)
+        self.assertLess(similarity(world_cup, fingerprint(
+            'Which is the only team to play in every soccer World Cup?'
+        )), 0.5)
+
+    def test_create_duplicate_conflicts(self):
+        for question in (self.WORLD_CUP.upper(), self.TYPO):
+            res, data = self.create(question)
+
+            self.assertEqual(res.status_code, 409)
+            self.assertFalse(data['success'])
+            self.assertEqual(data['message'], 'Duplicate question')
+            self.assertEqual(data['duplicates'][0]['id'], 11)
+        self.assertEqual(data['duplicates'][0]['question'], self.WORLD_CUP)
+        self.assertLess(data['duplicates'][0]['similarity'], 1)
+
+        res, data = self.create(self.TYPO, allow_duplicates=True)
+        self.assertEqual(res.status_code, 200)
+        res, data = self.create(self.TYPO, allow_duplicates='yes')
+        self.assertEqual(res.status_code, 400)
+
+    def test_batch_duplicates(self):
+        questions = [
+            {'question': 'Which dedup fish swims backwards?', 'answer': 'a',
+             'category': 1, 'difficulty': 1},
+            {'question': self.TYPO, 'answer': 'b', 'category': 6,
+             'difficulty': 1},
+            {'question': 'Which dedup fish swims backward?', 'answer': 'c',
+             'category': 1, 'difficulty': 1},
+            {'question': 'Which dedup bird flies backwards?', 'answer': ''},
+        ]
+        res = self.client().post(
+            '/questions/batch', json={'questions': questions}
+        )
+        data = json.loads(res.data)
+        self.created += data['created']
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['created']), 1)
+        self.assertEqual(data['errors'], [
+            {'index': 1, 'error': 'Duplicate of question 11'},
+            {'index': 2, 'error': 'Duplicate of index 0'},
+            {'index': 3, 'error': 'Missing answer'},
+        ])
+
+        res = self.client().post('/questions/batch', json={
+            'questions': questions[1:3], 'allow_duplicates': True
+        })
+        data = json.loads(res.data)
+        self.created += data['created']
+        self.assertEqual(len(data['created']), 2)
+
+    def test_import_duplicates(self):
+        rows = [
+            {'question': 'Dedup import one?', 'answer': '1', 'category': 1},
+            {'question': 'DEDUP import one', 'answer': '1', 'category': 1},
+            {'question': self.WORLD_CUP, 'answer': 'x', 'category': 6},
+        ]
+        body = '\n'.join(json.dumps(row) for row in rows)
+        res = self.client().post('/questions/import', data=body)
+        data = json.loads(res.data)
+        self.created += [
+            question.id for question in Question.query.filter(
+                Question.question.like('Dedup %')
+            )
+        ]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['inserted'], 1)
+        self.assertEqual(data['errors'], [
+            {'line': 2, 'error': 'Duplicate of line 1'},
+            {'line': 3, 'error': 'Duplicate of question 11'},
+        ])
+
+    def test_import_signs_inserted_rows(self):
+        methods = ['executemany']
+        if db.engine.dialect.name == 'postgresql':
+            methods.append('copy')
+        for method in methods:
+            with self.subTest(method=method):
+                lines = [json.dumps({
+                    'question': 'Dedup {0} import {1}?'.format(method, i),
+                    'answer': str(i), 'category': 1
+                }) for i in range(3)]
+                report = import_questions(lines, 'jsonl', [1], batch_size=2,
+                                          method=method)
+                ids = [question.id for question in Question.query.filter(
+                    Question.question.like('Dedup {0} %'.format(method))
+                ).order_by(Question.id)]
+                self.created += ids
+
+                self.assertEqual(report['inserted'], 3)
+                self.assertEqual(len(ids), 3)
+                signed = set(
+                    row[0] for row in db.session.query(
+                        QuestionSignature.question_id
+                    ).filter(QuestionSignature.question_id.in_(ids))
+                )
+                self.assertEqual(signed, set(ids))
+
+    def test_sign_missing_questions(self):
+        res, data = self.create('Which dedup planet is unsigned?')
+        # As if it was written before the signatures existed
+        db.session.execute(QuestionSignature.__table__.delete().where(
+            QuestionSignature.question_id == data['created']
+        ))
+        db.session.execute(Question.__table__.update().where(
+            Question.id == data['created']
+        ).values(question_hash=None))
+        db.session.commit()
+        new = fingerprint('Which dedup planet is unsigned!')
+        self.assertEqual(find_duplicates([new]), [[]])
+
+        self.assertEqual(sign_missing_questions(), 1)
+        self.assertEqual(
+            [found[0] for found in find_duplicates([new])[0]],
+            [data['created']]
+        )
+        self.assertEqual(sign_missing_questions(), 0)
+
+    def test_duplicate_clusters(self):
+        ids = []
+        for question in ('Which dedup river is the longest one?',
+                         'Which dedup river is the longest?',
+                         'Which dedup river is the longest one',
+                         self.TYPO):
+            ids.append(self.create(question, allow_duplicates=True)[1][
+                'created'
+            ])
+        stats = {}
+        clusters = list(duplicate_clusters(stats=stats))
+
+        self.assertIn(sorted(ids[:3]), clusters)
+        self.assertIn([11, ids[3]], clusters)
+        self.assertEqual(stats['clusters'], len(clusters))
+        self.assertGreater(stats['compared'], 0)
+        self.assertEqual(stats['skipped_buckets'], 0)
+        clusters = list(duplicate_clusters(threshold=1.0))
+        self.assertIn([ids[0], ids[2]], clusters)
+        self.assertNotIn([11, ids[3]], clusters)
+
+
+class QuestionStatsTestCase(unittest.TestCase):
+    """This class represents the question index version test case"""
+
+    def setUp(self):
+        self.app = create_app()
+        if db.engine.dialect.name != 'postgresql':
+            self.skipTest('question_version needs PostgreSQL')
+        with open(os.path.join(
+                os.path.dirname(os.path.abspath(__file__)),
+                'migrations', '006_question_version.sql')) as sql_file:
+            with db.engine.begin() as connection:
+                connection.execute(sql_file.read())
+        self.pool = QuestionPool(check_interval=0)
+        self.pool.load()
+        self.created = []
+
+    def tearDown(self):
+        self.pool.invalidate()
+        if self.created:
+            db.engine.execute(
+                Question.__table__.delete().where(
+                    Question.id.in_(self.created)
+                )
+            )
+        db.session.remove()
+        with db.engine.begin() as connection:
+            connection.execute(
+                'DROP TRIGGER questions_version ON questions; '
+                'DROP TRIGGER questions_version_truncate ON questions; '
+                'DROP FUNCTION bump_question_version(); '
+                'DROP SEQUENCE question_version'
+            )
+
+    def test_writes_of_other_processes_rebuild_the_index(self):
+        total = self.pool.count()
+        # Not through the app: as if another process wrote it
+        result = db.engine.execute(Question.__table__.insert().values(
+            question='Elsewhere?', answer='yes', category=2, difficulty=1
+        ).returning(Question.id))
+        self.created.append(result.scalar())
+        self.assertEqual(self.pool.count(), total + 1)
+        self.assertIn(self.created[0], self.pool.ids(2, 1))
+
+    def test_own_writes_keep_the_index(self):
+        loaded_at = self.pool._loaded_at
+        question = Question('Here?', 'yes', 2, 1)
+        question.insert()
+        self.created.append(question.id)
+        self.app.test_client().delete('/questions?ids={0}'.format(
+            question.id
+        ))
+        self.assertEqual(self.pool.count(), Question.query.count())
+        self.assertEqual(self.pool._loaded_at, loaded_at)
+
+    def test_concurrent_writes_do_not_wait(self):
+        version = read_version(db.session)
+        db.session.remove()
+        table = Question.__table__
+        first = db.engine.connect()
+        second = db.engine.connect()
+        try:
+            transaction = first.begin()
+            for _ in range(2):
+                self.created.append(first.execute(table.insert().values(
+                    question='First?', answer='yes', category=2
+                ).returning(table.c.id)).scalar())
+            with second.begin():
+                second.execute("SET LOCAL lock_timeout = '1s'")
+                self.created.append(second.execute(table.insert().values(
+                    question='Second?', answer='yes', category=2
+                ).returning(table.c.id)).scalar())
+            transaction.commit()
+        finally:
+            first.close()
+            second.close()
+        # Once per transaction
+        self.assertEqual(read_version(db.session), version + 2)
+
+
+class QuizSessionStoreTestCase(unittest.TestCase):
+    """This class represents the quiz session store test case"""
+
+    def setUp(self):
+        self.now = 0
+        self.store = QuizSessionStore(
+            ttl=10, max_sessions=2, clock=lambda: self.now
+        )
+
+    def test_session_returns_every_id_once(self):
+        session = self.store.start(1, list(range(100)))
+        ids = [self.store.next(session.token)[1] for _ in range(100)]
+        self.assertEqual(sorted(ids), list(range(100)))
+        self.assertEqual(self.store.next(session.token), (session, None))
+        self.assertIsNone(self.store.get(session.token))
+
+    def test_expired_sessions_are_evicted(self):
+        session = self.store.start(1, [1, 2, 3])
+        self.now = 5
+        self.assertIs(self.store.get(session.token), session)
+        self.now = 14
+        self.assertIs(self.store.get(session.token), session)
+        self.now = 25
+        self.assertIsNone(self.store.get(session.token))
+        self.assertEqual(len(self.store), 0)
+
+    def test_shuffled_session_plays_in_order(self):
+        session = self.store.start(1, [3, 1, 2], shuffled=True)
+        ids = [self.store.next(session.token)[1] for _ in range(3)]
+        self.assertEqual(ids, [3, 1, 2])
+
+    def test_tokens_name_their_store(self):
+        session = self.store.start(1, [1])
+        self.assertTrue(self.store.owns(session.token))
+        self.assertTrue(self.store.owns(self.store.instance + '.gone'))
+        other = QuizSessionStore()
+        self.assertFalse(other.owns(session.token))
+        self.assertFalse(other.owns('garbage'))
+
+    def test_oldest_session_dropped_when_full(self):
+        first = self.store.start(1, [1])
+        second = self.store.start(1, [2])
+        third = self.store.start(1, [3])
+        self.assertIsNone(self.store.get(first.token))
+        self.assertIs(self.store.get(second.token), second)
+        self.assertIs(self.store.get(third.token), third)
+
+
+class QuizDecksTestCase(unittest.TestCase):
+    """This class represents the precomputed quiz decks test case"""
+
+    def setUp(self):
+        self.now = 0
+        self.app = create_app()
+        self.pool = QuestionPool()
+        self.decks = QuizDecks(self.pool, decks=3, rotate_interval=60,
+                               check_interval=0, clock=lambda: self.now)
+
+    def tearDown(self):
+        self.decks.close()
+        db.session.remove()
+
+    def test_decks_shuffle_pool_ids(self):
+        self.decks.build()
+        for category in (QuestionPool.ALL, 2):
+            ids = list(self.pool.ids(category))
+            decks = [self.decks.deal(category) for _ in range(4)]
+            for deck in decks:
+                self.assertEqual(sorted(deck), ids)
+            # Dealt in turn, as copies
+            self.assertEqual(decks[3], decks[0])
+            decks[0].pop()
+            self.assertEqual(len(self.decks.deal(category)), len(ids))
+        orders = set(tuple(self.decks.deal(QuestionPool.ALL))
+                     for _ in range(3))
+        self.assertEqual(len(orders), 3)
+        self.assertEqual(len(self.decks.deal(99)), 0)
+        self.assertGreater(self.decks.memory_usage(), 0)
+
+    def test_deal_waits_for_decks_matching_pool(self):
+        self.assertIsNone(self.decks.deal(2))
+        self.assertTrue(self.decks.refresh())
+        self.assertIsNotNone(self.decks.deal(2))
+        self.pool.add(999999, 2)
+        self.assertIsNone(self.decks.deal(2))
+        self.assertTrue(self.decks.refresh())
+        self.assertIn(999999, self.decks.deal(2))
+        self.assertFalse(self.decks.refresh())
+        self.pool.discard(999999)
+        self.decks.refresh()
+        self.assertNotIn(999999, self.decks.deal(2))
+        stats = self.decks.stats()
+        self.assertEqual((stats['dealt'], stats['missed']), (3, 2))
+        self.assertEqual(stats['builds'], 3)
+
+    def test_rotation(self):
+        self.decks.refresh()
+        self.now = 30
+        self.assertFalse(self.decks.refresh())
+        self.now = 61
+        self.assertTrue(self.decks.refresh())
+        self.assertEqual(self.decks.stats()['builds'], 2)
+
+    def test_background_build(self):
+        self.decks.check_interval = 0.05
+        self.decks.init_app(self.app)
+        # The first deal starts the thread
+        self.decks.deal(2)
+        deadline = time.monotonic() + 5
+        while self.decks.stale and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(sorted(self.decks.deal(2)), list(self.pool.ids(2)))
+
+    def test_quiz_session_route(self):
+        app = create_app({'QUIZ_DECKS': 2})
+        decks = app.extensions['trivia']['quiz_decks']
+        decks.refresh()
+        client = app.test_client()
+        res = client.post('/quizzes/sessions',
+                          json={'quiz_category': {'id': 2}})
+        data = json.loads(res.data)
+        token = data['session']
+        self.assertEqual(data['total_questions'], self.pool.count(2))
+        seen = set()
+        for _ in range(data['total_questions']):
+            res = client.post('/quizzes/sessions/' + token)
+            question = json.loads(res.data)['question']
+            self.assertEqual(question['category'], 2)
+            seen.add(question['id'])
+        self.assertEqual(seen, set(self.pool.ids(2)))
+        decks.close()
+        self.assertEqual(decks.stats()['dealt'], 1)
+        text = client.get('/metrics').data.decode('utf-8')
+        self.assertIn('trivia_quiz_decks_dealt_total 1', text)
+
+
+class CategoryCacheTestCase(unittest.TestCase):
+    """This class represents the category cache test case"""
+
+    def setUp(self):
+        self.app = create_app()
+        self.cache = CategoryCache()
+
+    def test_hits_and_misses(self):
+        categories = self.cache.categories()
+        self.assertEqual(len(categories), 6)
+        body, etag = self.cache.response()
+        self.assertEqual(json.loads(body)['count'], 6)
+        self.assertEqual(
+            self.cache.stats(), {'version': 1, 'hits': 1, 'misses': 1}
+        )
+
+    def test_invalidate(self):
+        body, etag = self.cache.response()
+        self.cache.invalidate()
+        self.assertEqual(self.cache.response(), (body, etag))
+        self.assertEqual(self.cache.version, 2)
+
+
+class CacheBackendTestCase(unittest.TestCase):
+    """This class represents the response cache backends test case"""
+
+    def setUp(self):
+        self.now = 0
+
+        def clock():
+            return self.now
+        self.backends = [
+            MemoryCacheBackend(max_bytes=10000, clock=clock),
+            SharedCacheBackend(LocalStore(clock=clock)),
+        ]
+
+    def test_ttl(self):
+        for backend in self.backends:
+            with self.subTest(backend=backend.name):
+                backend.set('a', b'body', 10)
+                self.now = 5
+                self.assertEqual(backend.get('a'), b'body')
+                self.now = 11
+                self.assertIsNone(backend.get('a'))
+                self.now = 0
+
+    def test_invalidate_tags(self):
+        for backend in self.backends:
+            with self.subTest(backend=backend.name):
+                backend.set('a', b'1', 60, ['questions', 'category:1'])
+                backend.set('b', b'2', 60, ['category:2'])
+                backend.set('c', b'3', 60, ['search:moon'])
+                self.assertEqual(backend.tags('search:*'), ['search:moon'])
+                self.assertEqual(backend.invalidate(['category:1']), 1)
+                self.assertIsNone(backend.get('a'))
+                self.assertEqual(backend.get('b'), b'2')
+                self.assertEqual(backend.get('c'), b'3')
+
+    def test_bodies_computed_before_an_invalidation_are_not_stored(self):
+        for backend in self.backends:
+            with self.subTest(backend=backend.name):
+                generation = backend.generation()
+                backend.invalidate(['category:1'])
+                backend.set('a', b'old', 60, ['category:1'], generation)
+                self.assertIsNone(backend.get('a'))
+                backend.set('a', b'new', 60, ['category:1'],
+                            backend.generation())
+                self.assertEqual(backend.get('a'), b'new')
+
+    def test_memory_cap_drops_least_recently_used(self):
+        backend = self.backends[0]
+        body = b'x' * 4000
+        backend.set('a', body, 60)
+        backend.set('b', body, 60)
+        backend.get('a')
+        backend.set('c', body, 60)
+        self.assertIsNone(backend.get('b'))
+        self.assertEqual(backend.get('a'), body)
+        self.assertLessEqual(backend.bytes, backend.max_bytes)
+        backend.set('huge', b'x' * 20000, 60)
+        self.assertIsNone(backend.get('huge'))
+        self.assertEqual(backend.stats()['entries'], 2)
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+    """This class represents the response cache test case"""
+
+    config = {}
+
+    def setUp(self):
+        self.app = create_app(self.config)
+        self.client = self.app.test_client
+        self.cache = self.app.extensions['trivia']['response_cache']
+        self.created = []
+
+    def tearDown(self):
+        for question_id in self.created:
+            self.client().delete('/questions/{0}'.format(question_id))
+
+    def create(self, question, category):
+        res = self.client().post('/questions', json={
+            'question': question, 'answer': 'cached',
+            'difficulty': 1, 'category': category,
+        })
+        self.created.append(json.loads(res.data)['created'])
+
+    def statements(self, path):
+        """ Returns the body of GET path and the statements it ran. """
+        statements = []
+
+        def count_statement(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+        try:
+            res = self.client().get(path)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_statement)
+        self.assertEqual(res.status_code, 200)
+        return json.loads(res.data), statements
+
+    def test_hit_runs_no_sql(self):
+        for path in ('/questions?page=2', '/categories/2/questions',
+                     '/questions?question=title'):
+            with self.subTest(path=path):
+                data, statements = self.statements(path)
+                cached, statements = self.statements(path)
+                self.assertEqual(cached, data)
+                self.assertEqual(statements, [])
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (3, 3))
+        self.assertEqual(stats['hit_ratio'], 0.5)
+
+    def test_write_invalidates_affected_entries(self):
+        paths = ['/questions?page=1', '/categories/1/questions',
+                 '/categories/2/questions', '/questions?question=title',
+                 '/questions?question=soccer']
+        for path in paths:
+            self.client().get(path)
+        self.create('Which title is cached?', 1)
+
+        hits = self.cache.hits
+        for path in paths:
+            self.client().get(path)
+        # category 2 and the soccer search were kept
+        self.assertEqual(self.cache.hits - hits, 2)
+        data = json.loads(self.client().get('/questions?question=title').data)
+        self.assertIn(self.created[0], [qt['id'] for qt in data['questions']])
+
+        self.client().delete('/questions/{0}'.format(self.created.pop()))
+        data = json.loads(self.client().get('/questions?question=title').data)
+        self.assertNotIn('cached', [qt['answer'] for qt in data['questions']])
+
+    def test_writes_of_other_processes(self):
+        if self.cache.backend.name != 'memory':
+            self.skipTest('the shared backend gets every invalidation')
+        path = '/categories/2/questions'
+        self.client().get(path)
+        # Not through the app: as if another process wrote it
+        result = db.engine.execute(Question.__table__.insert().values(
+            question='Elsewhere?', answer='cached', category=2, difficulty=1
+        ))
+        self.created.append(result.inserted_primary_key[0])
+        # What the pool does when it sees the question_version move
+        self.app.extensions['trivia']['question_pool'].load()
+        data = json.loads(self.client().get(path).data)
+        self.assertIn(self.created[0], [qt['id'] for qt in data['questions']])
+
+    def test_stats_in_metrics(self):
+        self.client().get('/questions')
+        self.client().get('/questions')
+        text = self.client().get('/metrics').data.decode('utf-8')
+        self.assertIn(
+            'trivia_response_cache_hits_total{{backend="{0}"}} 1'.format(
+                self.cache.backend.name), text
+        )
+        self.assertIn('trivia_response_cache_bytes', text)
+
+
+class SharedResponseCacheTestCase(ResponseCacheTestCase):
+    """The response cache tests with the shared backend stand-in"""
+
+    config = {'RESPONSE_CACHE': 'shared', 'RESPONSE_CACHE_URL': 'local://'}
+
+    def test_cache_off(self):
+        app = create_app({'RESPONSE_CACHE': 'off'})
+        self.assertIsNone(app.extensions['trivia']['response_cache'])
+        self.assertEqual(app.test_client().get('/questions').status_code, 200)
+
+
+class LeaderboardTestCase(unittest.TestCase):
+    """This class represents the scores and leaderboard test case"""
+
+    def setUp(self):
+        self.app = create_app({
+            'SCORE_FLUSH_SIZE': 3, 'SCORE_FLUSH_INTERVAL': 0,
+        })
+        self.client = self.app.test_client
+        trivia = self.app.extensions['trivia']
+        self.recorder = trivia['score_recorder']
+        self.leaderboard = trivia['leaderboard']
+        upgrade()
+
+    def tearDown(self):
+        db.session.rollback()
+        db.session.execute(Score.__table__.delete())
+        db.session.commit()
+
+    def record(self, player, category, score, total=10):
+        res = self.client().post('/scores', json={
+            'player': player, 'quiz_category': {'id': category},
+            'score': score, 'total': total,
+        })
+        self.assertEqual(res.status_code, 200)
+        return json.loads(res.data)['rank']
+
+    def get_leaderboard(self, query=''):
+        res = self.client().get('/leaderboard' + query)
+        self.assertEqual(res.status_code, 200)
+        return [
+            (row['player'], row['score'])
+            for row in json.loads(res.data)['leaderboard']
+        ]
+
+    def test_board_keeps_best_score_per_player(self):
+        board = Board()
+        self.assertEqual(board.offer(3, 'ana', 5, 10, 1.0), 1)
+        self.assertEqual(board.offer(3, 'bob', 7, 10, 2.0), 1)
+        self.assertIsNone(board.offer(3, 'ana', 4, 10, 3.0))
+        self.assertEqual(board.offer(3, 'ana', 8, 10, 4.0), 1)
+        # ties go to whoever got there first
+        self.assertEqual(board.offer(3, 'cid', 7, 10, 5.0), 3)
+        self.assertIsNone(board.offer(3, 'dan', 6, 10, 6.0))
+        self.assertEqual(board.offer(3, 'eve', 9, 10, 7.0), 1)
+        self.assertEqual(
+            [entry[2] for entry in board.entries], ['eve', 'ana', 'bob']
+        )
+        self.assertEqual(sorted(board.best), ['ana', 'bob', 'eve'])
+
+    def test_scores_are_ranked_before_they_are_written(self):
+        self.assertEqual(self.record('ana', 2, 5), 1)
+        self.assertEqual(self.record('bob', 2, 7), 1)
+        self.assertEqual(Score.query.count(), 0)
+        self.assertEqual(self.get_leaderboard('?category=2'),
+                         [('bob', 7), ('ana', 5)])
+        # the third score fills the buffer, which is written at once
+        self.assertEqual(self.record('cid', 3, 9), 1)
+        self.assertEqual(Score.query.count(), 3)
+        self.assertEqual(self.recorder.stats()['flushes'], 1)
+        self.assertEqual(self.get_leaderboard(),
+                         [('cid', 9), ('bob', 7), ('ana', 5)])
+        self.assertEqual(self.get_leaderboard('?category=3&limit=5'),
+                         [('cid', 9)])
+        self.assertEqual(self.get_leaderboard('?category=0'), [])
+
+    def test_leaderboard_loads_from_scores_table(self):
+        self.record('ana', 2, 5)
+        self.record('ana', 2, 8)
+        self.record('bob', 2, 6)
+        self.record('cid', 2, 1)
+        app = create_app({'LEADERBOARD_SIZE': 2})
+        with app.app_context():
+            leaderboard = app.extensions['trivia']['leaderboard']
+            self.assertEqual(
+                [(row['player'], row['score']) for row in leaderboard.top(2)],
+                [('ana', 8), ('bob', 6)]
+            )
+        # cid's score is still buffered here, and stays after a reload
+        self.leaderboard.invalidate()
+        self.assertEqual(self.get_leaderboard('?category=2'),
+                         [('ana', 8), ('bob', 6), ('cid', 1)])
+
+    def test_background_flush(self):
+        recorder = ScoreRecorder(flush_size=1000, flush_interval=0.05)
+        recorder.init_app(self.app)
+        recorder.record('ana', 1, 3, 5)
+        deadline = time.monotonic() + 5
+        while recorder.stats()['flushed'] == 0 \
+                and time.monotonic() < deadline:
+            time.sleep(0.01)
+        recorder.close()
+        self.assertEqual(recorder.stats()['flushed'], 1)
+        self.assertEqual(Score.query.filter(Score.player == 'ana').count(), 1)
+
+    def test_failed_flush_keeps_scores(self):
+        recorder = ScoreRecorder(flush_size=1000, flush_interval=0,
+                                 max_pending=2)
+        for player in ('ana', 'bob'):
+            recorder.record(player, 1, 3, 5)
+        recorder.record('x' * 100, 1, 3, 5)
+        self.assertEqual(recorder.flush(), 0)
+        stats = recorder.stats()
+        self.assertEqual((stats['pending'], stats['dropped']), (2, 1))
+        self.assertEqual([event[0] for event in recorder.pending()],
+                         ['bob', 'x' * 100])
+
+    def test_malformed_score_requests(self):
+        for body in ({'player': 'ana', 'score': 1, 'total': 2},
+                     {'player': '', 'quiz_category': {'id': 1},
+                      'score': 1, 'total': 2},
+                     {'player': 'ana', 'quiz_category': {'id': 1},
+                      'score': 3, 'total': 2},
+                     {'player': 'ana', 'quiz_category': {'id': 1},
+                      'score': '1', 'total': 2}):
+            res = self.client().post('/scores', json=body)
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 400)
+            self.assertFalse(data['success'])
+        res = self.client().get('/leaderboard?category=x')
+        self.assertEqual(res.status_code, 400)
+
+    def test_score_metrics(self):
+        self.record('ana', 2, 5)
+        text = self.client().get('/metrics').data.decode('utf-8')
+        self.assertIn('trivia_scores_recorded_total 1', text)
+        self.assertIn('trivia_scores_pending 1', text)
+
+
+class StartupTestCase(unittest.TestCase):
+    """This class represents the settings and warm-up test case"""
+
+    def setUp(self):
+        self.connections = []
+        event.listen(Pool, 'connect', self.connected)
+
+    def tearDown(self):
+        event.remove(Pool, 'connect', self.connected)
+
+    def connected(self, connection, record):
+        self.connections.append(connection)
+
+    def test_settings_defaults(self):
+        settings = load_settings({'QUESTIONS_PER_PAGE': None})
+        self.assertEqual(set(settings), set(SETTINGS))
+        self.assertEqual(settings['LEADERBOARD_SIZE'], 10)
+        self.assertEqual(settings['WARMUP'], 'off')
+        self.assertIsNone(load_settings({'SLOW_QUERY_MS': ''})[
+            'SLOW_QUERY_MS'
+        ])
+
+    def test_settings_convert(self):
+        settings = load_settings({
+            'QUESTIONS_PER_PAGE': '25', 'RESPONSE_CACHE_TTL': '2.5',
+            'WARMUP': 'Background',
+        })
+        self.assertEqual(settings['QUESTIONS_PER_PAGE'], 25)
+        self.assertEqual(settings['RESPONSE_CACHE_TTL'], 2.5)
+        self.assertEqual(settings['WARMUP'], 'background')
+
+    def test_invalid_settings(self):
+        for name, value in (('QUESTIONS_PER_PAGE', 'ten'),
+                            ('QUESTIONS_PER_PAGE', 0),
+                            ('SCORE_FLUSH_INTERVAL', -1),
+                            ('SEARCH_BACKEND', 'elastic'),
+                            ('WARMUP', 'eager'),
+                            ('RATE_LIMIT', 'redis'),
+                            ('RATE_LIMITS', 'quizzes=fast'),
+                            ('DB_REPLICA_URLS', 'sqlite://,replica'),
+                            ('DB_READ_YOUR_WRITES', -1)):
+            with self.assertRaises(ValueError) as raised:
+                create_app({name: value})
+            self.assertIn(name, str(raised.exception))
+
+    def test_create_app_does_not_connect(self):
+        app = create_app({'SEARCH_BACKEND': ''})
+        self.assertEqual(self.connections, [])
+        self.assertIsInstance(
+            app.extensions['trivia']['search_backend'], PostgresSearch
+        )
+        self.assertEqual(app.extensions['trivia']['questions_per_page'], 10)
+
+    def test_warm_up(self):
+        app = create_app()
+        trivia = app.extensions['trivia']
+        timings = warm_up(app)
+        self.assertEqual(
+            set(timings),
+            set(['categories', 'question_pool', 'search', 'suggest',
+                 'leaderboard'])
+        )
+        self.assertTrue(all(value is not None for value in timings.values()))
+        self.assertFalse(trivia['category_cache'].stale)
+        self.assertFalse(trivia['question_pool'].stale)
+        self.assertFalse(trivia['leaderboard'].stale)
+        # The first request has nothing left to load
+        statements = []
+
+        def executed(connection, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(Engine, 'before_cursor_execute', executed)
+        try:
+            res = app.test_client().get('/categories')
+        finally:
+            event.remove(Engine, 'before_cursor_execute', executed)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(statements, [])
+
+    def test_warm_up_skips_failures(self):
+        app = create_app()
+        trivia = app.extensions['trivia']
+
+        def fail():
+            raise RuntimeError('search is down')
+        trivia['search_backend'].warm_up = fail
+        timings = warm_up(app)
+        self.assertIsNone(timings['search'])
+        self.assertIsNotNone(timings['leaderboard'])
+        self.assertFalse(trivia['leaderboard'].stale)
+
+
+class MetricsTestCase(unittest.TestCase):
+    """This class represents the request metrics test case"""
+
+    def setUp(self):
+        self.app = create_app()
+        self.client = self.app.test_client
+
+    def get_metric(self, text, name):
+        for line in text.splitlines():
+            if line.startswith(name + ' '):
+                return float(line.split()[-1])
+        return None
+
+    def test_metrics_by_route(self):
+        self.client().get('/questions')
+        self.client().get('/questions')
+        self.client().post('/quizzes', json={
+            'quiz_category': {'id': 0}, 'previous_questions': []
+        })
+        self.client().get('/nothing-here')
+        res = self.client().get('/metrics')
+        text = res.data.decode('utf-8')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.content_type.startswith('text/plain'))
+        self.assertEqual(self.get_metric(
+            text,
+            'trivia_request_duration_seconds_count{endpoint="get_questions"}'
+        ), 2)
+        self.assertEqual(self.get_metric(
+            text,
+            'trivia_request_duration_seconds_bucket'
+            '{endpoint="get_questions",le="+Inf"}'
+        ), 2)
+        self.assertGreater(self.get_metric(
+            text, 'trivia_db_statements_total{endpoint="play_quiz"}'
+        ), 0)
+        self.assertGreater(self.get_metric(
+            text, 'trivia_db_duration_seconds_total{endpoint="get_questions"}'
+        ), 0)
+        self.assertEqual(self.get_metric(
+            text, 'trivia_requests_total{endpoint="unmatched",status="404"}'
+        ), 1)
+
+    def test_slow_query_log(self):
+        os.environ['SLOW_QUERY_MS'] = '0'
+        try:
+            app = create_app()
+        finally:
+            del os.environ['SLOW_QUERY_MS']
+        with self.assertLogs('flaskr.metrics', 'WARNING') as logs:
+            app.test_client().get('/questions')
+        self.assertIn('in get_questions: SELECT', logs.output[0])
+        text = app.test_client().get('/metrics').data.decode('utf-8')
+        self.assertGreater(
+            self.get_metric(text, 'trivia_slow_queries_total'), 0
+        )
+
+    def test_many_requests(self):
+        # The time these hooks take is measured by benchmarks.metrics
+        metrics = Metrics()
+        response = self.app.response_class('')
+        requests = 1000
+        with self.app.test_request_context('/questions'):
+            for _ in range(requests):
+                metrics.request_started()
+                for _ in range(5):
+                    metrics.statement_executed('SELECT 1', 0.0001)
+                metrics.response_ready(response)
+                metrics.request_finished()
+        route = metrics.route('get_questions')
+        self.assertEqual(route.count, requests)
+        self.assertEqual(route.statements, requests * 5)
+        self.assertAlmostEqual(route.db_seconds, requests * 5 * 0.0001)
+        self.assertEqual(sum(route.buckets), requests)
+
+
+class RateLimitTestCase(unittest.TestCase):
+    """This class represents the rate limiter test case"""
+
+    def setUp(self):
+        self.now = 0.0
+        self.quiz = {'quiz_category': {'id': 0}, 'previous_questions': []}
+
+    def tearDown(self):
+        db.session.remove()
+
+    def clock(self):
+        return self.now
+
+    def test_parse_limits(self):
+        self.assertEqual(
+            parse_limits(' quizzes=20/10, search@10.0.0.5=5/1.5,'),
+            {('quizzes', None): (20, 10.0),
+             ('search', '10.0.0.5'): (5, 1.5)}
+        )
+        self.assertEqual(parse_limits(''), {})
+        for text in ('quizzes', 'quizzes=20', 'quizzes=x/10',
+                     'quizzes=0/10', 'quizzes=5/0', '=5/10'):
+            with self.assertRaises(ValueError):
+                parse_limits(text)
+
+    def test_memory_bucket(self):
+        backend = MemoryRateLimitBackend(max_keys=2, clock=self.clock)
+        self.assertEqual([backend.take('a', 2, 10) for _ in range(2)],
+                         [0, 0])
+        # One token every 5 seconds
+        self.assertAlmostEqual(backend.take('a', 2, 10), 5)
+        self.assertEqual(backend.take('b', 2, 10), 0)
+        self.now = 5
+        self.assertEqual(backend.take('a', 2, 10), 0)
+        self.assertGreater(backend.take('a', 2, 10), 0)
+        # The least recently used key is dropped
+        backend.take('c', 2, 10)
+        self.assertEqual(len(backend), 2)
+        self.assertEqual(backend.take('b', 2, 10), 0)
+        self.assertEqual(backend.take('b', 2, 10), 0)
+
+    def test_shared_backend_between_processes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'buckets')
+            first = SharedRateLimitBackend(path, slots=16, clock=self.clock)
+            second = SharedRateLimitBackend(path, slots=16, clock=self.clock)
+            try:
+                self.assertEqual(first.take('a', 2, 10), 0)
+                self.assertEqual(second.take('a', 2, 10), 0)
+                self.assertAlmostEqual(first.take('a', 2, 10), 5)
+                self.now = 5
+                self.assertEqual(second.take('a', 2, 10), 0)
+                # More keys than slots: the oldest slots are reused
+                for key in range(40):
+                    first.take(str(key), 2, 10)
+                second.clear()
+                self.assertEqual(first.take('a', 1, 10), 0)
+            finally:
+                first.close()
+                second.close()
+
+    def test_client_quota(self):
+        limiter = RateLimiter(
+            MemoryRateLimitBackend(clock=self.clock),
+            parse_limits('quizzes=1/10,quizzes@10.0.0.5=3/10')
+        )
+        for client, allowed in (('10.0.0.4', 1), ('10.0.0.5', 3)):
+            waits = [limiter.check('play_quiz', {}, client)
+                     for _ in range(4)]
+            self.assertEqual(waits[:allowed], [None] * allowed)
+            self.assertTrue(all(waits[allowed:]))
+        self.assertIsNone(limiter.check('get_questions', {}, '10.0.0.4'))
+        self.assertEqual(limiter.stats()['limited'], {'quizzes': 4})
+        self.assertEqual(limiter.retry_after(0.2), '1')
+        self.assertEqual(limiter.retry_after(2.5), '3')
+
+    def test_client_address(self):
+        self.assertEqual(client_address('10.0.0.1', '1.2.3.4'), '10.0.0.1')
+        self.assertEqual(
+            client_address('10.0.0.1', '6.6.6.6, 1.2.3.4', 1), '1.2.3.4'
+        )
+        self.assertEqual(
+            client_address('10.0.0.1', '6.6.6.6, 1.2.3.4, 10.0.0.2', 2),
+            '1.2.3.4'
+        )
+        self.assertEqual(client_address('10.0.0.1', '1.2.3.4', 2),
+                         '10.0.0.1')
+
+    def test_limited_routes(self):
+        app = create_app({
+            'RATE_LIMIT': 'memory',
+            'RATE_LIMITS': 'quizzes=2/60,search=1/60',
+            'RATE_LIMIT_PROXIES': 1,
+        })
+        client = app.test_client()
+        statuses = [client.post('/quizzes', json=self.quiz).status_code
+                    for _ in range(2)]
+        res = client.post('/quizzes', json=self.quiz)
+        data = json.loads(res.data)
+
+        self.assertEqual(statuses, [200, 200])
+        self.assertEqual(res.status_code, 429)
+        self.assertEqual(res.headers['Retry-After'], '30')
+        self.assertEqual(res.headers['Access-Control-Allow-Origin'], '*')
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'Too many requests')
+        # Another client behind the proxy has its own bucket
+        res = client.post('/quizzes', json=self.quiz,
+                          headers={'X-Forwarded-For': '10.0.0.9'})
+        self.assertEqual(res.status_code, 200)
+        # Listing questions is not limited, searching is
+        for _ in range(3):
+            self.assertEqual(client.get('/questions').status_code, 200)
+        self.assertEqual(
+            client.get('/questions?question=title').status_code, 200
+        )
+        self.assertEqual(
+            client.get('/questions?question=title').status_code, 429
+        )
+        self.assertEqual(client.options('/quizzes').status_code, 200)
+        # Starting a quiz session takes a quizzes token too
+        self.assertEqual(
+            client.post('/quizzes/sessions', json=self.quiz).status_code,
+            429
+        )
+
+        text = client.get('/metrics').data.decode('utf-8')
+        self.assertIn('trivia_rate_limited_total{limit="quizzes"} 2', text)
+        self.assertIn('trivia_rate_limited_total{limit="search"} 1', text)
+        self.assertIn('trivia_rate_limit_keys 3', text)
+
+    def test_off_by_default(self):
+        app = create_app()
+        self.assertIsNone(app.extensions['trivia']['rate_limiter'])
+        client = app.test_client()
+        for _ in range(25):
+            self.assertEqual(
+                client.post('/quizzes', json=self.quiz).status_code, 200
+            )
+
+
+class EngineOptionsTestCase(unittest.TestCase):
+    """This class represents the database engine settings test case"""
+
+    def setUp(self):
+        self.config = {
+            'SQLALCHEMY_DATABASE_URI': os.getenv('SQLALCHEMY_DATABASE_URI')
+        }
+
+    def tearDown(self):
+        # bind the models back to a default app
+        create_app()
+
+    def test_pool_settings(self):
+        self.config.update({
+            'DB_POOL_SIZE': '3',
+            'DB_MAX_OVERFLOW': 0,
+            'DB_POOL_PRE_PING': 'true',
+            'DB_POOL_RECYCLE': '600',
+            'DB_STATEMENT_TIMEOUT': '1500',
+        })
+        options = engine_options(self.config, TimedQueuePool)
+        self.assertEqual(options['poolclass'], TimedQueuePool)
+        self.assertEqual(options['pool_size'], 3)
+        self.assertEqual(options['max_overflow'], 0)
+        self.assertEqual(options['pool_pre_ping'], True)
+        self.assertEqual(options['pool_recycle'], 600)
+        self.assertEqual(
+            options['connect_args'], {'options': '-c statement_timeout=1500'}
+        )
+        self.assertNotIn('pool_timeout', options)
+
+    def test_pgbouncer_mode(self):
+        self.config.update({
+            'DB_PGBOUNCER': '1',
+            'DB_POOL_SIZE': '3',
+            'DB_STATEMENT_TIMEOUT': '1500',
+        })
+        self.assertEqual(
+            engine_options(self.config, TimedQueuePool),
+            {'poolclass': NullPool}
+        )
+
+    def test_app_engine_uses_settings(self):
+        app = create_app({'DB_POOL_SIZE': 2, 'DB_STATEMENT_TIMEOUT': 1000})
+        with app.app_context():
+            self.assertIsInstance(db.engine.pool, TimedQueuePool)
+            self.assertEqual(db.engine.pool.size(), 2)
+            self.assertEqual(
+                db.session.execute('SHOW statement_timeout').scalar(), '1s'
+            )
+            db.session.remove()
+
+        app.test_client().get('/questions')
+        text = app.test_client().get('/metrics').data.decode('utf-8')
+        self.assertIn('trivia_db_pool_size 2', text)
+        self.assertIn('trivia_db_pool_wait_seconds_total'
+                      '{endpoint="get_questions"}', text)
+        self.assertNotIn('trivia_db_pool_wait_seconds_count 0', text)
+
+    def test_tables_created_by_migrate_only(self):
+        handle, path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        try:
+            app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path})
+            with app.app_context():
+                self.assertEqual(inspect(db.engine).get_table_names(), [])
+                upgrade()
+                self.assertEqual(
+                    sorted(inspect(db.engine).get_table_names()),
+                    ['categories', 'question_signatures', 'questions',
+                     'scores']
+                )
+        finally:
+            os.remove(path)
+
+
+class ReplicaTestCase(unittest.TestCase):
+    """This class represents the read replica routing test case, with a
+    primary and a replica SQLite database holding different questions"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.primary = self.database('primary', 'Primary question')
+        self.replica = self.database('replica', 'Replica question')
+        # Cached bodies would hide where the reads went
+        self.app = self.make_app(RESPONSE_CACHE='off')
+        self.router = self.app.extensions['trivia']['replica_router']
+        self.now = 1000.0
+        self.new_question = {
+            'question': 'New question', 'answer': 'Answer', 'category': 1,
+            'difficulty': 1
+        }
+
+    def tearDown(self):
+        db.session.remove()
+        self.router.close()
+        self.directory.cleanup()
+
+    def clock(self):
+        return self.now
+
+    def make_app(self, **config):
+        config.update({
+            'SQLALCHEMY_DATABASE_URI': self.primary,
+            'DB_REPLICA_URLS': self.replica,
+            'DB_REPLICA_CHECK_INTERVAL': 0,
+            'SEARCH_BACKEND': 'memory',
+        })
+        return create_app(config)
+
+    def database(self, name, question):
+        uri = 'sqlite:///' + os.path.join(self.directory.name, name + '.db')
+        app = create_app({'SQLALCHEMY_DATABASE_URI': uri})
+        with app.app_context():
+            upgrade()
+            db.session.add(Category('Science'))
+            db.session.commit()
+            Question(question, 'Answer', 1, 1).insert()
+            db.session.remove()
+        return uri
+
+    def questions(self, client, path='/questions'):
+        data = json.loads(client.get(path).data)
+        return [question['question'] for question in data['questions']]
+
+    def test_parse_replica_urls(self):
+        self.assertEqual(
+            parse_replica_urls(' sqlite:///a.db, ,postgresql://h/trivia'),
+            ['sqlite:///a.db', 'postgresql://h/trivia']
+        )
+        self.assertEqual(parse_replica_urls(None), [])
+        with self.assertRaises(ValueError):
+            parse_replica_urls('replica')
+
+    def test_reads_go_to_replica(self):
+        client = self.app.test_client()
+        self.assertEqual(self.questions(client), ['Replica question'])
+        self.assertEqual(self.questions(client, '/categories/1/questions'),
+                         ['Replica question'])
+        res = client.post('/quizzes', json={
+            'quiz_category': {'id': 0}, 'previous_questions': []
+        })
+        self.assertEqual(json.loads(res.data)['question']['question'],
+                         'Replica question')
+        self.assertEqual(self.router.stats()['replicas'][0][2], 3)
+
+    def test_read_your_writes(self):
+        writer = self.app.test_client()
+        res = writer.post('/questions', json=self.new_question)
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(PIN_COOKIE, res.headers['Set-Cookie'])
+        self.assertEqual(self.questions(writer),
+                         ['Primary question', 'New question'])
+        self.assertEqual(self.router.stats()['pinned_reads'], 1)
+        # Other clients keep reading the replica
+        self.assertEqual(self.questions(self.app.test_client()),
+                         ['Replica question'])
+        # Until the pin expires
+        self.router.clock = lambda: time.time() + 60
+        self.assertEqual(self.questions(writer), ['Replica question'])
+
+    def test_read_your_writes_off(self):
+        app = self.make_app(RESPONSE_CACHE='off', DB_READ_YOUR_WRITES=0)
+        client = app.test_client()
+        res = client.post('/questions', json=self.new_question)
+        self.assertNotIn('Set-Cookie', res.headers)
+        self.assertEqual(self.questions(client), ['Replica question'])
+        app.extensions['trivia']['replica_router'].close()
+
+    def test_quiz_question_missing_on_replica(self):
+        self.app.test_client().post('/questions', json=self.new_question)
+        res = self.app.test_client().post('/quizzes', json={
+            'quiz_category': {'id': 0}, 'previous_questions': [1]
+        })
+        # Looked up on the primary instead of being skipped as deleted
+        self.assertEqual(json.loads(res.data)['question']['question'],
+                         'New question')
+
+    def test_replica_response_not_cached_after_write(self):
+        app = self.make_app(RESPONSE_CACHE='memory')
+        trivia = app.extensions['trivia']
+        app.test_client().post('/questions', json=self.new_question)
+        self.questions(app.test_client())
+        self.assertEqual(trivia['response_cache'].stats()['entries'], 0)
+        trivia['replica_router'].clock = lambda: time.time() + 60
+        self.questions(app.test_client())
+        self.assertEqual(trivia['response_cache'].stats()['entries'], 1)
+        trivia['replica_router'].close()
+
+    def test_session_routing(self):
+        with self.app.app_context():
+            db.session.info[REPLICA_KEY] = self.router.replicas[0].engine
+            self.assertEqual(Question.query.first().question,
+                             'Replica question')
+            with primary_reads():
+                self.assertEqual(Question.query.first().question,
+                                 'Primary question')
+            self.assertEqual(db.session.info[REPLICA_KEY],
+                             self.router.replicas[0].engine)
+            # After a write the session reads the primary
+            db.session.add(Category('History'))
+            db.session.flush()
+            self.assertEqual(
+                Category.query.order_by(Category.id).all()[-1].type,
+                'History'
+            )
+            db.session.rollback()
+
+    def test_round_robin_and_health(self):
+        missing = os.path.join(self.directory.name, 'missing')
+        engines = [
+            create_engine(self.replica),
+            create_engine('sqlite:///' + os.path.join(missing, 'replica.db')),
+        ]
+        router = ReplicaRouter(engines, check_interval=0)
+        self.assertEqual([router.choose().engine for _ in range(4)],
+                         engines * 2)
+        self.assertEqual(router.check(), 1)
+        self.assertEqual([router.choose().engine for _ in range(3)],
+                         [engines[0]] * 3)
+        router.mark_down(router.replicas[0])
+        self.assertIsNone(router.choose())
+        self.assertEqual(router.stats()['fallbacks'], 1)
+        os.mkdir(missing)
+        self.assertEqual(router.check(), 2)
+        self.assertIsNotNone(router.choose())
+        router.close()
+
+    def test_pin_cookie(self):
+        router = ReplicaRouter([], read_your_writes=5, clock=self.clock)
+        for value in (None, '', 'soon', repr(self.now)):
+            self.assertFalse(router.pinned(value))
+        until = router.wrote()
+        self.assertEqual(until, self.now + 5)
+        self.assertTrue(router.pinned(repr(until)))
+        self.assertTrue(router.stale(object()))
+        self.assertFalse(router.stale(None))
+        self.now += 5
+        self.assertFalse(router.pinned(repr(until)))
+        self.assertFalse(router.stale(object()))
+
+    def test_metrics(self):
+        client = self.app.test_client()
+        client.get('/questions')
+        text = client.get('/metrics').data.decode('utf-8')
+        label = 'replica="{0}"'.format(self.replica)
+        self.assertIn('trivia_db_replica_up{' + label + '} 1', text)
+        self.assertIn('trivia_db_replica_reads_total{' + label + '} 1', text)
+        self.assertIn('trivia_db_replica_fallbacks_total 0', text)
+
+    def test_asgi(self):
+        self.router.close()
+        asgi = create_asgi_app({
+            'SQLALCHEMY_DATABASE_URI': self.primary,
+            'DB_REPLICA_URLS': self.replica,
+            'DB_REPLICA_CHECK_INTERVAL': 0,
+            'RESPONSE_CACHE': 'off',
+            'ASYNC_DB_DRIVER': 'threads',
+        })
+        self.router = asgi.replica_router
+        self.asgi, self.loop = asgi, asyncio.new_event_loop()
+        try:
+            status, _, data = AsgiTestCase.asgi_request(
+                self, 'GET', '/categories/1/questions'
+            )
+            self.assertEqual(json.loads(data)['questions'][0]['question'],
+                             'Replica question')
+            # Pinned clients read the primary
+            cookie = '{0}={1!r}'.format(PIN_COOKIE, time.time() + 60)
+            status, _, data = AsgiTestCase.asgi_request(
+                self, 'GET', '/questions', headers=[('Cookie', cookie)]
+            )
+            self.assertEqual(json.loads(data)['questions'][0]['question'],
+                             'Primary question')
+        finally:
+            self.loop.run_until_complete(asgi.close())
+            self.loop.close()
+
+
+class AsgiTestCase(unittest.TestCase):
+    """This class checks that the ASGI entry point answers like the Flask
+    app, with the asyncpg driver"""
+    driver = 'asyncpg'
+
+    def setUp(self):
+        self.asgi = create_asgi_app({'ASYNC_DB_DRIVER': self.driver})
+        self.client = self.asgi.app.test_client
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.asgi.close())
+        self.loop.close()
+
+    def asgi_request(self, method, path, body=None, headers=()):
+        path, _, query = path.partition('?')
+        raw_headers = [
+            (name.lower().encode(), value.encode()) for name, value in headers
+        ]
+        data = b''
+        if body is not None:
+            data = json.dumps(body).encode()
+            raw_headers.append((b'content-type', b'application/json'))
+        scope = {
+            'type': 'http', 'method': method, 'path': path,
+            'query_string': query.encode(), 'headers': raw_headers,
+            'http_version': '1.1', 'scheme': 'http', 'root_path': '',
+            'server': ('localhost', 80), 'client': ('127.0.0.1', 5000),
+        }
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': data}
+
+        async def send(message):
+            messages.append(message)
+
+        self.loop.run_until_complete(self.asgi(scope, receive, send))
+        headers = dict(
+            (name.decode(), value.decode())
+            for name, value in messages[0]['headers']
+        )
+        return messages[0]['status'], headers, b''.join(
+            message.get('body', b'') for message in messages[1:]
+        )
+
+    def assertSameResponse(self, method, path, body=None, headers=()):
+        status, asgi_headers, data = self.asgi_request(
+            method, path, body, headers
+        )
+        res = self.client().open(
+            path, method=method, json=body, headers=list(headers)
+        )
+        self.assertEqual(status, res.status_code)
+        self.assertEqual(data, res.data)
+        if res.data:
+            self.assertEqual(asgi_headers['content-type'], res.content_type)
+        self.assertEqual(asgi_headers['access-control-allow-origin'], '*')
+        return data
+
+    def test_same_json_as_flask_app(self):
+        paths = [
+            '/categories', '/questions', '/questions?page=2',
+            '/questions?page=999', '/questions?page=x',
+            '/questions?after=5&limit=3', '/questions?after=zz!',
+            '/questions?count=exact', '/questions?question=title',
+            '/categories/1/questions', '/categories/99/questions',
+            '/categories/1/questions?after=0&limit=2', '/nothing-here',
+        ]
+        for path in paths:
+            with self.subTest(path=path):
+                self.assertSameResponse('GET', path)
+        self.assertSameResponse('POST', '/categories')
+
+    def test_async_handler_metrics(self):
+        self.assertEqual(self.asgi.database.name, self.driver)
+        self.asgi_request('GET', '/questions?page=2')
+        stats = self.asgi.metrics.route('get_questions')
+        self.assertEqual(stats.count, 1)
+        self.assertEqual(stats.statements, 1)
+        self.assertGreater(stats.db_seconds, 0)
+
+    def test_unexpected_error(self):
+        def broken():
+            raise RuntimeError('broken')
+        self.asgi.category_cache.response = broken
+        with self.assertLogs(self.asgi.app.logger, 'ERROR'):
+            status, headers, data = self.asgi_request('GET', '/categories')
+        self.assertEqual(status, 500)
+        self.assertEqual(json.loads(data), error_body(500))
+        self.assertIn(
+            'trivia_requests_total{endpoint="get_categories",status="500"} 1',
+            self.asgi.metrics.render()
+        )
+
+    def test_categories_not_modified(self):
+        status, headers, data = self.asgi_request('GET', '/categories')
+        status, headers, data = self.asgi_request(
+            'GET', '/categories',
+            headers=[('If-None-Match', headers['etag'])]
+        )
+        self.assertEqual(status, 304)
+        self.assertEqual(data, b'')
+
+    def test_quiz_same_json_as_flask_app(self):
+        ids = [question.id for question in Question.query.filter(
+            Question.category == 2
+        ).all()]
+        quiz = {
+            'quiz_category': {'id': 2},
+            'previous_questions': ids[1:],
+        }
+        data = json.loads(self.assertSameResponse('POST', '/quizzes', quiz))
+        self.assertEqual(data['question']['id'], ids[0])
+        self.assertSameResponse('POST', '/quizzes', {'quiz_category': None})
+        self.assertSameResponse('POST', '/quizzes', {
+            'quiz_category': {'id': 2}, 'previous_questions': ['x'],
+        })
+        quiz.update({'adaptive': True, 'difficulty': 1})
+        data = json.loads(self.assertSameResponse('POST', '/quizzes', quiz))
+        self.assertEqual(data['difficulty'], 1)
+        quiz['last_answer_correct'] = 'yes'
+        self.assertSameResponse('POST', '/quizzes', quiz)
+        quiz.update({'adaptive': False, 'hide_answer': True})
+        data = json.loads(self.assertSameResponse('POST', '/quizzes', quiz))
+        self.assertNotIn('answer', data['question'])
+
+    def test_quiz_session(self):
+        status, headers, data = self.asgi_request(
+            'POST', '/quizzes/sessions', {'quiz_category': {'id': 2}}
+        )
+        session = json.loads(data)
+        seen = []
+        for _ in range(session['total_questions']):
+            status, headers, data = self.asgi_request(
+                'POST', '/quizzes/sessions/' + session['session']
+            )
+            seen.append(json.loads(data)['question']['id'])
+        status, headers, data = self.asgi_request(
+            'POST', '/quizzes/sessions/' + session['session']
+        )
+        self.assertEqual(json.loads(data), {'success': True, 'question': None})
+        self.assertEqual(sorted(seen), sorted(
+            question.id for question in Question.query.filter(
+                Question.category == 2
+            ).all()
+        ))
+        # Over: the last request ended it
+        self.assertSameResponse(
+            'POST', '/quizzes/sessions/' + session['session']
+        )
+        self.assertSameResponse(
+            'DELETE', '/quizzes/sessions/' + session['session']
+        )
+        status, headers, data = self.asgi_request(
+            'POST', '/quizzes/sessions', {'quiz_category': {'id': 2}}
+        )
+        token = json.loads(data)['session']
+        status, headers, data = self.asgi_request(
+            'DELETE', '/quizzes/sessions/' + token
+        )
+        self.assertEqual(json.loads(data)['deleted'], token)
+        # Sessions of another process
+        self.assertSameResponse('POST', '/quizzes/sessions/other.token')
+
+    def test_writes_served_by_flask_app(self):
+        status, headers, data = self.asgi_request('POST', '/questions', {
+            'question': 'Async?', 'answer': 'zyxwvasync',
+            'category': 1, 'difficulty': 1,
+        })
+        created = json.loads(data)['created']
+        status, headers, data = self.asgi_request(
+            'GET', '/questions?after={0}'.format(created - 1)
+        )
+        self.assertEqual(json.loads(data)['questions'][0]['id'], created)
+        status, headers, data = self.asgi_request(
+            'DELETE', '/questions/{0}'.format(created)
+        )
+        self.assertEqual(status, 200)
+        self.assertNotIn(created, self.asgi.question_pool.ids())
+
+    def test_rate_limit(self):
+        self.loop.run_until_complete(self.asgi.close())
+        self.asgi = create_asgi_app({
+            'ASYNC_DB_DRIVER': self.driver, 'RATE_LIMIT': 'memory',
+            'RATE_LIMITS': 'quizzes=2/60,search=1/60',
+        })
+        quiz = {'quiz_category': {'id': 0}, 'previous_questions': []}
+        statuses = [self.asgi_request('POST', '/quizzes', quiz)[0]
+                    for _ in range(2)]
+        status, headers, data = self.asgi_request('POST', '/quizzes', quiz)
+
+        self.assertEqual(statuses, [200, 200])
+        self.assertEqual(status, 429)
+        self.assertEqual(headers['retry-after'], '30')
+        self.assertEqual(json.loads(data)['error'], 429)
+        # A search handed over to the Flask app is counted once
+        self.assertEqual(
+            self.asgi_request('GET', '/questions?question=title')[0], 200
+        )
+        self.assertEqual(
+            self.asgi_request('GET', '/questions?question=title')[0], 429
+        )
+
+
+class AsgiThreadsTestCase(AsgiTestCase):
+    """This class runs the ASGI checks with the threads driver"""
+    driver = 'threads'
+
+
+class SearchBackendTestCase(unittest.TestCase):
+    """This class represents the search backends test case"""
+
+    def setUp(self):
+        self.app = create_app()
+        self.backends = [PostgresSearch(), InvertedIndexSearch()]
+
+    def search_ids(self, backend, term):
+        results, total = backend.search(term, 0, 100)
+        self.assertEqual(len(results), total)
+        return [question.id for question, score in results]
+
+    def test_ranked_by_weight(self):
+        question = Question(
+            question='Which zyxwv is older?',
+            answer='The zyxwv tree',
+            difficulty=1,
+            category=1
+        )
+        other = Question(
+            question='Which tree is older?',
+            answer='zyxwv',
+            difficulty=1,
+            category=1
+        )
+        question.insert()
+        other.insert()
+        try:
+            for backend in self.backends:
+                with self.subTest(backend=backend.name):
+                    results, total = backend.search('zyx', 0, 10)
+                    self.assertEqual(
+                        [row.id for row, score in results],
+                        [question.id, other.id]
+                    )
+                    self.assertTrue(results[0][1] > results[1][1])
+                    self.assertEqual(
+                        self.search_ids(backend, 'older zyxwv tree'),
+                        [question.id, other.id]
+                    )
+        finally:
+            question.delete()
+            other.delete()
+        for backend in self.backends:
+            with self.subTest(backend=backend.name):
+                self.assertEqual(self.search_ids(backend, 'zyxwv'), [])
+
+    def test_every_word_must_match(self):
+        for backend in self.backends:
+            with self.subTest(backend=backend.name):
+                self.assertTrue(self.search_ids(backend, 'title'))
+                self.assertEqual(
+                    self.search_ids(backend, 'title jacaranda'), []
+                )
+                self.assertEqual(self.search_ids(backend, '?!'), [])
+
+    def test_rolled_back_writes_keep_the_index(self):
+        index = self.backends[1]
+        index.load()
+        question = Question(
+            question='Which zqxjk is older?',
+            answer='The zqxjk tree',
+            difficulty=1,
+            category=1
+        )
+        question.insert()
+        try:
+            question.question = 'Which tree is older?'
+            db.session.flush()
+            db.session.rollback()
+            self.assertEqual(self.search_ids(index, 'zqxjk older'),
+                             [question.id])
+            db.session.delete(question)
+            db.session.flush()
+            db.session.rollback()
+            self.assertEqual(self.search_ids(index, 'zqxjk'), [question.id])
+        finally:
+            question.delete()
+        self.assertEqual(self.search_ids(index, 'zqxjk'), [])
+
+    def test_refresh_while_searching(self):
+        index = self.backends[1]
+        index.load()
+        ensure_loaded = index._ensure_loaded
+
+        def refreshed_after_loading():
+            # As if an import refreshed the index right after this search
+            # loaded it
+            ensure_loaded()
+            index.refresh()
+        index._ensure_loaded = refreshed_after_loading
+        self.assertTrue(self.search_ids(index, 'title'))
+        del index._ensure_loaded
+        loaded_at = index._loaded_at
+        self.assertTrue(self.search_ids(index, 'title'))
+        self.assertGreater(index._loaded_at, loaded_at)
+
+    def test_vector_follows_sql_updates(self):
+        backend = self.backends[0]
+        question = Question(
+            question='Which vwxyz is older?',
+            answer='The vwxyz tree',
+            difficulty=1,
+            category=1
+        )
+        question.insert()
+        try:
+            # Written outside the app: the trigger updates the vector
+            db.session.execute(
+                'UPDATE questions SET answer = :answer WHERE id = :id',
+                {'answer': 'The qrstu tree', 'id': question.id}
+            )
+            db.session.commit()
+            self.assertEqual(
+                self.search_ids(backend, 'qrstu'), [question.id]
+            )
+            self.assertEqual(self.search_ids(backend, 'vwxyz tree'),
+                             [question.id])
+        finally:
+            question.delete()
+
+
+class SerializationTestCase(unittest.TestCase):
+    """This class represents the JSON serialization test case"""
+
+    def setUp(self):
+        self.app = create_app()
+        self.client = self.app.test_client
+
+    def test_stdlib_fallback_matches_orjson(self):
+        data = {'success': True, 'categories': {1: 'Science'}, 'questions': [
+            {'id': 1, 'answer': 'Peñarol', 'category': None}
+        ]}
+        encoded = serialization.dumps(data)
+        orjson = serialization.orjson
+        serialization.orjson = None
+        try:
+            self.assertEqual(json.loads(serialization.dumps(data)),
+                             json.loads(encoded))
+        finally:
+            serialization.orjson = orjson
+        self.assertEqual(json.loads(encoded)['categories'], {'1': 'Science'})
+
+    def test_never_indented(self):
+        self.app.debug = True
+        res = self.client().get('/questions')
+        self.assertNotIn(b'\n', res.data)
+        self.assertEqual(res.content_type, 'application/json')
+
+    def test_rows_format_like_questions(self):
+        questions = Question.query.order_by(Question.id).limit(5).all()
+        rows = db.session.query(*serialization.QUESTION_COLUMNS).order_by(
+            Question.id).limit(5).all()
+        self.assertEqual(serialization.format_rows(rows),
+                         [qt.format() for qt in questions])
+
+    def test_stream_in_batches(self):
+        res = self.client().post('/questions/batch', json={'questions': [{
+            'question': 'Streamed {0}?'.format(i), 'answer': 'yes',
+            'difficulty': 1, 'category': 6,
+        } for i in range(1000)]})
+        created = json.loads(res.data)['created']
+        try:
+            res = self.client().get('/categories/6/questions?stream=true')
+            data = json.loads(res.data)
+            ids = [qt.id for qt in Question.query.filter(
+                Question.category == 6).order_by(Question.id)]
+            self.assertEqual([qt['id'] for qt in data['questions']], ids)
+            self.assertEqual(data['total_questions'], len(ids))
+        finally:
+            self.client().delete('/questions?ids={0}'.format(
+                ','.join(str(i) for i in created)))
+
+
+class PaginationTestCase(unittest.TestCase):
+    """This class represents the pagination helpers test case"""
+
+    def test_cursor_round_trip(self):
+        for question_id in (0, 7, 123456789):
+            cursor = encode_cursor(question_id)
+            self.assertFalse(cursor.isdigit())
+            self.assertEqual(decode_cursor(cursor), question_id)
+        self.assertEqual(decode_cursor('42'), 42)
+        self.assertRaises(ValueError, decode_cursor, 'bm9wZQ')
+
+
+class QueryPlanTestCase(unittest.TestCase):
+    """This class checks that the hot queries can use the indexes"""
+
+    def setUp(self):
+        self.app = create_app()
+        if db.engine.dialect.name != 'postgresql':
+            self.skipTest('query plans need PostgreSQL')
+        upgrade()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def seed(self, rows=20000):
+        """ Adds rows questions of category 1 in the test transaction, and
+            analyzes the table: on the ~20 seeded rows, a scan of the
+            primary key filtering on the category costs as little as the
+            index and the planner may pick either.
+        """
+        db.session.execute(
+            "INSERT INTO questions (question, answer, category, difficulty) "
+            "SELECT 'Plan ' || n || '?', 'yes', 1, 1 "
+            "FROM generate_series(1, :rows) AS n", {'rows': rows}
+        )
+        db.session.execute('ANALYZE questions')
+
+    def plan(self, query):
+        """ EXPLAIN output of query, with sequential scans disabled so the
+            test tables don't hide a missing index.
+        """
+        sql = str(query.statement.compile(
+            dialect=db.engine.dialect,
+            compile_kwargs={'literal_binds': True}
+        ))
+        db.session.execute('SET LOCAL enable_seqscan = off')
+        rows = db.session.execute('EXPLAIN ' + sql)
+        return '\n'.join(row[0] for row in rows)
+
+    def test_category_index_exists(self):
+        definition = db.session.execute(
+            "SELECT indexdef FROM pg_indexes "
+            "WHERE indexname = 'ix_questions_category_id'"
+        ).scalar()
+        self.assertIn('(category, id)', definition)
+
+    def test_category_listing_uses_index(self):
+        self.seed()
+        query = Question.query.filter(
+            Question.category == 2
+        ).order_by(Question.id).limit(10)
+        plan = self.plan(query)
+        self.assertIn('ix_questions_category_id', plan)
+        self.assertNotIn('Sort', plan)
+
+    def test_category_keyset_page_uses_index(self):
+        self.seed()
+        query = Question.query.filter(
+            Question.category == 2, Question.id > 5
+        ).order_by(Question.id).limit(10)
+        plan = self.plan(query)
+        self.assertIn('ix_questions_category_id', plan)
+        self.assertNotIn('Sort', plan)
+
+    def test_question_by_id_uses_primary_key(self):
+        plan = self.plan(Question.query.filter(Question.id == 5))
+        self.assertIn('questions_pkey', plan)
+
+
 # Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()
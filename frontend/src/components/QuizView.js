@@ -16,6 +16,8 @@ class QuizView extends Component {
         numCorrect: 0,
         currentQuestion: {},
         guess: '',
+        correct: false,
+        answer: '',
         forceEnd: false
     }
   }
@@ -54,7 +56,8 @@ class QuizView extends Component {
       contentType: 'application/json',
       data: JSON.stringify({
         previous_questions: previousQuestions,
-        quiz_category: this.state.quizCategory
+        quiz_category: this.state.quizCategory,
+        hide_answer: true
       }),
       xhrFields: {
         withCredentials: true
@@ -79,11 +82,32 @@ class QuizView extends Component {
 
   submitGuess = (event) => {
     event.preventDefault();
-    const formatGuess = this.state.guess.replace(/[.,\/#!$%\^&\*;:{}=\-_`~()]/g,"").toLowerCase()
-    let evaluate =  this.evaluateAnswer()
-    this.setState({
-      numCorrect: !evaluate ? this.state.numCorrect : this.state.numCorrect + 1,
-      showAnswer: true,
+    $.ajax({
+      url: '/quizzes/answer',
+      type: "POST",
+      dataType: 'json',
+      contentType: 'application/json',
+      data: JSON.stringify({
+        question_id: this.state.currentQuestion.id,
+        answer: this.state.guess
+      }),
+      xhrFields: {
+        withCredentials: true
+      },
+      crossDomain: true,
+      success: (result) => {
+        this.setState({
+          numCorrect: !result.correct ? this.state.numCorrect : this.state.numCorrect + 1,
+          correct: result.correct,
+          answer: result.answer,
+          showAnswer: true,
+        })
+        return;
+      },
+      error: (error) => {
+        alert('Unable to check the answer. Please try your request again')
+        return;
+      }
     })
   }
 
@@ -95,6 +119,8 @@ class QuizView extends Component {
       numCorrect: 0,
       currentQuestion: {},
       guess: '',
+      correct: false,
+      answer: '',
       forceEnd: false
     })
   }
@@ -140,20 +166,13 @@ class QuizView extends Component {
     )
   }
 
-  evaluateAnswer = () => {
-    const formatGuess = this.state.guess.replace(/[.,\/#!$%\^&\*;:{}=\-_`~()]/g,"").toLowerCase()
-    const answerArray = this.state.currentQuestion.answer.toLowerCase().split(' ');
-    return answerArray.includes(formatGuess)
-  }
-
   renderCorrectAnswer(){
-    const formatGuess = this.state.guess.replace(/[.,\/#!$%\^&\*;:{}=\-_`~()]/g,"").toLowerCase()
-    let evaluate =  this.evaluateAnswer()
+    let evaluate = this.state.correct
     return(
       <div className="quiz-play-holder">
         <div className="quiz-question">{this.state.currentQuestion.question}</div>
         <div className={`${evaluate ? 'correct' : 'wrong'}`}>{evaluate ? "You were correct!" : "You were incorrect"}</div>
-        <div className="quiz-answer">{this.state.currentQuestion.answer}</div>
+        <div className="quiz-answer">{this.state.answer}</div>
         <br />
         <button type="submit" 
           className="pure-button pure-button-primary"
@@ -1,8 +1,10 @@
 import React, { Component } from 'react'
+import $ from 'jquery';
 
 class Search extends Component {
   state = {
     query: '',
+    suggestions: [],
   }
 
   getInfo = (event) => {
@@ -14,6 +16,32 @@ class Search extends Component {
     this.setState({
       query: this.search.value
     })
+    this.getSuggestions(this.search.value)
+  }
+
+  getSuggestions = (query) => {
+    // Only the last request is shown: the others are cancelled
+    if (this.suggestRequest) {
+      this.suggestRequest.abort()
+    }
+    this.suggestRequest = $.ajax({
+      url: '/questions/suggest',
+      type: "GET",
+      data: { prefix: query },
+      dataType: 'json',
+      success: (result) => {
+        this.setState({ suggestions: result.suggestions })
+        return;
+      },
+      error: (xhr, textStatus) => {
+        // Aborted by a newer keystroke, whose suggestions will follow
+        if (textStatus === 'abort') {
+          return;
+        }
+        this.setState({ suggestions: [] })
+        return;
+      }
+    })
   }
 
   render() {
@@ -24,7 +52,14 @@ class Search extends Component {
             placeholder="Search questions..."
             ref={input => this.search = input}
             onChange={this.handleInputChange}
+            list="search-suggestions"
+            autoComplete="off"
           /> &nbsp;
+          <datalist id="search-suggestions">
+            {this.state.suggestions.map((suggestion) => (
+              <option key={suggestion} value={suggestion}/>
+            ))}
+          </datalist>
           <button type="submit" class="pure-button pure-button-primary">
             Search
           </button>